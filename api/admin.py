@@ -41,16 +41,12 @@ class CommunityAdmin(admin.ModelAdmin):
     list_display = ('name', 'created_by', 'location', 'created_at', 'member_count', 'is_public')
     list_filter = ('is_public', 'created_at', 'location')
     search_fields = ('name', 'bio', 'created_by__username', 'created_by__email')
-    readonly_fields = ('created_at', 'invite_link')
+    readonly_fields = ('created_at', 'invite_link', 'member_count')
     inlines = [CommunityMemberInline, ChannelInline]
-    
-    def member_count(self, obj):
-        return obj.members.count()
-    member_count.short_description = 'Members'
 
 class CommunityMemberAdmin(admin.ModelAdmin):
-    list_display = ('user', 'community', 'role', 'joined_at', 'is_online')
-    list_filter = ('role', 'is_online', 'joined_at', 'community')
+    list_display = ('user', 'community', 'role', 'joined_at')
+    list_filter = ('role', 'joined_at', 'community')
     search_fields = ('user__username', 'user__email', 'community__name')
     raw_id_fields = ('user', 'community')
 
@@ -99,13 +95,9 @@ class EventAdmin(admin.ModelAdmin):
     list_display = ('name', 'community', 'date', 'time', 'location', 'created_by', 'created_at', 'participant_count')
     list_filter = ('date', 'created_at', 'community')
     search_fields = ('name', 'description', 'community__name', 'created_by__username')
-    readonly_fields = ('created_at',)
+    readonly_fields = ('created_at', 'participant_count')
     raw_id_fields = ('community', 'channel', 'created_by')
     inlines = [EventParticipantInline]
-    
-    def participant_count(self, obj):
-        return obj.participants.count()
-    participant_count.short_description = 'Participants'
 
 class EventParticipantAdmin(admin.ModelAdmin):
     list_display = ('user', 'event', 'joined_at')
@@ -0,0 +1,407 @@
+# api/bench.py
+"""
+Load generation and latency measurement for the chat websockets.
+
+A run opens CLIENTS chat sockets spread evenly over CHANNELS channels of a
+throwaway bench community (room size = CLIENTS / CHANNELS). In every
+channel SENDERS clients each send MESSAGES chat messages, wrapped in
+typing_start/typing_stop, at RATE messages per second, and every client
+answers each READ_EVERY-th message it receives with a message_read frame.
+Chat messages carry their send time, so each delivery to each member is
+one fan-out latency sample.
+
+Two transports are supported:
+
+- `communicator`: channels' WebsocketCommunicator against the ASGI
+  application in this process. There is no network, so this measures the
+  consumers, the channel layer and encoding.
+- `socket`: real websockets against a Daphne process started on a free
+  local port, or against an already running server given by url. This
+  needs the `websockets` package.
+
+The report has connect time, p50/p99/max fan-out latency, messages and
+deliveries per second, lost deliveries and memory per connection. Memory
+is traced Python allocations for `communicator` (client side included)
+and the server's RSS growth for a locally started server.
+
+Bench users, community and channels are created in the configured
+database and deleted afterwards, so point it at a development database
+(and, for `socket` with a url, at the one that server uses). Runs can be
+stored as named baselines in a JSON file and compared against later; see
+the bench_websockets management command.
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+from django.conf import settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import Channel, Community, CommunityMember, User
+
+MESSAGE_PREFIX = 'bench:'
+CONNECT_CONCURRENCY = 200
+
+# Result fields compared against a baseline, and whether lower is better
+COMPARED = {
+    'p50_ms': True,
+    'p99_ms': True,
+    'deliveries_per_sec': False,
+    'memory_per_connection_kb': True,
+}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+class BenchFixture:
+    """Bench users, a community and its channels, removed by delete()"""
+    def __init__(self, clients, channels):
+        self.run_id = uuid.uuid4().hex[:8]
+        self.clients = clients
+        self.channel_count = channels
+        self.users = []
+        self.channels = []
+        self.community = None
+
+    def create(self):
+        prefix = f'bench-{self.run_id}'
+        users = [
+            User(
+                username=f'{prefix}-{index}',
+                email=f'{prefix}-{index}@bench.invalid',
+                first_name='Bench',
+                last_name=str(index),
+                password='!',  # unusable; the bench authenticates with tokens
+            )
+            for index in range(self.clients)
+        ]
+        self.users = User.objects.bulk_create(users, batch_size=1000)
+        self.community = Community.objects.create(
+            name=prefix, bio='Websocket benchmark', location='bench', created_by=self.users[0]
+        )
+        CommunityMember.objects.bulk_create(
+            [CommunityMember(community=self.community, user=user) for user in self.users],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        self.channels = [
+            Channel.objects.create(community=self.community, name=f'{prefix}-{index}', created_by=self.users[0])
+            for index in range(self.channel_count)
+        ]
+        return [
+            (self.channels[index % self.channel_count], str(AccessToken.for_user(user)))
+            for index, user in enumerate(self.users)
+        ]
+
+    def delete(self):
+        # Cascades to the community, channels, memberships and messages
+        User.objects.filter(username__startswith=f'bench-{self.run_id}-').delete()
+
+
+class CommunicatorTransport:
+    name = 'communicator'
+
+    def __init__(self, application=None):
+        if application is None:
+            from backend.asgi import application
+        self.application = application
+
+    async def open(self, channel, token):
+        from channels.testing import WebsocketCommunicator
+
+        communicator = WebsocketCommunicator(self.application, f'/ws/chat/{channel.id.hex}/?token={token}')
+        connected, _ = await communicator.connect(timeout=30)
+        if not connected:
+            raise ConnectionError(f'Connection to channel {channel.id} was refused')
+        return CommunicatorConnection(communicator)
+
+    def memory(self):
+        return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+
+    def start_memory(self):
+        tracemalloc.start()
+
+    def stop_memory(self):
+        tracemalloc.stop()
+
+
+class CommunicatorConnection:
+    def __init__(self, communicator):
+        self.communicator = communicator
+
+    async def send(self, data):
+        await self.communicator.send_json_to(data)
+
+    async def recv(self):
+        return await self.communicator.receive_json_from(timeout=3600)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketTransport:
+    name = 'socket'
+
+    def __init__(self, url, server=None):
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            raise RuntimeError('The socket mode needs the websockets package')
+        self.url = url.rstrip('/')
+        self.server = server
+
+    async def open(self, channel, token):
+        from websockets.asyncio.client import connect
+
+        connection = await connect(
+            f'{self.url}/ws/chat/{channel.id.hex}/?token={token}',
+            subprotocols=['circleup.json'],
+            open_timeout=30,
+            max_queue=None,
+        )
+        return SocketConnection(connection)
+
+    def memory(self):
+        return self.server.rss() if self.server is not None else None
+
+    def start_memory(self):
+        pass
+
+    def stop_memory(self):
+        pass
+
+
+class SocketConnection:
+    def __init__(self, connection):
+        self.connection = connection
+
+    async def send(self, data):
+        await self.connection.send(json.dumps(data))
+
+    async def recv(self):
+        return json.loads(await self.connection.recv())
+
+    async def close(self):
+        await self.connection.close()
+
+
+class DaphneServer:
+    """The project's ASGI application served by Daphne on a free local port"""
+    def __init__(self, host='127.0.0.1', port=None):
+        self.host = host
+        self.port = port or self.free_port(host)
+        self.process = None
+
+    @staticmethod
+    def free_port(host):
+        with socket.socket() as sock:
+            sock.bind((host, 0))
+            return sock.getsockname()[1]
+
+    @property
+    def url(self):
+        return f'ws://{self.host}:{self.port}'
+
+    def start(self, timeout=30):
+        module, attribute = settings.ASGI_APPLICATION.rsplit('.', 1)
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'daphne', '-b', self.host, '-p', str(self.port), f'{module}:{attribute}'],
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings')},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Daphne exited with status {self.process.returncode}')
+            try:
+                socket.create_connection((self.host, self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f'Daphne did not start listening on {self.host}:{self.port}')
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+    def rss(self):
+        """Resident memory of the server process in bytes (Linux only)"""
+        try:
+            with open(f'/proc/{self.process.pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, AttributeError):
+            pass
+        return None
+
+
+class BenchStats:
+    def __init__(self, expected):
+        self.expected = expected
+        self.sent = 0
+        self.delivered = 0
+        self.reads = 0
+        self.latencies = []
+        self.done = asyncio.Event()
+        if expected == 0:
+            self.done.set()
+
+    def delivery(self, latency_ms):
+        self.delivered += 1
+        if latency_ms is not None:
+            self.latencies.append(latency_ms)
+        if self.delivered >= self.expected:
+            self.done.set()
+
+
+async def listen(connection, stats, read_every):
+    received = 0
+    while True:
+        data = await connection.recv()
+        if data.get('type') != 'chat_message':
+            continue
+        text = data['message']['message']
+        latency = None
+        if text.startswith(MESSAGE_PREFIX):
+            latency = (time.perf_counter_ns() - int(text[len(MESSAGE_PREFIX):])) / 1e6
+        stats.delivery(latency)
+        received += 1
+        if read_every and received % read_every == 0:
+            await connection.send({'type': 'message_read', 'message_id': data['message']['id']})
+            stats.reads += 1
+
+
+async def send_messages(connection, stats, messages, rate):
+    interval = 1 / rate if rate else 0
+    for _ in range(messages):
+        await connection.send({'type': 'typing_start'})
+        await connection.send({'type': 'chat_message', 'message': f'{MESSAGE_PREFIX}{time.perf_counter_ns()}'})
+        await connection.send({'type': 'typing_stop'})
+        stats.sent += 1
+        if interval:
+            await asyncio.sleep(interval)
+
+
+async def run_bench(transport, assignments, senders=1, messages=20, rate=10.0, read_every=5, drain_timeout=30.0):
+    """
+    Run the workload over `assignments` ([(channel, token)] from
+    BenchFixture.create()) and return the result dict.
+    """
+    members = {}
+    for channel, _ in assignments:
+        members[channel.id] = members.get(channel.id, 0) + 1
+    senders_per_channel = {channel_id: min(senders, count) for channel_id, count in members.items()}
+    stats = BenchStats(sum(
+        senders_per_channel[channel_id] * messages * count for channel_id, count in members.items()
+    ))
+
+    transport.start_memory()
+    memory_before = transport.memory()
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def open_connection(channel, token):
+        async with semaphore:
+            return await transport.open(channel, token)
+
+    connect_started = time.perf_counter()
+    connections = await asyncio.gather(*[open_connection(channel, token) for channel, token in assignments])
+    connect_seconds = time.perf_counter() - connect_started
+    memory_after = transport.memory()
+    transport.stop_memory()
+
+    listeners = [asyncio.ensure_future(listen(connection, stats, read_every)) for connection in connections]
+    sending, assigned = [], {}
+    for (channel, _), connection in zip(assignments, connections):
+        if assigned.get(channel.id, 0) < senders_per_channel[channel.id]:
+            assigned[channel.id] = assigned.get(channel.id, 0) + 1
+            sending.append(send_messages(connection, stats, messages, rate))
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*sending)
+        try:
+            await asyncio.wait_for(stats.done.wait(), drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        duration = time.perf_counter() - started
+    finally:
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+        await asyncio.gather(*[connection.close() for connection in connections], return_exceptions=True)
+
+    memory_per_connection = None
+    if memory_before is not None and memory_after is not None and connections:
+        memory_per_connection = round((memory_after - memory_before) / len(connections) / 1024, 1)
+    rounded = lambda value: round(value, 2) if value is not None else None
+    return {
+        'mode': transport.name,
+        'clients': len(assignments),
+        'channels': len(members),
+        'room_size': max(members.values(), default=0),
+        'connect_seconds': round(connect_seconds, 2),
+        'messages_sent': stats.sent,
+        'deliveries': stats.delivered,
+        'expected_deliveries': stats.expected,
+        'lost': stats.expected - stats.delivered,
+        'reads_sent': stats.reads,
+        'duration_seconds': round(duration, 2),
+        'messages_per_sec': round(stats.sent / duration, 1) if duration else None,
+        'deliveries_per_sec': round(stats.delivered / duration, 1) if duration else None,
+        'p50_ms': rounded(percentile(stats.latencies, 50)),
+        'p99_ms': rounded(percentile(stats.latencies, 99)),
+        'max_ms': rounded(max(stats.latencies, default=None)),
+        'memory_per_connection_kb': memory_per_connection,
+    }
+
+
+def scenario_name(result):
+    return f"{result['mode']}-{result['clients']}c-{result['channels']}ch"
+
+
+def load_baselines(path):
+    try:
+        with open(path) as baselines:
+            return json.load(baselines)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path, name, result):
+    baselines = load_baselines(path)
+    baselines[name] = result
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as out:
+        json.dump(baselines, out, indent=2, sort_keys=True)
+
+
+def compare(result, baseline, tolerance):
+    """Regressions of `result` against `baseline` beyond `tolerance` (a fraction)"""
+    regressions = []
+    for field, lower_is_better in COMPARED.items():
+        current, previous = result.get(field), baseline.get(field)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (change if lower_is_better else -change) > tolerance:
+            regressions.append(f'{field}: {previous} -> {current} ({change:+.0%})')
+    if result['lost'] > baseline.get('lost', 0):
+        regressions.append(f"lost: {baseline.get('lost', 0)} -> {result['lost']}")
+    return regressions
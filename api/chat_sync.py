@@ -0,0 +1,62 @@
+# api/chat_sync.py
+"""
+Incremental chat sync over per-channel sequence numbers.
+
+Every write to a ChatMessage takes the next number from its channel's
+`last_seq` (see ChatMessage.save): a new message gets it as both `seq` and
+`change_seq`, an edit, delete or reaction only moves `change_seq` forward. Deleted
+messages stay behind as tombstones (is_deleted, text cleared) so clients
+can drop them locally.
+
+A client keeps the `last_seq` of its previous sync and asks for
+`?after=<last_seq>`, getting just the new, edited and deleted messages in
+change order; `?before=<seq>` pages back through older history.
+"""
+
+
+class ChatSyncService:
+    @staticmethod
+    def queryset(channel):
+        return channel.chat_messages.select_related('user', 'channel').prefetch_related('reactions', 'mentions')
+
+    @staticmethod
+    def changes(channel, after, limit=50):
+        """
+        Messages created, edited or deleted after `after`, oldest change
+        first. Returns (messages, has_more, last_seq) where last_seq is the
+        cursor for the next call.
+        """
+        # Read before the rows: every change up to here is already committed
+        channel_seq = channel.last_seq
+        messages = list(
+            ChatSyncService.queryset(channel).filter(change_seq__gt=after).order_by('change_seq')[:limit + 1]
+        )
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        last_seq = messages[-1].change_seq if messages else after
+        if not has_more:
+            last_seq = max(last_seq, channel_seq)
+        return messages, has_more, last_seq
+
+    @staticmethod
+    def history(channel, before=None, limit=50):
+        """
+        Up to `limit` live messages before seq `before` (the latest ones when
+        None), oldest first. Returns (messages, has_more, last_seq) where
+        last_seq is where a following `changes()` call should start.
+        """
+        channel_seq = channel.last_seq
+        queryset = ChatSyncService.queryset(channel).filter(is_deleted=False)
+        if before is not None:
+            queryset = queryset.filter(seq__lt=before)
+        messages = list(queryset.order_by('-seq')[:limit + 1])
+        has_more = len(messages) > limit
+        return messages[:limit][::-1], has_more, channel_seq
+
+    @staticmethod
+    def tombstone(message):
+        """Soft-delete a message, recording the delete as a change"""
+        message.is_deleted = True
+        message.message = ''
+        message.save(update_fields=['is_deleted', 'message', 'updated_at'])
+        return message
@@ -0,0 +1,136 @@
+# api/chat_writer.py
+"""
+Write-behind persistence for chat messages received over websockets.
+
+ChatConsumer builds ChatMessage instances with pre-assigned UUIDs and
+timestamps, broadcasts them right away and hands them to this per-process
+writer. A background thread collects messages for up to FLUSH_INTERVAL
+seconds (or BATCH_SIZE messages) and saves each batch with a single
+bulk_create, so a burst of chat costs a few INSERTs instead of one thread
+pool hop and one write transaction per message. The queue is bounded;
+when it is full submit() returns False and the caller writes through.
+Pending messages are flushed at interpreter exit.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from functools import lru_cache
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from .models import ChatMessage
+from .search import SearchService
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 0.05,  # seconds
+    'MAX_QUEUE': 10000,
+}
+
+
+def writer_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_WRITER', {})}
+
+
+class ChatMessageWriter:
+    def __init__(self, batch_size, flush_interval, max_queue):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def submit(self, message):
+        """Queue an unsaved ChatMessage; False if the queue is full"""
+        self.start()
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            logger.warning("Chat writer queue full, writing message through")
+            return False
+
+    def flush(self):
+        """Block until every queued message has been written"""
+        if self._thread is not None:
+            self.queue.join()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not (self._stopping.is_set() and self.queue.empty()):
+            batch = self._collect()
+            if batch:
+                try:
+                    self._write(batch)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+
+    def _collect(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        close_old_connections()
+        try:
+            with transaction.atomic():
+                self._assign_seqs(batch)
+                ChatMessage.objects.bulk_create(batch)
+            SearchService.index_many(batch)
+        except Exception as e:
+            # Fall back to one-by-one so a single bad row (e.g. a channel
+            # deleted mid-burst) does not lose the rest of the batch
+            logger.warning(f"Chat batch write of {len(batch)} messages failed, retrying singly: {e}")
+            for message in batch:
+                try:
+                    message.seq = None
+                    message.save(force_insert=True)
+                except Exception as e:
+                    logger.error(f"Dropping chat message {message.id}: {e}")
+        finally:
+            close_old_connections()
+
+    def _assign_seqs(self, batch):
+        # bulk_create bypasses ChatMessage.save, so reserve one block of
+        # sequence numbers per channel and hand them out in arrival order
+        by_channel = {}
+        for message in batch:
+            by_channel.setdefault(message.channel_id, []).append(message)
+        for channel_id, messages in by_channel.items():
+            first = ChatMessage.allocate_seqs(channel_id, len(messages))
+            for seq, message in enumerate(messages, start=first):
+                message.seq = message.change_seq = seq
+
+
+@lru_cache(maxsize=None)
+def get_chat_writer():
+    config = writer_settings()
+    return ChatMessageWriter(config['BATCH_SIZE'], config['FLUSH_INTERVAL'], config['MAX_QUEUE'])
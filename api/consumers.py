@@ -1,31 +1,68 @@
 # api/consumers.py
-import json
+import uuid
+from urllib.parse import parse_qs
+from django.core.exceptions import ValidationError
+from django.utils import timezone
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import Channel, CommunityMember, ChatMessage
+from .models import Channel, ChatMessage
+from .chat_writer import get_chat_writer, writer_settings
+from .typing import get_typing_tracker
+from .presence import PresenceService, channel_scope, community_scope
+from .replay import ReplayService, chat_message_event, event_id, replay_settings
+from .framing import FramedConsumerMixin, encode_event
+from .read_cursors import get_read_cursor_writer
+from .memberships import MembershipService
+from .notification_counts import UnreadCountService
 from asgiref.sync import sync_to_async
 
-class ChatConsumer(AsyncWebsocketConsumer):
+# Presence stores may do network I/O (Redis); keep it off the event loop
+presence_connect = sync_to_async(PresenceService.connect, thread_sensitive=False)
+presence_disconnect = sync_to_async(PresenceService.disconnect, thread_sensitive=False)
+presence_heartbeat = sync_to_async(PresenceService.heartbeat, thread_sensitive=False)
+replay_record = sync_to_async(ReplayService.record, thread_sensitive=False)
+replay_events = sync_to_async(ReplayService.events, thread_sensitive=False)
+
+class ChatConsumer(FramedConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
-        self.channel_id = self.scope['url_route']['kwargs']['channel_id']
+        # Canonical form, so clients may use either UUID spelling and REST
+        # sends (NotificationService.send_chat_notification) reach the group
+        try:
+            self.channel_id = str(uuid.UUID(self.scope['url_route']['kwargs']['channel_id']))
+        except ValueError:
+            await self.close()
+            return
         self.room_group_name = f'chat_{self.channel_id}'
         
         # Check if user has access to this channel
         if await self.has_channel_access():
+            # Ids sent by replay_missed(); their live copies are skipped
+            self.replayed_ids = set()
             await self.channel_layer.group_add(
                 self.room_group_name,
                 self.channel_name
             )
-            await self.accept()
+            await self.accept_framed()
+            
+            self.presence_scopes = [
+                channel_scope(self.channel.id),
+                community_scope(self.channel.community_id),
+            ]
+            await presence_connect(self.presence_scopes, self.scope["user"].id)
+            
+            # Reconnecting clients pass the id of the last message they saw
+            last_seen = parse_qs(self.scope.get('query_string', b'').decode()).get('last_seen')
+            if last_seen:
+                await self.replay_missed(last_seen[0])
             
             # Notify others that user joined
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
+                encode_event({
                     'type': 'user_joined',
                     'user_id': str(self.scope["user"].id),
                     'username': self.scope["user"].username
-                }
+                })
             )
         else:
             await self.close()
@@ -36,19 +73,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
+            await get_typing_tracker().stop(self.room_group_name, str(self.scope["user"].id))
+            if hasattr(self, 'presence_scopes'):
+                await presence_disconnect(self.presence_scopes, self.scope["user"].id)
             
             # Notify others that user left
             await self.channel_layer.group_send(
                 self.room_group_name,
-                {
+                encode_event({
                     'type': 'user_left', 
                     'user_id': str(self.scope["user"].id),
                     'username': self.scope["user"].username
-                }
+                })
             )
     
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = self.decode_frame(text_data, bytes_data)
         message_type = text_data_json.get('type', 'chat_message')
         
         if message_type == 'chat_message':
@@ -59,104 +99,145 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.handle_typing_stop()
         elif message_type == 'message_read':
             await self.handle_message_read(text_data_json)
+        elif message_type == 'heartbeat':
+            await presence_heartbeat(self.presence_scopes, self.scope["user"].id)
     
     async def handle_chat_message(self, data):
-        # Save message to database
+        # Save message to database (write-behind, the id is assigned here)
         message = await self.save_message(data['message'])
+        await get_typing_tracker().stop(self.room_group_name, str(self.scope["user"].id))
         
-        # Broadcast to room group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': {
-                    'id': str(message.id),
-                    'user_id': str(self.scope["user"].id),
-                    'username': self.scope["user"].username,
-                    'profile_pic': await self.get_user_profile_pic(),
-                    'message': data['message'],
-                    'timestamp': message.created_at.isoformat(),
-                    'type': 'chat_message'
-                }
-            }
-        )
+        # Broadcast to room group, encoded once for every recipient, keeping
+        # a copy for reconnecting clients
+        event = chat_message_event(message)
+        await replay_record(self.room_group_name, event)
+        await self.channel_layer.group_send(self.room_group_name, encode_event(event))
     
+    async def replay_missed(self, last_seen):
+        # Replay from the ring buffer when it still holds last_seen, else
+        # from the database; too big a gap means a REST resync
+        buffered = await replay_events(self.room_group_name)
+        events = ReplayService.since(buffered, last_seen)
+        if events is None:
+            events = await self.get_missed_events(last_seen, buffered)
+        if events is None:
+            await self.send_event({'type': 'resync_required'})
+            return
+        for event in events:
+            await self.send_event(event)
+        # The group was joined before the buffer was read, so messages sent
+        # in between arrive live as well
+        self.replayed_ids = {event_id(event) for event in events}
+    
+    # Typing frames are coalesced into one `typing_users` roster per room per
+    # tick by api/typing.py rather than broadcast one by one
     async def handle_typing_start(self):
-        await self.channel_layer.group_send(
+        await get_typing_tracker().start(
             self.room_group_name,
-            {
-                'type': 'user_typing',
-                'user_id': str(self.scope["user"].id),
-                'username': self.scope["user"].username,
-                'typing': True
-            }
+            str(self.scope["user"].id),
+            self.scope["user"].username
         )
     
     async def handle_typing_stop(self):
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_typing', 
-                'user_id': str(self.scope["user"].id),
-                'username': self.scope["user"].username,
-                'typing': False
-            }
-        )
+        await get_typing_tracker().stop(self.room_group_name, str(self.scope["user"].id))
     
     async def handle_message_read(self, data):
+        # Persisted in batches by the read cursor writer; the broadcast is
+        # for read receipts. Malformed or negative positions are ignored.
+        if not get_read_cursor_writer().record(
+            self.scope["user"].id, self.channel.id,
+            seq=data.get('seq'), message_id=data.get('message_id')
+        ):
+            return
         await self.channel_layer.group_send(
             self.room_group_name,
-            {
+            encode_event({
                 'type': 'message_read',
                 'user_id': str(self.scope["user"].id),
                 'username': self.scope["user"].username,
-                'message_id': data['message_id']
-            }
+                'message_id': data.get('message_id')
+            })
         )
     
-    # WebSocket event handlers
+    # WebSocket event handlers; group events arrive pre-encoded (api/framing.py)
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps(event))
+        if event.get('message_id') in self.replayed_ids:
+            self.replayed_ids.discard(event['message_id'])
+            return
+        await self.send_event(event)
     
     async def user_joined(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
     
     async def user_left(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
     
     async def user_typing(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
+    
+    async def typing_users(self, event):
+        await self.send_event(event)
     
     async def message_read(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
     
     @database_sync_to_async
     def has_channel_access(self):
+        if not self.scope["user"].is_authenticated:
+            return False
         try:
-            channel = Channel.objects.get(id=self.channel_id)
-            return CommunityMember.objects.filter(
-                community=channel.community,
-                user=self.scope["user"]
-            ).exists()
+            # Resolved once and kept for the lifetime of the connection
+            self.channel = Channel.objects.get(id=self.channel_id)
+            return MembershipService.is_member(self.scope["user"], self.channel.community_id)
         except Channel.DoesNotExist:
             return False
     
-    @database_sync_to_async 
-    def save_message(self, message_text):
-        channel = Channel.objects.get(id=self.channel_id)
-        message = ChatMessage.objects.create(
-            channel=channel,
+    @database_sync_to_async
+    def get_missed_events(self, last_seen, buffered):
+        try:
+            last_seen = uuid.UUID(last_seen)
+        except ValueError:
+            return None
+        seen_seq = ChatMessage.objects.filter(
+            id=last_seen, channel_id=self.channel.id
+        ).values_list('seq', flat=True).first()
+        if seen_seq is None:
+            return None
+        
+        max_replay = replay_settings()['MAX_REPLAY']
+        messages = list(
+            ChatMessage.objects.filter(channel_id=self.channel.id, seq__gt=seen_seq, is_deleted=False)
+            .select_related('user').order_by('seq')[:max_replay + 1]
+        )
+        if len(messages) > max_replay:
+            return None
+        events = [chat_message_event(message) for message in messages]
+        
+        # Messages still queued in the chat writer are only in the buffer
+        sent = {event_id(event) for event in events}
+        written = {
+            str(pk) for pk in ChatMessage.objects.filter(
+                id__in=[event_id(event) for event in buffered]
+            ).values_list('id', flat=True)
+        }
+        return events + [
+            event for event in buffered
+            if event_id(event) not in sent and event_id(event) not in written
+        ]
+    
+    async def save_message(self, message_text):
+        message = ChatMessage(
+            id=uuid.uuid4(),
+            channel=self.channel,
             user=self.scope["user"],
-            message=message_text
+            message=message_text,
+            created_at=timezone.now()
         )
+        if not writer_settings()['ENABLED'] or not get_chat_writer().submit(message):
+            await database_sync_to_async(message.save)(force_insert=True)
         return message
-    
-    @database_sync_to_async
-    def get_user_profile_pic(self):
-        user = self.scope["user"]
-        return user.profile_pic.url if user.profile_pic else None
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(FramedConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
         if self.scope["user"].is_authenticated:
             self.user_id = str(self.scope["user"].id)
@@ -166,7 +247,11 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
-            await self.accept()
+            await self.accept_framed()
+            
+            # The app-wide socket makes the user online in all their communities
+            self.presence_scopes = await self.get_presence_scopes()
+            await presence_connect(self.presence_scopes, self.user_id)
         else:
             await self.close()
     
@@ -176,23 +261,43 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
+        if hasattr(self, 'presence_scopes'):
+            await presence_disconnect(self.presence_scopes, self.user_id)
     
     async def user_notification(self, event):
         """Handle user-specific notifications"""
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
     
-    async def receive(self, text_data):
+    async def notification_updated(self, event):
+        """An aggregated notification took another actor"""
+        await self.send_event(event)
+    
+    async def unread_count(self, event):
+        """The badge count changed"""
+        await self.send_event(event)
+    
+    async def receive(self, text_data=None, bytes_data=None):
         # User can mark notifications as read via WebSocket
-        data = json.loads(text_data)
+        data = self.decode_frame(text_data, bytes_data)
         if data.get('type') == 'mark_read':
             await self.mark_notification_read(data['notification_id'])
+        elif data.get('type') == 'heartbeat':
+            await presence_heartbeat(self.presence_scopes, self.user_id)
+    
+    @database_sync_to_async
+    def get_presence_scopes(self):
+        community_ids = MembershipService.community_ids(self.scope["user"])
+        return [community_scope(community_id) for community_id in community_ids]
     
     @database_sync_to_async
     def mark_notification_read(self, notification_id):
         from .models import Notification
         try:
-            notification = Notification.objects.get(id=notification_id, user=self.scope["user"])
-            notification.is_read = True
-            notification.save()
-        except Notification.DoesNotExist:
-            pass
\ No newline at end of file
+            marked = Notification.objects.filter(
+                id=notification_id, user=self.scope["user"], is_read=False
+            ).update(is_read=True)
+        except (ValueError, ValidationError):
+            return
+        if marked:
+            # Pushed to this socket and the user's other ones
+            UnreadCountService.adjust_and_push({self.user_id: -1})
\ No newline at end of file
@@ -0,0 +1,70 @@
+# api/counters.py
+import logging
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from .models import (
+    ChatMessage, ChatReaction, Community, CommunityMember, Event,
+    EventParticipant, Like, Post, Reaction,
+)
+
+logger = logging.getLogger(__name__)
+
+# (model, counter field, related model, FK on the related model pointing back)
+COUNTERS = [
+    (Post, 'like_count', Like, 'post'),
+    (Post, 'reaction_count', Reaction, 'post'),
+    (Community, 'member_count', CommunityMember, 'community'),
+    (Event, 'participant_count', EventParticipant, 'event'),
+    (ChatMessage, 'reaction_count', ChatReaction, 'message'),
+]
+
+
+class CounterService:
+    @staticmethod
+    def increment(instance, field, amount=1, **extra):
+        """
+        Atomically add `amount` to a counter column on `instance`; `extra`
+        columns are set in the same UPDATE
+        """
+        type(instance).objects.filter(pk=instance.pk).update(
+            **{field: F(field) + amount}, **extra
+        )
+
+    @staticmethod
+    def decrement(instance, field, amount=1, **extra):
+        """Atomically subtract `amount` from a counter column, never below zero"""
+        if amount <= 0:
+            return
+        type(instance).objects.filter(pk=instance.pk).update(
+            **{field: Greatest(F(field) - amount, Value(0))}, **extra
+        )
+
+    @staticmethod
+    def actual_count(related_model, fk_name):
+        """Subquery expression counting related rows for the outer object"""
+        counts = related_model.objects.filter(
+            **{fk_name: OuterRef('pk')}
+        ).order_by().values(fk_name).annotate(total=Count('pk')).values('total')
+        return Coalesce(Subquery(counts), Value(0))
+
+    @staticmethod
+    def find_drift(model, field, related_model, fk_name):
+        """Return (pk, stored, actual) for every row whose counter is out of date"""
+        queryset = model.objects.annotate(
+            actual=CounterService.actual_count(related_model, fk_name)
+        ).exclude(**{field: F('actual')})
+        return list(queryset.values_list('pk', field, 'actual'))
+
+    @staticmethod
+    def rebuild(model, field, related_model, fk_name, batch_size=500):
+        """Recompute drifted counters for one column. Returns the rows fixed."""
+        drift = CounterService.find_drift(model, field, related_model, fk_name)
+        objs = []
+        for pk, _stored, actual in drift:
+            obj = model(pk=pk)
+            setattr(obj, field, actual)
+            objs.append(obj)
+        model.objects.bulk_update(objs, [field], batch_size=batch_size)
+        if objs:
+            logger.info(f"Rebuilt {len(objs)} {model.__name__}.{field} counters")
+        return len(objs)
@@ -0,0 +1,177 @@
+# api/fake_redis.py
+"""
+A tiny in-process stand-in for Redis pub/sub.
+
+It speaks enough RESP2 (PING, SELECT, CLIENT, PUBLISH, [P]SUBSCRIBE,
+[P]UNSUBSCRIBE) for channels_redis' RedisPubSubChannelLayer, so several
+Daphne/runserver processes can share a channel layer on one box without a
+real Redis. Start it with `manage.py runfakeredis` and run the workers with
+CHANNEL_LAYER=fake_redis. Nothing is persisted; for tests and local
+multi-process experiments only.
+"""
+import asyncio
+import fnmatch
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def encode(value):
+    """RESP2-encode a reply"""
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if isinstance(value, (list, tuple)):
+        return b'*%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+    raise TypeError(f'Cannot encode {type(value).__name__}')
+
+
+class SimpleString(bytes):
+    pass
+
+
+def encode_reply(value):
+    if isinstance(value, SimpleString):
+        return b'+' + value + b'\r\n'
+    return encode(value)
+
+
+OK = SimpleString(b'OK')
+PONG = SimpleString(b'PONG')
+
+
+class ClientConnection:
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.channels = set()
+        self.patterns = set()
+
+    @property
+    def subscription_count(self):
+        return len(self.channels) + len(self.patterns)
+
+    def send(self, value):
+        self.writer.write(encode_reply(value))
+
+    async def read_command(self):
+        line = await self.reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command, e.g. typed into telnet/redis-cli
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:])):
+            header = await self.reader.readline()
+            length = int(header[1:])
+            data = await self.reader.readexactly(length + 2)
+            args.append(data[:-2])
+        return args
+
+    async def serve(self):
+        try:
+            while True:
+                args = await self.read_command()
+                if args is None:
+                    break
+                if not args:
+                    continue
+                if not self.handle(args[0].upper().decode(), args[1:]):
+                    break
+                await self.writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.server.disconnect(self)
+            self.writer.close()
+
+    def handle(self, command, args):
+        if command == 'PING':
+            if self.subscription_count:
+                self.send([b'pong', args[0] if args else b''])
+            else:
+                self.send(args[0] if args else PONG)
+        elif command == 'ECHO':
+            self.send(args[0])
+        elif command in ('SELECT', 'CLIENT', 'FLUSHDB', 'FLUSHALL'):
+            self.send(OK)
+        elif command == 'PUBLISH':
+            self.send(self.server.publish(args[0], args[1]))
+        elif command in ('SUBSCRIBE', 'PSUBSCRIBE'):
+            targets = self.channels if command == 'SUBSCRIBE' else self.patterns
+            for name in args:
+                targets.add(name)
+                self.send([command.lower().encode(), name, self.subscription_count])
+        elif command in ('UNSUBSCRIBE', 'PUNSUBSCRIBE'):
+            targets = self.channels if command == 'UNSUBSCRIBE' else self.patterns
+            names = args or sorted(targets)
+            if not names:
+                self.send([command.lower().encode(), None, self.subscription_count])
+            for name in names:
+                targets.discard(name)
+                self.send([command.lower().encode(), name, self.subscription_count])
+        elif command == 'QUIT':
+            self.send(OK)
+            return False
+        else:
+            self.writer.write(b"-ERR unknown command '%s'\r\n" % command.encode())
+        return True
+
+
+class FakeRedisServer:
+    def __init__(self, host='127.0.0.1', port=6390):
+        self.host = host
+        self.port = port
+        self.clients = set()
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._accept, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Fake Redis listening on {self.host}:{self.port}")
+        return self
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for client in list(self.clients):
+            client.writer.close()
+
+    @property
+    def url(self):
+        return f'redis://{self.host}:{self.port}/0'
+
+    async def _accept(self, reader, writer):
+        client = ClientConnection(self, reader, writer)
+        self.clients.add(client)
+        await client.serve()
+
+    def disconnect(self, client):
+        self.clients.discard(client)
+
+    def publish(self, channel, message):
+        receivers = 0
+        text = channel.decode(errors='replace')
+        for client in list(self.clients):
+            if channel in client.channels:
+                client.send([b'message', channel, message])
+                receivers += 1
+            for pattern in client.patterns:
+                if fnmatch.fnmatchcase(text, pattern.decode(errors='replace')):
+                    client.send([b'pmessage', pattern, channel, message])
+                    receivers += 1
+        return receivers
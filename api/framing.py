@@ -0,0 +1,98 @@
+# api/framing.py
+"""
+Encode-once websocket broadcasting.
+
+Group events are encoded by the sender with encode_event(): the event keeps
+its `type` (so channels still dispatches it to the right handler), the
+`user_id` or chat `message_id` it is about (for the send queues in
+api/send_queues.py) and carries the finished JSON text and MessagePack
+bytes of the payload.
+Receiving consumers forward whichever one their client negotiated without
+touching the payload, so a broadcast costs one encode per message however
+many sockets are in the group.
+
+Clients choose the framing with the websocket subprotocol:
+`circleup.msgpack` for binary MessagePack frames, `circleup.json` (or no
+subprotocol) for JSON text frames. MessagePack needs the `msgpack` package,
+which channels_redis already depends on.
+"""
+import json
+from .send_queues import SLOW_CONSUMER_CLOSE_CODE, create_send_queue, metrics, slow_consumer_reason
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON_SUBPROTOCOL = 'circleup.json'
+MSGPACK_SUBPROTOCOL = 'circleup.msgpack'
+
+
+def encode_event(event):
+    """A group event carrying `event` pre-encoded for every framing"""
+    encoded = {
+        'type': event['type'],
+        'frame_text': json.dumps(event),
+    }
+    if 'user_id' in event:
+        encoded['user_id'] = event['user_id']
+    if event['type'] == 'chat_message':
+        encoded['message_id'] = event['message']['id']
+    if msgpack is not None:
+        encoded['frame_bytes'] = msgpack.packb(event, use_bin_type=True)
+    return encoded
+
+
+class FramedConsumerMixin:
+    """
+    For AsyncWebsocketConsumer subclasses: negotiates the framing on
+    accept, forwards pre-encoded group events through the connection's
+    send queue and decodes incoming frames in either format.
+    """
+    framing = 'json'
+    send_queue = None
+
+    async def accept_framed(self):
+        offered = self.scope.get('subprotocols') or []
+        subprotocol = None
+        if MSGPACK_SUBPROTOCOL in offered and msgpack is not None:
+            self.framing, subprotocol = 'msgpack', MSGPACK_SUBPROTOCOL
+        elif JSON_SUBPROTOCOL in offered:
+            subprotocol = JSON_SUBPROTOCOL
+        await self.accept(subprotocol=subprotocol)
+        self.send_queue = create_send_queue(self.send_frame)
+        self.send_queue.start()
+
+    async def send_event(self, event):
+        """Queue an event, as-is if it was built by encode_event()"""
+        if 'frame_text' not in event:
+            event = encode_event(event)
+        if self.send_queue is None:
+            await self.send_frame(event)
+        elif not self.send_queue.put(event):
+            await self.evict_slow_consumer()
+
+    async def send_frame(self, event):
+        if self.framing == 'msgpack':
+            await self.send(bytes_data=event['frame_bytes'])
+        else:
+            await self.send(text_data=event['frame_text'])
+
+    async def evict_slow_consumer(self):
+        # Stop taking group events, then tell the client where to resume
+        last_seen = self.send_queue.last_seen
+        await self.send_queue.stop()
+        metrics.evicted += 1
+        if hasattr(self, 'room_group_name'):
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE, reason=slow_consumer_reason(last_seen))
+
+    async def websocket_disconnect(self, message):
+        if self.send_queue is not None:
+            await self.send_queue.stop()
+        await super().websocket_disconnect(message)
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        if bytes_data is not None and msgpack is not None:
+            return msgpack.unpackb(bytes_data, raw=False)
+        return json.loads(text_data or bytes_data)
@@ -0,0 +1,106 @@
+import asyncio
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.bench import (
+    BenchFixture, CommunicatorTransport, DaphneServer, SocketTransport,
+    compare, load_baselines, run_bench, save_baseline, scenario_name,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the chat websockets: N clients over M channels sending messages, '
+        'typing and read events; reports fan-out latency, throughput and memory per connection'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['communicator', 'socket'], default='communicator')
+        parser.add_argument(
+            '--url',
+            help='Server for --mode socket, e.g. ws://127.0.0.1:8000; by default Daphne is started locally',
+        )
+        # The defaults match the baseline committed in benchmarks/websocket_baselines.json
+        parser.add_argument('--clients', type=int, default=50, help='Total websocket connections')
+        parser.add_argument('--channels', type=int, default=2, help='Channels the clients are spread over')
+        parser.add_argument('--senders', type=int, default=1, help='Sending clients per channel')
+        parser.add_argument('--messages', type=int, default=20, help='Messages per sender')
+        parser.add_argument('--rate', type=float, default=10.0, help='Messages per second per sender (0: no pause)')
+        parser.add_argument('--read-every', type=int, default=5, help='Send message_read every N received messages')
+        parser.add_argument('--drain-timeout', type=float, default=30.0, help='Seconds to wait for outstanding deliveries')
+        parser.add_argument(
+            '--baseline-file',
+            default=str(settings.BASE_DIR / 'benchmarks' / 'websocket_baselines.json'),
+        )
+        parser.add_argument('--save-baseline', nargs='?', const='', help='Store the result as a baseline (default name: the scenario)')
+        parser.add_argument('--compare', nargs='?', const='', help='Compare with a stored baseline (default name: the scenario)')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed regression as a fraction')
+        parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['channels'] < 1:
+            raise CommandError('--clients and --channels must be at least 1')
+        if options['channels'] > options['clients']:
+            raise CommandError('--channels cannot exceed --clients')
+
+        server = None
+        try:
+            if options['mode'] == 'socket':
+                if options['url']:
+                    transport = SocketTransport(options['url'])
+                else:
+                    server = DaphneServer()
+                    transport = SocketTransport(server.url, server)
+            else:
+                transport = CommunicatorTransport()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        fixture = BenchFixture(options['clients'], options['channels'])
+        try:
+            assignments = fixture.create()
+            if server is not None:
+                server.start()
+            result = asyncio.run(run_bench(
+                transport, assignments,
+                senders=options['senders'],
+                messages=options['messages'],
+                rate=options['rate'],
+                read_every=options['read_every'],
+                drain_timeout=options['drain_timeout'],
+            ))
+        except (RuntimeError, ConnectionError, OSError) as e:
+            raise CommandError(f'Benchmark failed: {e}')
+        finally:
+            if server is not None:
+                server.stop()
+            fixture.delete()
+
+        name = scenario_name(result)
+        if options['json']:
+            self.stdout.write(json.dumps({'scenario': name, **result}, indent=2))
+        else:
+            self.stdout.write(name)
+            for field, value in result.items():
+                self.stdout.write(f'  {field}: {value}')
+
+        if options['save_baseline'] is not None:
+            save_baseline(options['baseline_file'], options['save_baseline'] or name, result)
+            self.stdout.write(self.style.SUCCESS(f"Baseline {options['save_baseline'] or name} saved"))
+
+        if options['compare'] is not None:
+            baseline_name = options['compare'] or name
+            baselines = load_baselines(options['baseline_file'])
+            baseline = baselines.get(baseline_name)
+            if baseline is None:
+                raise CommandError(
+                    f'No baseline named {baseline_name} in {options["baseline_file"]} '
+                    f'(stored: {", ".join(sorted(baselines)) or "none"}); '
+                    f'record one with the same options and --save-baseline'
+                )
+            regressions = compare(result, baseline, options['tolerance'])
+            for regression in regressions:
+                self.stdout.write(f'  {regression}')
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against baseline {baseline_name}')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against baseline {baseline_name}'))
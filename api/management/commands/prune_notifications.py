@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.notification_retention import NotificationRetentionService, retention_settings
+
+
+class Command(BaseCommand):
+    help = 'Delete old read notifications and archive old unread ones (see NOTIFICATION_RETENTION)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many notifications would be deleted and archived',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            old_read, old_unread = NotificationRetentionService.expired()
+            self.stdout.write(f'{old_read.count()} read notifications would be deleted')
+            archive = retention_settings()['ARCHIVE']
+            if archive:
+                self.stdout.write(f'{old_unread.count()} unread notifications would be archived ({archive})')
+            return
+
+        result = NotificationRetentionService.prune()
+        if result is None:
+            raise CommandError('Another retention run is in progress')
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {result['deleted']} read notifications, archived {result['archived']} unread ones"
+        ))
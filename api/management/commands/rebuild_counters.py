@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.counters import COUNTERS, CounterService
+
+
+class Command(BaseCommand):
+    help = 'Rebuild (or, with --verify, just check) the denormalized counter columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report drifted counters; exit with an error if any are found',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of rows written per UPDATE batch when rebuilding',
+        )
+
+    def handle(self, *args, **options):
+        total_drift = 0
+        for model, field, related_model, fk_name in COUNTERS:
+            label = f'{model.__name__}.{field}'
+            if options['verify']:
+                drift = CounterService.find_drift(model, field, related_model, fk_name)
+                for pk, stored, actual in drift[:10]:
+                    self.stdout.write(f'  {label} {pk}: stored={stored} actual={actual}')
+                count = len(drift)
+            else:
+                count = CounterService.rebuild(
+                    model, field, related_model, fk_name,
+                    batch_size=options['batch_size'],
+                )
+            total_drift += count
+            self.stdout.write(f'{label}: {count} drifted')
+
+        if options['verify'] and total_drift:
+            raise CommandError(f'{total_drift} counters are out of date')
+        self.stdout.write(self.style.SUCCESS('Counters OK' if options['verify'] else 'Counters rebuilt'))
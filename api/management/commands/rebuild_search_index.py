@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.search import SEARCH_INDEXES, get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Repopulate the full-text search index (SQLite FTS5 tables)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'indexes',
+            nargs='*',
+            help=f"Indexes to rebuild: {', '.join(SEARCH_INDEXES)} (default: all)",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        unknown = set(options['indexes']) - set(SEARCH_INDEXES)
+        if unknown:
+            raise CommandError(f"Unknown search index: {', '.join(sorted(unknown))}")
+
+        backend = get_search_backend()
+        for name in options['indexes'] or SEARCH_INDEXES:
+            index = SEARCH_INDEXES[name]
+            backend.clear(index)
+            batch, total = [], 0
+            for obj in index.model.objects.all().iterator(chunk_size=options['batch_size']):
+                batch.append(obj)
+                if len(batch) >= options['batch_size']:
+                    backend.index_many(batch)
+                    total += len(batch)
+                    batch = []
+            backend.index_many(batch)
+            total += len(batch)
+            self.stdout.write(f'{name}: {total} indexed')
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
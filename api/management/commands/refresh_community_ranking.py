@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.rankings import CommunityRankingService
+
+
+class Command(BaseCommand):
+    help = 'Recompute the cached community popularity ranking (run from cron every few minutes)'
+
+    def handle(self, *args, **options):
+        ranking = CommunityRankingService.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Ranked {len(ranking)} communities'))
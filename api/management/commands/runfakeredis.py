@@ -0,0 +1,24 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from api.fake_redis import FakeRedisServer
+
+
+class Command(BaseCommand):
+    help = 'Run an embedded pub/sub-only Redis stand-in for the fake_redis channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=6390)
+
+    def handle(self, *args, **options):
+        server = FakeRedisServer(options['host'], options['port'])
+
+        async def run():
+            await server.start()
+            self.stdout.write(self.style.SUCCESS(f'Fake Redis listening on {server.url}'))
+            await server.serve_forever()
+
+        try:
+            asyncio.run(run())
+        except KeyboardInterrupt:
+            pass
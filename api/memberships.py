@@ -0,0 +1,91 @@
+# api/memberships.py
+"""
+Cached community memberships for access checks.
+
+MembershipService.roles(user) returns the user's {community_id: role} map
+from the Django cache, so permissions, viewsets, serializers and
+websocket consumers share one lookup instead of each querying
+CommunityMember. Entries are versioned per user: any membership change
+(join, leave, role update or removal, creating a community, admin edits
+and cascades, all via the CommunityMember signals in api/signals.py)
+moves the user to a new version once the transaction commits, and the
+stale entry simply expires.
+
+With several worker processes the default cache must be shared (see
+CACHES in settings) for invalidations to reach every worker.
+"""
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import CommunityMember
+
+DEFAULTS = {
+    'TTL': 300,  # seconds
+}
+
+ADMIN_ROLES = ('admin', 'moderator')
+
+
+def membership_settings():
+    return {**DEFAULTS, **getattr(settings, 'MEMBERSHIP_CACHE', {})}
+
+
+def as_uuid(value):
+    return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+
+class MembershipService:
+    @staticmethod
+    def version_key(user_id):
+        return f'memberships:version:{user_id}'
+
+    @staticmethod
+    def version(user_id):
+        # Versions are timestamps rather than counters so that an evicted
+        # version key can never bring back an older cached entry
+        key = MembershipService.version_key(user_id)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, time.time_ns(), None)
+            version = cache.get(key)
+        return version
+
+    @staticmethod
+    def roles(user):
+        """{community_id: role} for every community the user belongs to"""
+        if user is None or not user.is_authenticated:
+            return {}
+        key = f'memberships:{user.pk}:{MembershipService.version(user.pk)}'
+        roles = cache.get(key)
+        if roles is None:
+            roles = dict(CommunityMember.objects.filter(user=user).values_list('community_id', 'role'))
+            cache.set(key, roles, membership_settings()['TTL'])
+        return roles
+
+    @staticmethod
+    def community_ids(user):
+        return list(MembershipService.roles(user))
+
+    @staticmethod
+    def role(user, community_id):
+        try:
+            return MembershipService.roles(user).get(as_uuid(community_id))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def is_member(user, community_id):
+        return MembershipService.role(user, community_id) is not None
+
+    @staticmethod
+    def is_admin(user, community_id):
+        return MembershipService.role(user, community_id) in ADMIN_ROLES
+
+    @staticmethod
+    def invalidate(user_id):
+        """Drop the user's cached memberships once the current transaction commits"""
+        transaction.on_commit(
+            lambda: cache.set(MembershipService.version_key(user_id), time.time_ns(), None)
+        )
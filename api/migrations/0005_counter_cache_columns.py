@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-17 01:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+COUNTERS = [
+    ('Post', 'like_count', 'Like', 'post'),
+    ('Post', 'reaction_count', 'Reaction', 'post'),
+    ('Community', 'member_count', 'CommunityMember', 'community'),
+    ('Event', 'participant_count', 'EventParticipant', 'event'),
+    ('ChatMessage', 'reaction_count', 'ChatReaction', 'message'),
+]
+
+
+def backfill_counters(apps, schema_editor):
+    for model_name, field, related_name, fk_name in COUNTERS:
+        model = apps.get_model('api', model_name)
+        related_model = apps.get_model('api', related_name)
+        counts = related_model.objects.filter(
+            **{fk_name: OuterRef('pk')}
+        ).order_by().values(fk_name).annotate(total=Count('pk')).values('total')
+        model.objects.update(**{field: Coalesce(Subquery(counts), Value(0))})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_userfcmtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='reaction_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='community',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='participant_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reaction_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 01:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_post_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='community',
+            index=models.Index(fields=['-member_count', 'id'], name='community_popularity_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.7 on 2026-10-17 01:31
+
+import uuid
+
+from django.db import migrations
+
+
+# (model, search fields, UNINDEXED filter columns)
+SEARCH_INDEXES = {
+    'community': ('Community', ['name', 'bio', 'location'], []),
+    'post': ('Post', ['caption'], ['community_id']),
+    'chat_message': ('ChatMessage', ['message'], ['channel_id']),
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    for name, (model_name, fields, filters) in SEARCH_INDEXES.items():
+        model = apps.get_model('api', model_name)
+        if connection.vendor == 'postgresql':
+            document = " || ' ' || ".join(f"coalesce({field}, '')" for field in fields)
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS api_{name}_search_idx ON {model._meta.db_table} "
+                f"USING gin ((to_tsvector('simple', {document})))"
+            )
+        elif connection.vendor == 'sqlite':
+            table = f'api_{name}_fts'
+            columns = ['object_id', *filters, *fields]
+            definitions = [f'{column} UNINDEXED' for column in ['object_id', *filters]] + fields
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                f"{', '.join(definitions)}, tokenize='unicode61 remove_diacritics 2')"
+            )
+            rows = [
+                [uuid.UUID(str(obj.pk)).int >> 65, obj.pk.hex]
+                + [getattr(obj, column).hex for column in filters]
+                + [getattr(obj, field) or '' for field in fields]
+                for obj in model.objects.all().iterator()
+            ]
+            if rows:
+                with connection.cursor() as cursor:
+                    cursor.executemany(
+                        f"INSERT INTO {table} (rowid, {', '.join(columns)}) "
+                        f"VALUES ({', '.join(['%s'] * (len(columns) + 1))})",
+                        rows
+                    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    for name in SEARCH_INDEXES:
+        if connection.vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS api_{name}_search_idx')
+        elif connection.vendor == 'sqlite':
+            schema_editor.execute(f'DROP TABLE IF EXISTS api_{name}_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_community_popularity_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
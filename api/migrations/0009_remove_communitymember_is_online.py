@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 01:36
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='communitymember',
+            name='is_online',
+        ),
+    ]
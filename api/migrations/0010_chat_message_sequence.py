@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-17 01:39
+
+from django.db import migrations, models
+
+
+def backfill_sequences(apps, schema_editor):
+    # Number existing messages per channel in the order they were sent
+    Channel = apps.get_model('api', 'Channel')
+    ChatMessage = apps.get_model('api', 'ChatMessage')
+    for channel in Channel.objects.all().iterator():
+        messages = list(ChatMessage.objects.filter(channel=channel).order_by('created_at', 'id'))
+        for seq, message in enumerate(messages, start=1):
+            message.seq = message.change_seq = seq
+        ChatMessage.objects.bulk_update(messages, ['seq', 'change_seq'], batch_size=500)
+        channel.last_seq = len(messages)
+        channel.save(update_fields=['last_seq'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_remove_communitymember_is_online'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='is_deleted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='seq',
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_sequences, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['channel', 'change_seq'], name='chat_message_change_seq_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatmessage',
+            constraint=models.UniqueConstraint(fields=('channel', 'seq'), name='chat_message_channel_seq_uniq'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-17 02:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_actors(apps, schema_editor):
+    # Open aggregated rows only know their latest actors; record those so
+    # they are not counted again
+    Notification = apps.get_model('api', 'Notification')
+    NotificationActor = apps.get_model('api', 'NotificationActor')
+    User = apps.get_model('api', 'User')
+    rows = list(Notification.objects.filter(group_key__isnull=False).values_list('id', 'latest_actors'))
+    actor_ids = {str(actor['id']) for _, latest_actors in rows for actor in latest_actors}
+    existing = {str(pk) for pk in User.objects.filter(id__in=actor_ids).values_list('id', flat=True)}
+    NotificationActor.objects.bulk_create([
+        NotificationActor(notification_id=notification_id, actor_id=actor['id'])
+        for notification_id, latest_actors in rows
+        for actor in latest_actors
+        if str(actor['id']) in existing
+    ], batch_size=500, ignore_conflicts=True)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_notification_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationActor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('actor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actors', to='api.notification')),
+            ],
+            options={
+                'unique_together': {('notification', 'actor')},
+            },
+        ),
+        migrations.RunPython(backfill_actors, migrations.RunPython.noop),
+    ]
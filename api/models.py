@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Prefetch, Subquery
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 import uuid
@@ -45,6 +46,16 @@ class OTP(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_used = models.BooleanField(default=False)
 
+class CommunityQuerySet(models.QuerySet):
+    def with_member_stats(self, user=None):
+        """
+        Load what CommunitySerializer renders so a whole listing costs no
+        per-row queries. The user's membership comes from the cached map in
+        api/memberships.py and online counts from the presence store
+        (api/presence.py), so neither needs a join here.
+        """
+        return self.select_related('created_by')
+
 class Community(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=100)
@@ -56,6 +67,15 @@ class Community(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     invite_link = models.CharField(max_length=50, unique=True, default=uuid.uuid4)
     is_public = models.BooleanField(default=True)
+    member_count = models.PositiveIntegerField(default=0)
+
+    objects = CommunityQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Popularity ranking (api/rankings.py)
+            models.Index(fields=['-member_count', 'id'], name='community_popularity_idx'),
+        ]
 
 class CommunityMember(models.Model):
     ROLE_CHOICES = [
@@ -68,7 +88,6 @@ class CommunityMember(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='joined_communities')
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='member')
     joined_at = models.DateTimeField(default=timezone.now)
-    is_online = models.BooleanField(default=False)
 
 class Channel(models.Model):
     CHANNEL_TYPES = [
@@ -85,6 +104,26 @@ class Channel(models.Model):
     is_restricted = models.BooleanField(default=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(default=timezone.now)
+    # Last sequence number handed out to this channel's messages
+    last_seq = models.PositiveBigIntegerField(default=0, editable=False)
+
+class PostQuerySet(models.QuerySet):
+    def for_feed(self, user=None):
+        """
+        Load everything PostSerializer renders in a fixed number of queries:
+        the author, the community (with its member stats) and the given
+        user's like/reaction state.
+        """
+        queryset = self.select_related('posted_by').prefetch_related(
+            Prefetch('community', queryset=Community.objects.with_member_stats(user))
+        )
+        if user is not None and user.is_authenticated:
+            reactions = Reaction.objects.filter(post=OuterRef('pk'), user=user)
+            queryset = queryset.annotate(
+                user_liked=Exists(Like.objects.filter(post=OuterRef('pk'), user=user)),
+                user_reaction=Subquery(reactions.values('reaction_type')[:1]),
+            )
+        return queryset
 
 class Post(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -94,6 +133,16 @@ class Post(models.Model):
     caption = models.TextField()
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    like_count = models.PositiveIntegerField(default=0)
+    reaction_count = models.PositiveIntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of feeds on (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='post_feed_idx'),
+        ]
 
 class Like(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes')
@@ -129,6 +178,7 @@ class Event(models.Model):
     location = models.CharField(max_length=200)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(default=timezone.now)
+    participant_count = models.PositiveIntegerField(default=0)
 
 class EventParticipant(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='participants')
@@ -148,9 +198,43 @@ class ChatMessage(models.Model):
     mentions = models.ManyToManyField(User, related_name='mentioned_in_messages', blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    reaction_count = models.PositiveIntegerField(default=0)
+    # Incremental sync (api/chat_sync.py): `seq` orders the channel's
+    # messages, `change_seq` is bumped by every edit, delete or reaction
+    seq = models.PositiveBigIntegerField(null=True, editable=False)
+    change_seq = models.PositiveBigIntegerField(null=True, editable=False)
+    is_deleted = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['channel', 'seq'], name='chat_message_channel_seq_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['channel', 'change_seq'], name='chat_message_change_seq_idx'),
+        ]
+    
+    @staticmethod
+    def allocate_seqs(channel_id, count=1):
+        """
+        Reserve `count` consecutive sequence numbers in a channel and return
+        the first. Must run in the transaction that writes the rows: the
+        channel row stays locked until commit, so rows become visible in
+        sequence order and `?after=` syncs never skip one.
+        """
+        Channel.objects.filter(pk=channel_id).update(last_seq=F('last_seq') + count)
+        last_seq = Channel.objects.filter(pk=channel_id).values_list('last_seq', flat=True).get()
+        return last_seq - count + 1
+    
+    def save(self, *args, **kwargs):
+        # Every write gets a fresh change_seq; new messages also take it as seq
+        with transaction.atomic():
+            self.change_seq = ChatMessage.allocate_seqs(self.channel_id)
+            if self.seq is None:
+                self.seq = self.change_seq
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'change_seq'}
+            super().save(*args, **kwargs)
 
 class ChatReaction(models.Model):
     REACTION_TYPES = [
@@ -173,6 +257,17 @@ class ChatReaction(models.Model):
     class Meta:
         unique_together = ('message', 'user', 'reaction_type')
 
+class ChannelReadCursor(models.Model):
+    # Highest ChatMessage.seq the user has read in the channel; written in
+    # batches by api/read_cursors.py
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='read_cursors')
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, related_name='read_cursors')
+    last_read_seq = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'channel')
+
 # Add to models.py
 class UserFCMToken(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='fcm_tokens')
@@ -208,4 +303,49 @@ class Notification(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(default=timezone.now)
-    chat_message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, null=True, blank=True)
\ No newline at end of file
+    chat_message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, null=True, blank=True)
+    
+    # Aggregated likes and reactions (api/notification_aggregation.py); the
+    # group key is set while the row still takes new actors
+    group_key = models.CharField(max_length=100, null=True, blank=True, editable=False)
+    actor_count = models.PositiveIntegerField(default=1)
+    latest_actors = models.JSONField(default=list, blank=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'group_key'], name='notification_user_group_key_uniq'),
+        ]
+        indexes = [
+            # Unread counts (api/notification_counts.py)
+            models.Index(fields=['user', 'is_read'], name='notification_user_read_idx'),
+            # Inbox listing, newest first
+            models.Index(fields=['user', '-created_at'], name='notification_user_created_idx'),
+            # Retention pruning (api/notification_retention.py)
+            models.Index(fields=['is_read', 'created_at'], name='notification_read_created_idx'),
+        ]
+
+class NotificationActor(models.Model):
+    # Distinct actors merged into an aggregated notification, so that
+    # actor_count counts each of them once (api/notification_aggregation.py)
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='actors')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        unique_together = ('notification', 'actor')
+
+class ArchivedNotification(models.Model):
+    # Compact copy of an old unread Notification moved out of the main table
+    # by api/notification_retention.py; targets are kept as plain ids
+    id = models.UUIDField(primary_key=True, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_notifications')
+    notification_type = models.CharField(max_length=20)
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    target = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='archived_notif_user_idx'),
+        ]
\ No newline at end of file
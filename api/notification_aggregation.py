@@ -0,0 +1,126 @@
+# api/notification_aggregation.py
+"""
+Aggregation of high-volume notifications.
+
+Likes and reactions are merged per recipient and target. While a user's
+`post_like` notification for a post is unread and was last bumped less
+than WINDOW seconds ago, another like updates that row instead of
+inserting a new one: the actor is moved to the front of `latest_actors`
+("alice and 41 others liked your post"), counted if they are not among the
+row's NotificationActor rows yet, and the row moves back to the top of the
+list. The count is bumped with an F() update, so concurrent merges never
+lose an increment even where row locks are unavailable (SQLite). The recipient's socket gets a
+`notification_updated` event for it rather than a new notification.
+
+The open row of a (user, target) pair is found by its group_key, which is
+unique per user, and locked while it is merged; a concurrent insert that
+loses the race on the constraint is retried as a merge, so merges are
+atomic upserts. Reading the notification, or letting the window pass,
+closes the row (its group_key is cleared) and the next actor opens a new
+one.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import Notification, NotificationActor
+
+DEFAULTS = {
+    'WINDOW': 24 * 3600,  # seconds since the last merge before a new row is started
+    'LATEST_ACTORS': 3,  # actors kept for display
+}
+
+# notification_type -> (target field, title, message template)
+AGGREGATED = {
+    'post_like': ('post', 'New likes on your post', '{actors} liked your post'),
+    'post_reaction': ('post', 'New reactions to your post', '{actors} reacted to your post'),
+    'chat_reaction': ('chat_message', 'New reactions to your message', '{actors} reacted to your message'),
+}
+
+
+def aggregation_settings():
+    return {**DEFAULTS, **getattr(settings, 'NOTIFICATION_AGGREGATION', {})}
+
+
+def describe_actors(latest_actors, actor_count):
+    names = [actor['username'] for actor in latest_actors]
+    if actor_count == 1 or not names:
+        return names[0] if names else 'Someone'
+    if actor_count == 2 and len(names) > 1:
+        return f'{names[0]} and {names[1]}'
+    others = actor_count - 1
+    return f"{names[0]} and {others} other{'s' if others != 1 else ''}"
+
+
+class NotificationAggregator:
+    @staticmethod
+    def is_aggregated(notification_type):
+        return notification_type in AGGREGATED
+
+    @staticmethod
+    def group_key(fields):
+        target, _, _ = AGGREGATED[fields['notification_type']]
+        return f"{fields['notification_type']}:{fields[f'{target}_id']}"
+
+    @staticmethod
+    def merge(fields, actor):
+        """
+        Fold a notification (field dict, as built by NotificationBuilder)
+        by `actor` ({'id', 'username'}) into the recipient's open row for
+        its target. Returns (notification, created).
+        """
+        key = NotificationAggregator.group_key(fields)
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    notification = Notification.objects.select_for_update().filter(
+                        user_id=fields['user_id'], group_key=key
+                    ).first()
+                    if notification is not None:
+                        if NotificationAggregator.is_open(notification, fields['created_at']):
+                            return NotificationAggregator._bump(notification, fields, actor), False
+                        notification.group_key = None
+                        notification.save(update_fields=['group_key'])
+                    return NotificationAggregator._open(fields, key, actor), True
+            except IntegrityError:
+                # Someone else opened the row first; merge into theirs
+                if attempt:
+                    raise
+
+    @staticmethod
+    def is_open(notification, now):
+        window = timedelta(seconds=aggregation_settings()['WINDOW'])
+        return not notification.is_read and notification.created_at >= now - window
+
+    @staticmethod
+    def _open(fields, key, actor):
+        _, title, template = AGGREGATED[fields['notification_type']]
+        notification = Notification.objects.create(**{
+            **fields,
+            'group_key': key,
+            'title': title,
+            'message': template.format(actors=describe_actors([actor], 1)),
+            'actor_count': 1,
+            'latest_actors': [actor],
+        })
+        NotificationActor.objects.create(notification=notification, actor_id=actor['id'])
+        return notification
+
+    @staticmethod
+    def _bump(notification, fields, actor):
+        _, title, template = AGGREGATED[fields['notification_type']]
+        # Actors already merged (unlike, like again) move to the front
+        # without being counted twice
+        _, new_actor = NotificationActor.objects.get_or_create(notification=notification, actor_id=actor['id'])
+        if new_actor:
+            Notification.objects.filter(pk=notification.pk).update(actor_count=F('actor_count') + 1)
+            notification.refresh_from_db(fields=['actor_count'])
+        previous = [entry for entry in notification.latest_actors if entry['id'] != actor['id']]
+        notification.latest_actors = [actor, *previous][:aggregation_settings()['LATEST_ACTORS']]
+        notification.title = title
+        notification.message = template.format(
+            actors=describe_actors(notification.latest_actors, notification.actor_count)
+        )
+        notification.created_at = fields['created_at']
+        notification.save(update_fields=['latest_actors', 'title', 'message', 'created_at'])
+        return notification
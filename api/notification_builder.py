@@ -0,0 +1,126 @@
+# api/notification_builder.py
+"""
+Batched creation of Notification rows.
+
+NotificationBuilder collects the notifications an action produces (every
+user mentioned in a message, the owner of a reacted-to message, ...).
+save() queues them as one create_notifications task (api/tasks.py) once
+the surrounding transaction commits. The task inserts them with a single
+bulk_create and pushes them to the recipients' `notifications_<user_id>`
+websocket groups in one batch (NotificationService.send_user_notifications),
+so notifying 50 mentioned users costs a handful of queries and one trip
+to the channel layer, none of it inside the request. Likes and reactions
+are merged into existing rows instead (api/notification_aggregation.py)
+and pushed as `notification_updated` events. New rows are then queued for
+mobile push delivery (api/push.py).
+"""
+from collections import Counter
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Notification
+from .notification_aggregation import NotificationAggregator
+from .notification_counts import UnreadCountService
+from .notification_service import NotificationService
+
+
+def notification_payload(notification):
+    """The websocket representation of a saved Notification"""
+    def as_str(value):
+        return str(value) if value is not None else None
+
+    return {
+        'id': str(notification.id),
+        'notification_type': notification.notification_type,
+        'title': notification.title,
+        'message': notification.message,
+        'community_id': as_str(notification.community_id),
+        'channel_id': as_str(notification.channel_id),
+        'post_id': as_str(notification.post_id),
+        'chat_message_id': as_str(notification.chat_message_id),
+        'is_read': notification.is_read,
+        'actor_count': notification.actor_count,
+        'latest_actors': notification.latest_actors,
+        'created_at': notification.created_at.isoformat(),
+    }
+
+
+class NotificationBuilder:
+    def __init__(self, actor=None):
+        # Whoever caused the notifications; they are never notified themselves
+        self.actor = actor
+        self.notifications = []
+
+    def add(self, user_id, notification_type, title, message, **related):
+        if self.actor is not None and str(user_id) == str(self.actor.pk):
+            return self
+        # Plain field values, so the batch can be handed to a task
+        fields = {
+            'user_id': str(user_id),
+            'notification_type': notification_type,
+            'title': title,
+            'message': message,
+            'created_at': timezone.now().isoformat(),
+        }
+        for name, value in related.items():
+            if isinstance(value, models.Model):
+                name, value = f'{name}_id', value.pk
+            fields[name] = str(value) if value is not None else None
+        if self.actor is not None and NotificationAggregator.is_aggregated(notification_type):
+            fields['actor'] = {'id': str(self.actor.pk), 'username': self.actor.username}
+        self.notifications.append(fields)
+        return self
+
+    def add_chat_mentions(self, message, user_ids):
+        channel = message.channel
+        username = self.actor.username
+        for user_id in user_ids:
+            self.add(
+                user_id,
+                'chat_mention',
+                title=f"You were mentioned by {username}",
+                message=f"{username} mentioned you in {channel.name}",
+                community_id=channel.community_id,
+                channel=channel,
+                chat_message=message
+            )
+        return self
+
+    def save(self):
+        """Queue the collected notifications for creation after commit"""
+        from .tasks import create_notifications, enqueue_on_commit
+
+        notifications, self.notifications = self.notifications, []
+        if notifications:
+            enqueue_on_commit(create_notifications, notifications)
+
+    @staticmethod
+    def create(notifications):
+        """Insert (or merge) notifications given as field dicts and push them"""
+        from .tasks import enqueue_on_commit, send_push_notifications
+
+        rows, merged = [], []
+        for fields in notifications:
+            fields = {**fields, 'created_at': parse_datetime(fields['created_at'])}
+            actor = fields.pop('actor', None)
+            if actor is not None and NotificationAggregator.is_aggregated(fields['notification_type']):
+                notification, created = NotificationAggregator.merge(fields, actor)
+                if not created:
+                    merged.append(notification)
+                    continue
+                rows.append(notification)
+            else:
+                rows.append(Notification(**fields))
+        Notification.objects.bulk_create([row for row in rows if row._state.adding])
+        UnreadCountService.adjust_and_push(Counter(str(notification.user_id) for notification in rows))
+
+        NotificationService.send_user_notifications([
+            (notification.user_id, notification_payload(notification)) for notification in rows
+        ])
+        NotificationService.send_user_notifications([
+            (notification.user_id, notification_payload(notification)) for notification in merged
+        ], event_type='notification_updated')
+        if rows:
+            # Merged rows are not pushed again; the device already shows them
+            enqueue_on_commit(send_push_notifications, [str(notification.id) for notification in rows])
+        return rows + merged
@@ -0,0 +1,108 @@
+# api/notification_counts.py
+"""
+Cached unread-notification counts for badges.
+
+Each user's unread count lives in the Django cache. Creating notifications
+increments it, and marking them read (REST or websocket) or deleting
+unread ones decrements it, with the new value pushed to the user's
+`notifications_<user_id>` group as an `unread_count` event. Clients render
+the badge from that instead of polling the notification list.
+
+Counts are reconciled lazily. An entry expires TTL seconds after it was
+last computed (increments do not extend it), and a missing or negative
+entry is recounted from the database on the (user, is_read) index, in one
+grouped query for every recipient of a batch.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from .models import Notification
+from .notification_service import NotificationService
+
+DEFAULTS = {
+    'TTL': 300,  # seconds before a cached count is recounted
+}
+
+
+def unread_count_settings():
+    return {**DEFAULTS, **getattr(settings, 'UNREAD_NOTIFICATION_COUNTS', {})}
+
+
+class UnreadCountService:
+    @staticmethod
+    def key(user_id):
+        return f'notifications:unread:{user_id}'
+
+    @staticmethod
+    def get(user_id):
+        count = cache.get(UnreadCountService.key(user_id))
+        if count is None or count < 0:
+            count = UnreadCountService.reconcile(user_id)
+        return count
+
+    @staticmethod
+    def reconcile(user_id):
+        return UnreadCountService.reconcile_many([user_id])[user_id]
+
+    @staticmethod
+    def reconcile_many(user_ids):
+        """Recount and cache several users' counts in one query; {user_id: count}"""
+        if not user_ids:
+            return {}
+        counts = dict.fromkeys(user_ids, 0)
+        by_id = {str(user_id): user_id for user_id in user_ids}
+        for row in Notification.objects.filter(
+            user_id__in=user_ids, is_read=False
+        ).values('user_id').annotate(total=Count('id')).order_by():
+            counts[by_id[str(row['user_id'])]] = row['total']
+        cache.set_many(
+            {UnreadCountService.key(user_id): count for user_id, count in counts.items()},
+            unread_count_settings()['TTL']
+        )
+        return counts
+
+    @staticmethod
+    def adjust(user_id, delta):
+        """Apply `delta` to a cached count and return the new count"""
+        try:
+            count = cache.incr(UnreadCountService.key(user_id), delta)
+        except ValueError:
+            # Not cached; the recount already includes the change
+            return UnreadCountService.reconcile(user_id)
+        if count < 0:
+            count = UnreadCountService.reconcile(user_id)
+        return count
+
+    @staticmethod
+    def reset(user_id):
+        cache.set(UnreadCountService.key(user_id), 0, unread_count_settings()['TTL'])
+        return 0
+
+    @staticmethod
+    def adjust_and_push(deltas):
+        """Apply {user_id: delta} and push every user's new count"""
+        counts, stale = {}, []
+        for user_id, delta in deltas.items():
+            if not delta:
+                continue
+            try:
+                counts[user_id] = cache.incr(UnreadCountService.key(user_id), delta)
+            except ValueError:
+                stale.append(user_id)
+                continue
+            if counts[user_id] < 0:
+                stale.append(user_id)
+        # Uncached or negative counts are recounted together
+        counts.update(UnreadCountService.reconcile_many(stale))
+        UnreadCountService.push(counts)
+        return counts
+
+    @staticmethod
+    def push(counts):
+        NotificationService.send_user_events([
+            (user_id, UnreadCountService.event(count)) for user_id, count in counts.items()
+        ])
+
+    @staticmethod
+    def event(count):
+        return {'type': 'unread_count', 'unread_count': count}
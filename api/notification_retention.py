@@ -0,0 +1,163 @@
+# api/notification_retention.py
+"""
+Retention for the Notification table.
+
+Read notifications older than READ_DAYS are deleted. Unread ones older than
+UNREAD_DAYS are moved out of the table when ARCHIVE is set: to the compact
+ArchivedNotification side table ('table') or appended to a JSONL file at
+ARCHIVE_PATH ('jsonl'); with ARCHIVE=None they are kept. Archived unread
+notifications leave the users' unread counts, and the new counts are
+pushed.
+
+Rows are handled CHUNK_SIZE at a time, oldest first, each chunk in its own
+short transaction with a PAUSE between chunks, so the job never holds the
+write lock for long (which on SQLite would block every other writer). A
+cache lock keeps runs from overlapping. The job runs from Celery beat (the
+prune_notifications task) or `manage.py prune_notifications`.
+"""
+import json
+import logging
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from .models import ArchivedNotification, Notification
+from .notification_counts import UnreadCountService
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'READ_DAYS': 30,  # None keeps read notifications
+    'UNREAD_DAYS': 180,
+    'ARCHIVE': None,  # 'table', 'jsonl' or None (keep old unread notifications)
+    'ARCHIVE_PATH': 'notification_archive.jsonl',
+    'CHUNK_SIZE': 500,
+    'PAUSE': 0.1,  # seconds between chunks
+    'LOCK_TTL': 3600,  # seconds
+}
+
+LOCK_KEY = 'notifications:retention:lock'
+
+ARCHIVED_FIELDS = (
+    'id', 'user_id', 'notification_type', 'title', 'message', 'created_at',
+    'community_id', 'channel_id', 'post_id', 'chat_message_id',
+)
+TARGET_FIELDS = ('community_id', 'channel_id', 'post_id', 'chat_message_id')
+
+
+def retention_settings():
+    return {**DEFAULTS, **getattr(settings, 'NOTIFICATION_RETENTION', {})}
+
+
+def archive_record(row):
+    """The compact form of a Notification values() row, as archived"""
+    return {
+        'id': str(row['id']),
+        'user_id': str(row['user_id']),
+        'notification_type': row['notification_type'],
+        'title': row['title'],
+        'message': row['message'],
+        'target': {field: str(row[field]) for field in TARGET_FIELDS if row[field] is not None},
+        'created_at': row['created_at'].isoformat(),
+    }
+
+
+class NotificationRetentionService:
+    @staticmethod
+    def expired(now=None):
+        """(old read notifications, old unread notifications to archive)"""
+        config = retention_settings()
+        now = now or timezone.now()
+        old_read = old_unread = Notification.objects.none()
+        if config['READ_DAYS'] is not None:
+            old_read = Notification.objects.filter(
+                is_read=True, created_at__lt=now - timedelta(days=config['READ_DAYS'])
+            )
+        if config['ARCHIVE'] and config['UNREAD_DAYS'] is not None:
+            old_unread = Notification.objects.filter(
+                is_read=False, created_at__lt=now - timedelta(days=config['UNREAD_DAYS'])
+            )
+        return old_read, old_unread
+
+    @staticmethod
+    def prune(now=None):
+        """
+        Delete and archive expired notifications; returns
+        {'deleted': n, 'archived': n}, or None if a run is already going.
+        """
+        config = retention_settings()
+        if config['ARCHIVE'] not in (None, 'table', 'jsonl'):
+            raise ImproperlyConfigured("NOTIFICATION_RETENTION['ARCHIVE'] must be 'table', 'jsonl' or None")
+        if not cache.add(LOCK_KEY, True, config['LOCK_TTL']):
+            return None
+        try:
+            old_read, old_unread = NotificationRetentionService.expired(now)
+            result = {
+                'deleted': NotificationRetentionService._in_chunks(old_read, NotificationRetentionService._delete, config),
+                'archived': NotificationRetentionService._in_chunks(old_unread, NotificationRetentionService._archive, config),
+            }
+            logger.info(f"Notification retention deleted {result['deleted']} and archived {result['archived']}")
+            return result
+        finally:
+            cache.delete(LOCK_KEY)
+
+    @staticmethod
+    def _in_chunks(queryset, handle, config):
+        total = 0
+        while True:
+            ids = list(queryset.order_by('created_at').values_list('id', flat=True)[:config['CHUNK_SIZE']])
+            if not ids:
+                return total
+            total += handle(ids, config)
+            time.sleep(config['PAUSE'])
+
+    @staticmethod
+    def _delete(ids, config):
+        with transaction.atomic():
+            deleted, _ = Notification.objects.filter(id__in=ids).delete()
+        return deleted
+
+    @staticmethod
+    def _archive(ids, config):
+        with transaction.atomic():
+            # Re-checked under the lock: anything read meanwhile is left for
+            # the read retention
+            rows = list(
+                Notification.objects.select_for_update().filter(id__in=ids, is_read=False).values(*ARCHIVED_FIELDS)
+            )
+            records = [archive_record(row) for row in rows]
+            if config['ARCHIVE'] == 'table':
+                ArchivedNotification.objects.bulk_create([
+                    ArchivedNotification(
+                        id=row['id'],
+                        user_id=row['user_id'],
+                        notification_type=row['notification_type'],
+                        title=row['title'],
+                        message=row['message'],
+                        target=record['target'],
+                        created_at=row['created_at'],
+                    )
+                    for row, record in zip(rows, records)
+                ], ignore_conflicts=True)
+            else:
+                # Written before the rows are deleted: a failure in between
+                # can archive a notification twice but never lose it
+                NotificationRetentionService._append_jsonl(records, str(config['ARCHIVE_PATH']))
+            Notification.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        UnreadCountService.adjust_and_push({
+            user_id: -count for user_id, count in Counter(record['user_id'] for record in records).items()
+        })
+        return len(rows)
+
+    @staticmethod
+    def _append_jsonl(records, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'a') as archive:
+            archive.writelines(json.dumps(record) + '\n' for record in records)
+            archive.flush()
+            os.fsync(archive.fileno())
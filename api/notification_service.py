@@ -1,7 +1,10 @@
 # api/notification_service.py
+import asyncio
 import logging
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
+from .replay import ReplayService
+from .framing import encode_event
 
 logger = logging.getLogger(__name__)
 
@@ -11,13 +14,13 @@ class NotificationService:
         """Send chat message to all users in a channel"""
         try:
             channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"chat_{channel_id}",
-                {
-                    'type': 'chat_message',
-                    'message': message_data
-                }
-            )
+            event = {
+                'type': 'chat_message',
+                'message': message_data
+            }
+            # Keep a copy for websocket clients that reconnect later
+            ReplayService.record(f"chat_{channel_id}", event)
+            async_to_sync(channel_layer.group_send)(f"chat_{channel_id}", encode_event(event))
             logger.info(f"Chat notification sent to channel {channel_id}")
         except Exception as e:
             logger.warning(f"WebSocket notification failed: {e}")
@@ -26,39 +29,34 @@ class NotificationService:
     @staticmethod
     def send_user_notification(user_id, notification_data):
         """Send personal notification to user via WebSocket"""
-        try:
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                f"notifications_{user_id}",
-                {
-                    'type': 'user_notification', 
-                    'notification': notification_data
-                }
-            )
-            logger.info(f"Notification sent to user {user_id}")
-        except Exception as e:
-            logger.error(f"Error sending user notification: {e}")
+        NotificationService.send_user_notifications([(user_id, notification_data)])
+    
+    @staticmethod
+    def send_user_notifications(notifications, event_type='user_notification'):
+        """Send [(user_id, notification_data)] to each user's notification group"""
+        NotificationService.send_user_events([
+            (user_id, {'type': event_type, 'notification': notification_data})
+            for user_id, notification_data in notifications
+        ])
     
     @staticmethod
-    def notify_mentioned_users(mentioned_users, message_data):
-        """Notify users when they're mentioned in a chat message"""
+    def send_user_events(events):
+        """
+        Send [(user_id, event)] to each user's notification group, all
+        group sends in one trip to the channel layer
+        """
+        if not events:
+            return
         try:
             channel_layer = get_channel_layer()
-            for user_id in mentioned_users:
-                # Send to user's personal notification channel
-                async_to_sync(channel_layer.group_send)(
-                    f"notifications_{user_id}",
-                    {
-                        'type': 'user_notification',
-                        'notification': {
-                            'type': 'mention',
-                            'message': f"You were mentioned in a chat",
-                            'channel_id': message_data.get('channel_id'),
-                            'message_id': message_data.get('id'),
-                            'mentioned_by': message_data.get('user', {}).get('username', 'Someone')
-                        }
-                    }
-                )
-                logger.info(f"Mention notification sent to user {user_id}")
+            
+            async def send_all():
+                await asyncio.gather(*[
+                    channel_layer.group_send(f"notifications_{user_id}", encode_event(event))
+                    for user_id, event in events
+                ])
+            
+            async_to_sync(send_all)()
+            logger.info(f"{len(events)} notification events sent")
         except Exception as e:
-            logger.warning(f"User mention notification failed: {e}")
\ No newline at end of file
+            logger.error(f"Error sending user notifications: {e}")
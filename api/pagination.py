@@ -0,0 +1,112 @@
+# api/pagination.py
+import base64
+import binascii
+import uuid
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+def get_offset_limit(request, default_limit=50, max_limit=100):
+    """Read ?offset= and ?limit= for endpoints that return a plain ranked list"""
+    try:
+        offset = max(int(request.query_params.get('offset', 0)), 0)
+        limit = min(max(int(request.query_params.get('limit', default_limit)), 1), max_limit)
+    except ValueError:
+        raise ValidationError({'error': 'offset and limit must be integers'})
+    return offset, limit
+
+
+def get_seq_range(request, default_limit=50, max_limit=200):
+    """Read the ?after= / ?before= sequence cursors and ?limit= for chat sync"""
+    try:
+        after = request.query_params.get('after')
+        before = request.query_params.get('before')
+        after = max(int(after), 0) if after is not None else None
+        before = max(int(before), 0) if before is not None else None
+        limit = min(max(int(request.query_params.get('limit', default_limit)), 1), max_limit)
+    except ValueError:
+        raise ValidationError({'error': 'after, before and limit must be integers'})
+    if after is not None and before is not None:
+        raise ValidationError({'error': 'Pass either after or before, not both'})
+    return after, before, limit
+
+
+class FeedCursorPagination(BasePagination):
+    """
+    Keyset pagination on (created_at, id), newest first.
+
+    Unlike offset pagination every page is a single index range scan, so
+    deep pages cost the same as the first one. The cursor is an opaque
+    base64 token of the last row's created_at and id.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = queryset.order_by('-created_at', '-id')
+
+        def fetch(cursor, limit):
+            if cursor is not None:
+                return list(queryset.filter(self.cursor_filter(cursor))[:limit])
+            return list(queryset[:limit])
+
+        return self.paginate_fetch(fetch, request)
+
+    def paginate_fetch(self, fetch, request):
+        """
+        Paginate rows returned by `fetch(cursor, limit)`, which must return up
+        to `limit` objects strictly after `cursor` in (-created_at, -id) order.
+        Lets non-queryset sources (e.g. precomputed timelines) share the cursor.
+        """
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+
+        # Fetch one extra row to know whether there is a next page
+        results = fetch(self.cursor, self.page_size + 1)
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        self.next_cursor = self.encode_cursor(results[-1]) if self.has_next else None
+        return results
+
+    @staticmethod
+    def cursor_filter(cursor):
+        created_at, pk = cursor
+        return Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next_cursor': self.next_cursor,
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, obj):
+        raw = f'{obj.created_at.isoformat()}|{obj.pk}'
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            created_at, pk = raw.split('|')
+            created_at = parse_datetime(created_at)
+            pk = uuid.UUID(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
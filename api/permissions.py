@@ -1,14 +1,10 @@
 from rest_framework import permissions
+from .memberships import MembershipService
 
 class IsCommunityAdmin(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if hasattr(obj, 'community'):
-            community = obj.community
-        else:
-            community = obj
-        
-        membership = community.members.filter(user=request.user).first()
-        return membership and membership.role in ['admin', 'moderator']
+        community_id = getattr(obj, 'community_id', obj.pk)
+        return MembershipService.is_admin(request.user, community_id)
 
 class IsChannelAdmin(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -19,11 +15,11 @@ class IsChannelAdmin(permissions.BasePermission):
         if request.method == 'POST':
             channel_id = request.data.get('channel')
             if channel_id:
+                from django.core.exceptions import ValidationError as DjangoValidationError
                 from .models import Channel
                 try:
-                    channel = Channel.objects.get(id=channel_id)
-                    membership = channel.community.members.filter(user=request.user).first()
-                    return membership and membership.role in ['admin', 'moderator']
-                except Channel.DoesNotExist:
+                    community_id = Channel.objects.values_list('community_id', flat=True).get(id=channel_id)
+                except (Channel.DoesNotExist, ValueError, DjangoValidationError):
                     return False
+                return MembershipService.is_admin(request.user, community_id)
         return True
\ No newline at end of file
@@ -0,0 +1,275 @@
+# api/presence.py
+"""
+Who is online, per community and per channel.
+
+Presence is kept out of the database. Each websocket connection registers
+its user in a set of scopes (`community:<id>`, `channel:<id>`) with an
+expiry TTL seconds ahead; clients send a `heartbeat` frame every
+HEARTBEAT_INTERVAL seconds to push the expiry forward. A clean disconnect
+removes the user once their last connection to the scope closes, and a
+connection that dies without closing simply ages out.
+
+ChatConsumer registers the channel and its community; NotificationConsumer
+(the app-wide socket) registers every community the user has joined.
+
+The store is pluggable: LocMemPresenceStore keeps entries in process memory
+(development and single-process deployments), RedisPresenceStore keeps one
+sorted set per scope scored by expiry, so counting who is online is a
+ZCARD after dropping expired members.
+"""
+import logging
+import threading
+import time
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'api.presence.LocMemPresenceStore',
+    'OPTIONS': {},
+    'HEARTBEAT_INTERVAL': 30,  # seconds between client heartbeats
+    'TTL': 75,  # seconds a user stays online without a heartbeat
+}
+
+
+def presence_settings():
+    return {**DEFAULTS, **getattr(settings, 'PRESENCE', {})}
+
+
+def community_scope(community_id):
+    return f'community:{community_id}'
+
+
+def channel_scope(channel_id):
+    return f'channel:{channel_id}'
+
+
+class BasePresenceStore:
+    """
+    A scope is a set of user ids, each with an expiry time. Open
+    connections are counted per (scope, user) so that closing one of two
+    tabs does not take the user offline.
+    """
+    def __init__(self, ttl, **options):
+        self.ttl = ttl
+
+    def connect(self, scopes, user_id):
+        """Count a new connection and mark the user online in each scope"""
+        raise NotImplementedError
+
+    def disconnect(self, scopes, user_id):
+        """Drop a connection; the user goes offline with their last one"""
+        raise NotImplementedError
+
+    def touch(self, scopes, user_id):
+        """Push the user's expiry in each scope TTL seconds ahead"""
+        raise NotImplementedError
+
+    def leave(self, scopes, user_id):
+        """Take the user offline in each scope where no connection is open"""
+        raise NotImplementedError
+
+    def online_counts(self, scopes):
+        """{scope: number of users online}"""
+        raise NotImplementedError
+
+    def online_users(self, scope):
+        raise NotImplementedError
+
+
+class LocMemPresenceStore(BasePresenceStore):
+    def __init__(self, ttl, **options):
+        super().__init__(ttl, **options)
+        self._scopes = {}  # scope -> {user_id: expires_at}
+        self._connections = {}  # (scope, user_id) -> open connections
+        self._lock = threading.Lock()
+
+    def _live(self, scope):
+        entries = self._scopes.get(scope, {})
+        now = time.time()
+        for user_id in [user_id for user_id, expires_at in entries.items() if expires_at <= now]:
+            del entries[user_id]
+            self._connections.pop((scope, user_id), None)
+        return entries
+
+    def connect(self, scopes, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            for scope in scopes:
+                key = (scope, user_id)
+                self._connections[key] = self._connections.get(key, 0) + 1
+        self.touch(scopes, user_id)
+
+    def disconnect(self, scopes, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            for scope in scopes:
+                key = (scope, user_id)
+                remaining = self._connections.get(key, 0) - 1
+                if remaining > 0:
+                    self._connections[key] = remaining
+                else:
+                    self._connections.pop(key, None)
+                    self._scopes.get(scope, {}).pop(user_id, None)
+
+    def touch(self, scopes, user_id):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            for scope in scopes:
+                self._scopes.setdefault(scope, {})[str(user_id)] = expires_at
+
+    def leave(self, scopes, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            for scope in scopes:
+                if not self._connections.get((scope, user_id)):
+                    self._scopes.get(scope, {}).pop(user_id, None)
+
+    def online_counts(self, scopes):
+        with self._lock:
+            return {scope: len(self._live(scope)) for scope in scopes}
+
+    def online_users(self, scope):
+        with self._lock:
+            return list(self._live(scope))
+
+
+class RedisPresenceStore(BasePresenceStore):
+    """
+    `presence:<scope>` is a sorted set of user ids scored by expiry time and
+    `presence:<scope>:connections` a hash of open connections per user.
+    Both keys expire with their newest entry, so idle scopes clean up after
+    themselves.
+    """
+    def __init__(self, ttl, location='redis://localhost:6379/3', **options):
+        import redis
+
+        super().__init__(ttl, **options)
+        self.client = redis.Redis.from_url(location, decode_responses=True)
+
+    def _key(self, scope):
+        return f'presence:{scope}'
+
+    def connect(self, scopes, user_id):
+        with self.client.pipeline(transaction=False) as pipe:
+            for scope in scopes:
+                connections = f'{self._key(scope)}:connections'
+                pipe.hincrby(connections, str(user_id), 1)
+                pipe.expire(connections, self.ttl)
+            pipe.execute()
+        self.touch(scopes, user_id)
+
+    def disconnect(self, scopes, user_id):
+        user_id = str(user_id)
+        with self.client.pipeline(transaction=False) as pipe:
+            for scope in scopes:
+                pipe.hincrby(f'{self._key(scope)}:connections', user_id, -1)
+            remaining = pipe.execute()
+
+        with self.client.pipeline(transaction=False) as pipe:
+            for scope, count in zip(scopes, remaining):
+                if count <= 0:
+                    pipe.hdel(f'{self._key(scope)}:connections', user_id)
+                    pipe.zrem(self._key(scope), user_id)
+            pipe.execute()
+
+    def touch(self, scopes, user_id):
+        expires_at = time.time() + self.ttl
+        with self.client.pipeline(transaction=False) as pipe:
+            for scope in scopes:
+                key = self._key(scope)
+                pipe.zadd(key, {str(user_id): expires_at})
+                pipe.expire(key, self.ttl)
+                pipe.expire(f'{key}:connections', self.ttl)
+            pipe.execute()
+
+    def leave(self, scopes, user_id):
+        user_id = str(user_id)
+        with self.client.pipeline(transaction=False) as pipe:
+            for scope in scopes:
+                pipe.hget(f'{self._key(scope)}:connections', user_id)
+            connections = pipe.execute()
+
+        with self.client.pipeline(transaction=False) as pipe:
+            for scope, count in zip(scopes, connections):
+                if int(count or 0) <= 0:
+                    pipe.zrem(self._key(scope), user_id)
+            pipe.execute()
+
+    def online_counts(self, scopes):
+        scopes = list(scopes)
+        now = time.time()
+        with self.client.pipeline(transaction=False) as pipe:
+            for scope in scopes:
+                pipe.zremrangebyscore(self._key(scope), '-inf', now)
+                pipe.zcard(self._key(scope))
+            results = pipe.execute()
+        return dict(zip(scopes, results[1::2]))
+
+    def online_users(self, scope):
+        return self.client.zrangebyscore(self._key(scope), time.time(), '+inf')
+
+
+@lru_cache(maxsize=None)
+def get_presence_store():
+    config = presence_settings()
+    store_class = import_string(config['BACKEND'])
+    return store_class(config['TTL'], **config['OPTIONS'])
+
+
+class PresenceService:
+    """
+    Presence is best effort: store failures are logged and never break the
+    request or the websocket connection; reads fall back to nobody online.
+    """
+    @staticmethod
+    def connect(scopes, user_id):
+        try:
+            get_presence_store().connect(scopes, user_id)
+        except Exception as e:
+            logger.warning(f"Presence connect failed for user {user_id}: {e}")
+
+    @staticmethod
+    def disconnect(scopes, user_id):
+        try:
+            get_presence_store().disconnect(scopes, user_id)
+        except Exception as e:
+            logger.warning(f"Presence disconnect failed for user {user_id}: {e}")
+
+    @staticmethod
+    def heartbeat(scopes, user_id):
+        try:
+            get_presence_store().touch(scopes, user_id)
+        except Exception as e:
+            logger.warning(f"Presence heartbeat failed for user {user_id}: {e}")
+
+    @staticmethod
+    def leave(scopes, user_id):
+        """Offline for REST clients; an open websocket keeps the user online"""
+        try:
+            get_presence_store().leave(scopes, user_id)
+        except Exception as e:
+            logger.warning(f"Presence leave failed for user {user_id}: {e}")
+
+    @staticmethod
+    def online_count(scope):
+        return PresenceService.online_counts([scope]).get(scope, 0)
+
+    @staticmethod
+    def online_counts(scopes):
+        scopes = list(scopes)
+        try:
+            return get_presence_store().online_counts(scopes)
+        except Exception as e:
+            logger.warning(f"Presence lookup failed: {e}")
+            return dict.fromkeys(scopes, 0)
+
+    @staticmethod
+    def online_user_ids(scope):
+        try:
+            return set(get_presence_store().online_users(scope))
+        except Exception as e:
+            logger.warning(f"Presence lookup failed for {scope}: {e}")
+            return set()
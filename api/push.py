@@ -0,0 +1,248 @@
+# api/push.py
+"""
+Push delivery of notifications to mobile devices over FCM.
+
+New notifications are handed to the send_push_notifications task
+(api/tasks.py) once they are saved. PushService.deliver() groups them per
+recipient, so a user notified several times in one batch gets a single
+"3 new notifications" push, and skips anything already read. Recipients
+whose pushes are identical (everyone mentioned in the same message) share
+multicasts: their active UserFCMToken rows are loaded in one query and
+sent BATCH_SIZE tokens at a time (FCM's multicast limit is 500), with at
+most CONCURRENCY multicasts in flight.
+
+Each token comes back as OK, UNREGISTERED (the app was uninstalled or the
+token rotated; the token is deactivated), RETRY (quota, unavailable or
+timeout; resent with exponential backoff, up to MAX_RETRIES times) or
+FAILED (anything else; logged and dropped).
+
+The transport is pluggable: FirebasePushTransport sends through
+firebase_admin, LocMemPushTransport sends nothing and records the
+multicasts in process memory, with per-token outcomes that can be
+scripted, for development and tests.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .models import Notification, UserFCMToken
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'api.push.LocMemPushTransport',
+    'OPTIONS': {},
+    'BATCH_SIZE': 500,  # tokens per multicast
+    'CONCURRENCY': 4,  # multicasts in flight
+    'MAX_RETRIES': 3,
+    'BACKOFF': 1.0,  # seconds before the first retry, doubled for each one after
+}
+
+OK = 'ok'
+UNREGISTERED = 'unregistered'
+RETRY = 'retry'
+FAILED = 'failed'
+
+TARGET_FIELDS = ('community_id', 'channel_id', 'post_id', 'chat_message_id')
+
+
+def push_settings():
+    return {**DEFAULTS, **getattr(settings, 'PUSH_NOTIFICATIONS', {})}
+
+
+def push_message(notifications):
+    """
+    The push for one user's new notifications (newest first):
+    {'title', 'body', 'data'}, with string data values as FCM requires.
+    """
+    latest = notifications[0]
+    if len(notifications) == 1:
+        data = {'notification_type': latest.notification_type}
+        for field in TARGET_FIELDS:
+            value = getattr(latest, field)
+            if value is not None:
+                data[field] = str(value)
+        return {'title': latest.title, 'body': latest.message, 'data': data}
+    return {
+        'title': f'{len(notifications)} new notifications',
+        'body': latest.message,
+        'data': {'notification_type': 'digest', 'count': str(len(notifications))},
+    }
+
+
+class BasePushTransport:
+    def __init__(self, **options):
+        pass
+
+    def send_multicast(self, tokens, message):
+        """
+        Send `message` ({'title', 'body', 'data'}) to up to 500 tokens;
+        returns one of OK, UNREGISTERED, RETRY or FAILED per token, in order.
+        """
+        raise NotImplementedError
+
+
+class LocMemPushTransport(BasePushTransport):
+    """
+    Sends nothing. Multicasts are kept in `sent` (the latest `max_sent`)
+    and every token succeeds unless outcomes were queued for it with
+    script(token, *outcomes).
+    """
+    def __init__(self, max_sent=1000, **options):
+        self.sent = deque(maxlen=max_sent)
+        self.scripted = {}
+        self.lock = threading.Lock()
+
+    def script(self, token, *outcomes):
+        with self.lock:
+            self.scripted.setdefault(token, deque()).extend(outcomes)
+
+    def reset(self):
+        with self.lock:
+            self.sent.clear()
+            self.scripted.clear()
+
+    def send_multicast(self, tokens, message):
+        with self.lock:
+            self.sent.append({'tokens': list(tokens), 'message': message})
+            return [self._outcome(token) for token in tokens]
+
+    def _outcome(self, token):
+        outcomes = self.scripted.get(token)
+        return outcomes.popleft() if outcomes else OK
+
+
+class FirebasePushTransport(BasePushTransport):
+    """
+    FCM through firebase_admin. `credentials` is the path of a service
+    account file; without it Application Default Credentials are used.
+    """
+    def __init__(self, credentials=None, app_name='circleup-push', dry_run=False, **options):
+        import firebase_admin
+        from firebase_admin import credentials as firebase_credentials, exceptions, messaging
+
+        try:
+            self.app = firebase_admin.get_app(app_name)
+        except ValueError:
+            certificate = (
+                firebase_credentials.Certificate(credentials) if credentials
+                else firebase_credentials.ApplicationDefault()
+            )
+            self.app = firebase_admin.initialize_app(certificate, name=app_name)
+        self.messaging = messaging
+        self.dry_run = dry_run
+        self.unregistered_errors = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+        self.retry_errors = (
+            messaging.QuotaExceededError,
+            exceptions.UnavailableError,
+            exceptions.InternalError,
+            exceptions.DeadlineExceededError,
+        )
+
+    def send_multicast(self, tokens, message):
+        multicast = self.messaging.MulticastMessage(
+            tokens=list(tokens),
+            notification=self.messaging.Notification(title=message['title'], body=message['body']),
+            data=message['data'],
+        )
+        response = self.messaging.send_each_for_multicast(multicast, dry_run=self.dry_run, app=self.app)
+        return [OK if result.success else self.classify(result.exception) for result in response.responses]
+
+    def classify(self, error):
+        if isinstance(error, self.unregistered_errors):
+            return UNREGISTERED
+        if isinstance(error, self.retry_errors):
+            return RETRY
+        logger.warning(f"FCM rejected a push: {error}")
+        return FAILED
+
+
+@lru_cache(maxsize=None)
+def get_push_transport():
+    config = push_settings()
+    transport_class = import_string(config['BACKEND'])
+    return transport_class(**config['OPTIONS'])
+
+
+class PushService:
+    @staticmethod
+    def deliver(notification_ids):
+        """
+        Push the given notifications to their users' devices; returns
+        {'users', 'multicasts', 'sent', 'unregistered', 'failed'}.
+        """
+        config = push_settings()
+        by_user = defaultdict(list)
+        notifications = Notification.objects.filter(id__in=notification_ids, is_read=False).only(
+            'user_id', 'notification_type', 'title', 'message', 'created_at', *TARGET_FIELDS
+        ).order_by('-created_at')
+        for notification in notifications:
+            by_user[notification.user_id].append(notification)
+        messages = {user_id: push_message(user_notifications) for user_id, user_notifications in by_user.items()}
+
+        # Users with identical pushes share multicasts
+        recipients = defaultdict(list)
+        for user_id, token in UserFCMToken.objects.filter(
+            user_id__in=by_user, is_active=True
+        ).values_list('user_id', 'token'):
+            message = messages[user_id]
+            recipients[json.dumps(message, sort_keys=True)].append(token)
+        batches = [
+            (tokens[start:start + config['BATCH_SIZE']], json.loads(key))
+            for key, tokens in recipients.items()
+            for start in range(0, len(tokens), config['BATCH_SIZE'])
+        ]
+
+        outcomes = {}
+        if batches:
+            transport = get_push_transport()
+            with ThreadPoolExecutor(max_workers=min(config['CONCURRENCY'], len(batches))) as executor:
+                for batch_outcomes in executor.map(
+                    lambda batch: PushService.send_batch(transport, *batch, config), batches
+                ):
+                    outcomes.update(batch_outcomes)
+
+        unregistered = [token for token, outcome in outcomes.items() if outcome == UNREGISTERED]
+        PushService.deactivate(unregistered, config)
+        result = {
+            'users': len(by_user),
+            'multicasts': len(batches),
+            'sent': sum(outcome == OK for outcome in outcomes.values()),
+            'unregistered': len(unregistered),
+            'failed': sum(outcome in (RETRY, FAILED) for outcome in outcomes.values()),
+        }
+        if result['failed']:
+            logger.warning(f"Push delivery failed for {result['failed']} of {len(outcomes)} tokens")
+        return result
+
+    @staticmethod
+    def send_batch(transport, tokens, message, config):
+        """Send one multicast, resending RETRY tokens with backoff; {token: outcome}"""
+        outcomes = {}
+        pending = tokens
+        for attempt in range(config['MAX_RETRIES'] + 1):
+            if attempt:
+                time.sleep(config['BACKOFF'] * 2 ** (attempt - 1) * random.uniform(1, 1.5))
+            try:
+                results = transport.send_multicast(pending, message)
+            except Exception as e:
+                logger.warning(f"Push multicast to {len(pending)} tokens failed (attempt {attempt + 1}): {e}")
+                results = [RETRY] * len(pending)
+            outcomes.update(zip(pending, results))
+            pending = [token for token in pending if outcomes[token] == RETRY]
+            if not pending:
+                break
+        return outcomes
+
+    @staticmethod
+    def deactivate(tokens, config):
+        for start in range(0, len(tokens), config['BATCH_SIZE']):
+            UserFCMToken.objects.filter(
+                token__in=tokens[start:start + config['BATCH_SIZE']], is_active=True
+            ).update(is_active=False)
@@ -0,0 +1,72 @@
+# api/rankings.py
+"""
+Materialized community popularity ranking.
+
+The ranking is the ids of the SIZE most-joined communities, stored in the
+cache and refreshed every TTL seconds: lazily on a miss, or ahead of time
+by `manage.py refresh_community_ranking` from cron when CACHES is shared
+between processes. Explore and the suggestions block page through it after
+dropping the user's (small) set of joined communities, then hydrate just
+that page, so neither aggregates over the whole community table per request.
+"""
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from .models import Community
+from .memberships import MembershipService
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SIZE': 1000,
+    'TTL': 600,
+}
+
+
+def ranking_settings():
+    return {**DEFAULTS, **getattr(settings, 'COMMUNITY_RANKING', {})}
+
+
+class CommunityRankingService:
+    CACHE_KEY = 'community_popularity_ranking'
+
+    @staticmethod
+    def refresh():
+        """Recompute the ranking and store it in the cache"""
+        config = ranking_settings()
+        ranking = list(
+            Community.objects.order_by('-member_count', 'id').values_list('id', flat=True)[:config['SIZE']]
+        )
+        cache.set(CommunityRankingService.CACHE_KEY, ranking, config['TTL'])
+        logger.info(f"Community popularity ranking refreshed ({len(ranking)} communities)")
+        return ranking
+
+    @staticmethod
+    def get_ranking():
+        ranking = cache.get(CommunityRankingService.CACHE_KEY)
+        if ranking is None:
+            ranking = CommunityRankingService.refresh()
+        return ranking
+
+    @staticmethod
+    def popular_ids(user, offset=0, limit=10):
+        """Ids of the most popular communities the user has not joined"""
+        joined = set(MembershipService.community_ids(user))
+        ranking = CommunityRankingService.get_ranking()
+        candidates = [community_id for community_id in ranking if community_id not in joined]
+
+        # Past the end of a truncated ranking, page through the table directly
+        if offset + limit > len(candidates) and len(ranking) >= ranking_settings()['SIZE']:
+            return list(
+                Community.objects.exclude(id__in=joined).order_by(
+                    '-member_count', 'id'
+                ).values_list('id', flat=True)[offset:offset + limit]
+            )
+        return candidates[offset:offset + limit]
+
+    @staticmethod
+    def popular_communities(user, offset=0, limit=10):
+        """The page of popular communities, annotated for CommunitySerializer and in ranking order"""
+        ids = CommunityRankingService.popular_ids(user, offset, limit)
+        communities = Community.objects.with_member_stats(user).in_bulk(ids)
+        return [communities[community_id] for community_id in ids if community_id in communities]
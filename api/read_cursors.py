@@ -0,0 +1,246 @@
+# api/read_cursors.py
+"""
+Per-user, per-channel read cursors and unread counts.
+
+Clients report reads as they scroll (`message_read` websocket frames or
+POST /channels/<id>/read/). Reports go to a per-process writer that keeps
+only the newest position per (user, channel) and a background thread
+saves whatever changed every FLUSH_INTERVAL seconds in a few batched
+queries, so scrolling through a hundred messages costs one write.
+Cursors only ever move forward, and never past the channel's last_seq:
+a client reporting a seq beyond the end of the channel is clamped to it,
+so it cannot hide messages that have not been sent yet. If a batch fails
+its cursors are written one at a time, so a bad entry only loses itself.
+
+Unread counts for all of a user's channels come from one query that
+counts each channel's messages past the cursor on the (channel, seq)
+index.
+"""
+import atexit
+import logging
+import threading
+import uuid
+from functools import lru_cache
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from .models import Channel, ChannelReadCursor, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FLUSH_INTERVAL': 2.0,  # seconds
+    'BATCH_SIZE': 500,
+    'MAX_RETRIES': 3,  # flushes to wait for a message id that is not saved yet
+}
+
+
+def read_cursor_settings():
+    return {**DEFAULTS, **getattr(settings, 'READ_CURSORS', {})}
+
+
+class ReadCursorWriter:
+    def __init__(self, flush_interval, batch_size, max_retries):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        # (user_id, channel_id) -> [seq, message_id, attempts]: the highest
+        # seq reported, and the newest reported message id not yet resolved
+        # to a seq (the cursor moves to whichever is further)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='read-cursor-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def record(self, user_id, channel_id, seq=None, message_id=None):
+        """
+        Note a read of `seq` (or of message `message_id`); cheap and
+        non-blocking. Returns False, recording nothing, unless `seq` is an
+        integer >= 0 or `message_id` a UUID.
+        """
+        try:
+            if seq is not None:
+                seq = int(seq)
+            else:
+                message_id = str(uuid.UUID(str(message_id)))
+        except (TypeError, ValueError):
+            return False
+        if seq is not None and seq < 0:
+            return False
+        self.start()
+        with self._lock:
+            self._merge((str(user_id), str(channel_id)), seq, None if seq is not None else message_id)
+        return True
+
+    def _merge(self, key, seq, message_id, attempts=0):
+        """Fold a report into the pending entry for `key`; call with the lock held"""
+        current = self._pending.get(key)
+        if current is None:
+            self._pending[key] = [seq, message_id, attempts]
+            return
+        if seq is not None:
+            current[0] = seq if current[0] is None else max(seq, current[0])
+        # A new report replaces the pending message id; a retried one only
+        # fills the slot if nothing newer was reported meanwhile
+        if message_id is not None and (current[1] is None or not attempts):
+            current[1], current[2] = message_id, attempts
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        close_old_connections()
+        try:
+            retry = self._resolve(pending)
+            resolved = {key: entry[0] for key, entry in pending.items() if entry[0] is not None}
+            keys = list(resolved)
+            for start in range(0, len(keys), self.batch_size):
+                batch = {key: resolved[key] for key in keys[start:start + self.batch_size]}
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.warning(f"Read cursor batch of {len(batch)} cursors failed, retrying singly: {e}")
+                    self._write_singly(batch, pending, retry)
+        except Exception as e:
+            # Keep the cursors for the next flush, up to max_retries times
+            logger.error(f"Read cursor flush of {len(pending)} cursors failed: {e}")
+            retry = {key: [*entry[:2], entry[2] + 1] for key, entry in pending.items() if entry[2] < self.max_retries}
+        finally:
+            close_old_connections()
+
+        with self._lock:
+            for key, entry in retry.items():
+                self._merge(key, *entry)
+
+    def _resolve(self, pending):
+        """Turn reported message ids into seqs; returns entries to retry later"""
+        message_ids = {entry[1] for entry in pending.values() if entry[1] is not None}
+        if not message_ids:
+            return {}
+        seqs = {
+            (str(pk), str(channel_id)): seq
+            for pk, channel_id, seq in ChatMessage.objects.filter(
+                id__in=message_ids
+            ).values_list('id', 'channel_id', 'seq')
+        }
+        retry = {}
+        for key, entry in pending.items():
+            if entry[1] is None:
+                continue
+            seq = seqs.get((entry[1], key[1]))
+            if seq is not None:
+                entry[0] = seq if entry[0] is None else max(seq, entry[0])
+            elif entry[2] < self.max_retries:
+                # The message may still be queued in the chat writer; any
+                # seq already known is written meanwhile
+                retry[key] = [None, entry[1], entry[2] + 1]
+            entry[1] = None
+        return retry
+
+    def _write_singly(self, cursors, pending, retry):
+        """Write a failed batch one cursor at a time, queueing failures to retry"""
+        for key, seq in cursors.items():
+            try:
+                self._write({key: seq})
+            except Exception as e:
+                attempts = pending[key][2]
+                if attempts < self.max_retries:
+                    retry[key] = [seq, None, attempts + 1]
+                else:
+                    logger.error(f"Dropping read cursor {key} at seq {seq}: {e}")
+
+    def _write(self, cursors):
+        user_ids = {user_id for user_id, _ in cursors}
+        channel_ids = {channel_id for _, channel_id in cursors}
+        with transaction.atomic():
+            last_seqs = {
+                str(channel_id): last_seq
+                for channel_id, last_seq in Channel.objects.filter(id__in=channel_ids).values_list('id', 'last_seq')
+            }
+            existing = {
+                (str(cursor.user_id), str(cursor.channel_id)): cursor
+                for cursor in ChannelReadCursor.objects.select_for_update().filter(
+                    user_id__in=user_ids, channel_id__in=channel_ids
+                )
+            }
+            created, updated = [], []
+            for (user_id, channel_id), seq in cursors.items():
+                if channel_id not in last_seqs:
+                    continue  # the channel was deleted
+                seq = min(seq, last_seqs[channel_id])
+                cursor = existing.get((user_id, channel_id))
+                if cursor is None:
+                    created.append(ChannelReadCursor(user_id=user_id, channel_id=channel_id, last_read_seq=seq))
+                elif seq > cursor.last_read_seq:
+                    cursor.last_read_seq = seq
+                    cursor.updated_at = timezone.now()  # bulk_update skips auto_now
+                    updated.append(cursor)
+            ChannelReadCursor.objects.bulk_create(created, ignore_conflicts=True)
+            ChannelReadCursor.objects.bulk_update(updated, ['last_read_seq', 'updated_at'])
+            if created:
+                self._advance_conflicts(created)
+
+    def _advance_conflicts(self, created):
+        """Move cursors a concurrent flush created first (ours were ignored) forward"""
+        wanted = {(str(cursor.user_id), str(cursor.channel_id)): cursor.last_read_seq for cursor in created}
+        for user_id, channel_id, last_read_seq in ChannelReadCursor.objects.filter(
+            user_id__in={cursor.user_id for cursor in created},
+            channel_id__in={cursor.channel_id for cursor in created},
+        ).values_list('user_id', 'channel_id', 'last_read_seq'):
+            seq = wanted.get((str(user_id), str(channel_id)))
+            if seq is not None and last_read_seq < seq:
+                ChannelReadCursor.objects.filter(user_id=user_id, channel_id=channel_id).update(
+                    last_read_seq=Greatest('last_read_seq', Value(seq)),
+                    updated_at=timezone.now(),
+                )
+
+
+@lru_cache(maxsize=None)
+def get_read_cursor_writer():
+    config = read_cursor_settings()
+    return ReadCursorWriter(config['FLUSH_INTERVAL'], config['BATCH_SIZE'], config['MAX_RETRIES'])
+
+
+class ReadCursorService:
+    @staticmethod
+    def unread_counts(channels, user):
+        """
+        Annotate `channels` with the user's last_read_seq and unread_count
+        (other people's live messages past the cursor) in a single query.
+        """
+        last_read = Coalesce(
+            Subquery(
+                ChannelReadCursor.objects.filter(
+                    channel=OuterRef('pk'), user=user
+                ).values('last_read_seq')[:1]
+            ),
+            Value(0)
+        )
+        unread = ChatMessage.objects.filter(
+            channel=OuterRef('pk'),
+            seq__gt=OuterRef('last_read_seq'),
+            is_deleted=False
+        ).exclude(user=user).order_by().values('channel').annotate(total=Count('pk')).values('total')
+        return channels.annotate(last_read_seq=last_read).annotate(
+            unread_count=Coalesce(Subquery(unread), Value(0))
+        )
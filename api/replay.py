@@ -0,0 +1,147 @@
+# api/replay.py
+"""
+Replay of missed chat events for reconnecting websockets.
+
+Every chat_message event sent to a `chat_<channel_id>` group is also
+appended to a bounded per-room ring buffer (the last SIZE events). A client
+that reconnects with `?last_seen=<message id>` gets the events after that
+message replayed from the buffer. If the buffer no longer holds it, the
+gap is read from the database as a single (channel, seq) range query. Only
+if that is more than MAX_REPLAY messages, or the message is unknown, is
+the client told to resync over the REST messages endpoint.
+
+The buffer is pluggable: LocMemReplayBuffer keeps rooms in process memory
+(pairs with the in-memory channel layer), RedisReplayBuffer keeps a capped
+list per room so every worker, and a freshly deployed one, sees the same
+history.
+"""
+import json
+import logging
+import threading
+from collections import deque
+from functools import lru_cache
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BACKEND': 'api.replay.LocMemReplayBuffer',
+    'OPTIONS': {},
+    'SIZE': 200,  # events kept per room
+    'MAX_REPLAY': 500,  # beyond this the client resyncs over REST
+}
+
+
+def replay_settings():
+    return {**DEFAULTS, **getattr(settings, 'CHAT_REPLAY', {})}
+
+
+def chat_message_event(message):
+    """The chat_message group event for a saved or pending ChatMessage"""
+    user = message.user
+    return {
+        'type': 'chat_message',
+        'message': {
+            'id': str(message.id),
+            'user_id': str(user.id),
+            'username': user.username,
+            'profile_pic': user.profile_pic.url if user.profile_pic else None,
+            'message': message.message,
+            'timestamp': message.created_at.isoformat(),
+            'type': 'chat_message'
+        }
+    }
+
+
+def event_id(event):
+    return event['message']['id']
+
+
+class BaseReplayBuffer:
+    def __init__(self, size, **options):
+        self.size = size
+
+    def append(self, room, event):
+        raise NotImplementedError
+
+    def events(self, room):
+        """Buffered events for a room, oldest first"""
+        raise NotImplementedError
+
+
+class LocMemReplayBuffer(BaseReplayBuffer):
+    def __init__(self, size, **options):
+        super().__init__(size, **options)
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def append(self, room, event):
+        with self._lock:
+            if room not in self._rooms:
+                self._rooms[room] = deque(maxlen=self.size)
+            self._rooms[room].append(event)
+
+    def events(self, room):
+        with self._lock:
+            return list(self._rooms.get(room, ()))
+
+
+class RedisReplayBuffer(BaseReplayBuffer):
+    """
+    One capped list per room (`replay:<room>`) of JSON-encoded events that
+    expires TTL seconds after the room's last message.
+    """
+    def __init__(self, size, location='redis://localhost:6379/4', ttl=24 * 3600, **options):
+        import redis
+
+        super().__init__(size, **options)
+        self.client = redis.Redis.from_url(location, decode_responses=True)
+        self.ttl = ttl
+
+    def _key(self, room):
+        return f'replay:{room}'
+
+    def append(self, room, event):
+        key = self._key(room)
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.rpush(key, json.dumps(event))
+            pipe.ltrim(key, -self.size, -1)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def events(self, room):
+        return [json.loads(event) for event in self.client.lrange(self._key(room), 0, -1)]
+
+
+@lru_cache(maxsize=None)
+def get_replay_buffer():
+    config = replay_settings()
+    buffer_class = import_string(config['BACKEND'])
+    return buffer_class(config['SIZE'], **config['OPTIONS'])
+
+
+class ReplayService:
+    """Buffer failures are logged; a reconnect then falls back to the database"""
+    @staticmethod
+    def record(room, event):
+        try:
+            get_replay_buffer().append(room, event)
+        except Exception as e:
+            logger.warning(f"Replay buffer append failed for {room}: {e}")
+
+    @staticmethod
+    def events(room):
+        try:
+            return get_replay_buffer().events(room)
+        except Exception as e:
+            logger.warning(f"Replay buffer read failed for {room}: {e}")
+            return []
+
+    @staticmethod
+    def since(events, last_seen):
+        """Events after message `last_seen`, or None if it is not among them"""
+        for index, event in enumerate(events):
+            if event_id(event) == last_seen:
+                return events[index + 1:]
+        return None
@@ -0,0 +1,205 @@
+# api/search.py
+"""
+Ranked full-text search over communities, posts and chat messages.
+
+On SQLite each searchable model has an FTS5 table (api_<name>_fts) that is
+kept in sync by the post_save/post_delete signals in api/signals.py. The
+FTS rowid is derived from the object's UUID so updates and deletes are
+rowid lookups; the UUID itself and the ids used for access control are
+stored in UNINDEXED columns. On PostgreSQL the same searches run against
+GIN expression indexes on to_tsvector() and need no sync at all.
+
+`manage.py rebuild_search_index` (re)populates the FTS tables.
+"""
+import logging
+import re
+import uuid
+from django.db import connection
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from .models import ChatMessage, Community, Post
+
+logger = logging.getLogger(__name__)
+
+
+class SearchIndex:
+    def __init__(self, name, model, fields, filters=(), weights=None):
+        self.name = name
+        self.model = model
+        self.fields = list(fields)
+        self.filters = list(filters)
+        self.weights = weights or {}
+        self.table = f'api_{name}_fts'
+
+    def columns(self):
+        return ['object_id', *self.filters, *self.fields]
+
+    def values(self, obj):
+        filter_values = [getattr(obj, column).hex for column in self.filters]
+        return [obj.pk.hex, *filter_values, *(getattr(obj, field) or '' for field in self.fields)]
+
+
+SEARCH_INDEXES = {
+    'community': SearchIndex(
+        'community', Community, ['name', 'bio', 'location'], weights={'name': 4.0, 'location': 2.0}
+    ),
+    'post': SearchIndex('post', Post, ['caption'], filters=['community_id']),
+    'chat_message': SearchIndex('chat_message', ChatMessage, ['message'], filters=['channel_id']),
+}
+
+
+def get_index(model):
+    for index in SEARCH_INDEXES.values():
+        if isinstance(model, index.model) or model is index.model:
+            return index
+    return None
+
+
+def tokenize(query):
+    return re.findall(r'\w+', query or '')[:16]
+
+
+def fts_rowid(pk):
+    """Stable 63-bit FTS rowid for a UUID primary key"""
+    return uuid.UUID(str(pk)).int >> 65
+
+
+class SQLiteSearchBackend:
+    def match_expression(self, tokens):
+        # Every term must match; the last one is a prefix (search-as-you-type)
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def index(self, obj):
+        index = get_index(obj)
+        columns = ', '.join(['rowid', *index.columns()])
+        placeholders = ', '.join(['%s'] * (len(index.columns()) + 1))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {index.table} WHERE rowid = %s', [fts_rowid(obj.pk)])
+            cursor.execute(
+                f'INSERT INTO {index.table} ({columns}) VALUES ({placeholders})',
+                [fts_rowid(obj.pk), *index.values(obj)]
+            )
+
+    def index_many(self, objs):
+        objs = list(objs)
+        if not objs:
+            return
+        index = get_index(objs[0])
+        columns = ', '.join(['rowid', *index.columns()])
+        placeholders = ', '.join(['%s'] * (len(index.columns()) + 1))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {index.table} WHERE rowid = %s',
+                [[fts_rowid(obj.pk)] for obj in objs]
+            )
+            cursor.executemany(
+                f'INSERT INTO {index.table} ({columns}) VALUES ({placeholders})',
+                [[fts_rowid(obj.pk), *index.values(obj)] for obj in objs]
+            )
+
+    def remove(self, obj):
+        index = get_index(obj)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {index.table} WHERE rowid = %s', [fts_rowid(obj.pk)])
+
+    def clear(self, index):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {index.table}')
+
+    def search(self, index, tokens, filters=None, offset=0, limit=20):
+        where = [f'{index.table} MATCH %s']
+        params = [self.match_expression(tokens)]
+        for column, values in (filters or {}).items():
+            values = [uuid.UUID(str(value)).hex for value in values]
+            if not values:
+                return []
+            where.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+
+        # bm25() takes one weight per column, UNINDEXED ones included
+        weights = ', '.join(str(index.weights.get(column, 1.0)) for column in index.columns())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT object_id FROM {index.table} WHERE {' AND '.join(where)} "
+                f"ORDER BY bm25({index.table}, {weights}) LIMIT %s OFFSET %s",
+                [*params, limit, offset]
+            )
+            return [uuid.UUID(row[0]) for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    """Queries must use the exact expressions the migration indexed"""
+
+    def vector_sql(self, index):
+        document = " || ' ' || ".join(f"coalesce({field}, '')" for field in index.fields)
+        return f"to_tsvector('simple', {document})"
+
+    def index(self, obj):
+        pass
+
+    def index_many(self, objs):
+        pass
+
+    def remove(self, obj):
+        pass
+
+    def clear(self, index):
+        pass
+
+    def search(self, index, tokens, filters=None, offset=0, limit=20):
+        query = ' & '.join(tokens) + ':*'
+        vector = self.vector_sql(index)
+        queryset = index.model.objects.filter(
+            RawSQL(f"{vector} @@ to_tsquery('simple', %s)", [query], output_field=BooleanField())
+        )
+        for column, values in (filters or {}).items():
+            queryset = queryset.filter(**{f'{column}__in': values})
+        queryset = queryset.annotate(
+            rank=RawSQL(f"ts_rank({vector}, to_tsquery('simple', %s))", [query], output_field=FloatField())
+        ).order_by('-rank', '-pk')
+        return list(queryset.values_list('pk', flat=True)[offset:offset + limit])
+
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SQLiteSearchBackend()
+
+
+class SearchService:
+    @staticmethod
+    def index(obj):
+        try:
+            get_search_backend().index(obj)
+        except Exception as e:
+            logger.warning(f"Search indexing failed for {type(obj).__name__} {obj.pk}: {e}")
+
+    @staticmethod
+    def index_many(objs):
+        try:
+            get_search_backend().index_many(objs)
+        except Exception as e:
+            logger.warning(f"Bulk search indexing failed: {e}")
+
+    @staticmethod
+    def remove(obj):
+        try:
+            get_search_backend().remove(obj)
+        except Exception as e:
+            logger.warning(f"Search index removal failed for {type(obj).__name__} {obj.pk}: {e}")
+
+    @staticmethod
+    def search(name, query, filters=None, offset=0, limit=20):
+        """Ranked ids of `name` objects matching `query`"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        return get_search_backend().search(SEARCH_INDEXES[name], tokens, filters, offset, limit)
+
+    @staticmethod
+    def hydrate(queryset, ids):
+        """Load `ids` from `queryset` in one query, keeping their ranked order"""
+        objs = queryset.in_bulk(ids)
+        return [objs[pk] for pk in ids if pk in objs]
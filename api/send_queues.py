@@ -0,0 +1,199 @@
+# api/send_queues.py
+"""
+Bounded per-connection outbound queues for websocket consumers.
+
+Consumers hand events to their SendQueue instead of awaiting
+`self.send()` inline; a writer task per connection drains the queue to
+the socket. A client on a slow link therefore only backs up its own
+queue, while the consumer keeps reading its channel-layer inbox and the
+rest of the room is unaffected.
+
+Queued events follow a drop policy:
+
+- typing rosters, join/leave events and unread badge counts are
+  coalesced: a newer event replaces the pending one with the same key in
+  place, so a stalled client gets the latest state once rather than
+  every change;
+- read receipts are dropped once the queue is over HIGH_WATER;
+- chat messages, notifications and everything else are never dropped.
+
+A connection whose queue stays over HIGH_WATER for EVICT_AFTER seconds,
+or reaches MAX_SIZE, is closed with code 4008 and a reason carrying the
+id of the last chat message it was sent (`slow_consumer last_seen=<id>`),
+so the client can reconnect with `?last_seen=` and have the gap replayed
+(api/replay.py).
+
+Per-process queue depth, drop, coalesce and eviction counters are kept
+in `metrics` and served to staff at /api/metrics/websockets/.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from collections import Counter, deque
+from django.conf import settings
+
+DEFAULTS = {
+    'MAX_SIZE': 1000,  # events; reaching it evicts the connection
+    'HIGH_WATER': 200,  # events; above it receipts are dropped and the eviction clock runs
+    'EVICT_AFTER': 10.0,  # seconds over HIGH_WATER before the connection is closed
+}
+
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+# Event types whose newest pending event supersedes older ones
+COALESCED = {
+    'typing_users': lambda event: ('typing_users',),
+    'user_typing': lambda event: ('user_typing', event.get('user_id')),
+    'user_joined': lambda event: ('presence', event.get('user_id')),
+    'user_left': lambda event: ('presence', event.get('user_id')),
+    'unread_count': lambda event: ('unread_count',),
+}
+
+# Event types that may be dropped under pressure
+DROPPABLE = {'message_read'}
+
+
+def send_queue_settings():
+    return {**DEFAULTS, **getattr(settings, 'WEBSOCKET_SEND_QUEUE', {})}
+
+
+def coalesce_key(event):
+    key = COALESCED.get(event['type'])
+    return key(event) if key is not None else None
+
+
+def slow_consumer_reason(last_seen):
+    return f'slow_consumer last_seen={last_seen}' if last_seen else 'slow_consumer'
+
+
+class SendQueueMetrics:
+    def __init__(self):
+        self._queues = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = Counter()
+        self.evicted = 0
+        self.max_depth = 0
+
+    def opened(self, queue):
+        with self._lock:
+            self._queues.add(queue)
+
+    def closed(self, queue):
+        with self._lock:
+            self._queues.discard(queue)
+
+    def observe(self, depth):
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def snapshot(self):
+        with self._lock:
+            depths = [len(queue) for queue in list(self._queues)]
+        return {
+            'connections': len(depths),
+            'queued': sum(depths),
+            'deepest_queue': max(depths, default=0),
+            'max_depth_seen': self.max_depth,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': dict(self.dropped),
+            'evicted': self.evicted,
+        }
+
+
+metrics = SendQueueMetrics()
+
+
+class SendQueue:
+    def __init__(self, send, max_size, high_water, evict_after):
+        self._send = send  # async callable taking an encoded event
+        self.max_size = max_size
+        self.high_water = high_water
+        self.evict_after = evict_after
+        self._entries = deque()  # [key, event]
+        self._pending = {}  # coalesce key -> queued entry
+        self._ready = asyncio.Event()
+        self._over_since = None
+        self._task = None
+        self.closed = False
+        self.last_seen = None  # id of the last chat message written to the socket
+
+    def __len__(self):
+        return len(self._entries)
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+        metrics.opened(self)
+
+    def put(self, event):
+        """
+        Queue an encoded event without waiting for the socket. Returns False
+        when the connection should be evicted as a slow consumer.
+        """
+        if self.closed:
+            return True
+        key = coalesce_key(event)
+        if key is not None and key in self._pending:
+            self._pending[key][1] = event
+            metrics.coalesced += 1
+            return True
+        depth = len(self._entries)
+        if depth >= self.high_water and event['type'] in DROPPABLE:
+            metrics.dropped[event['type']] += 1
+            return True
+
+        entry = [key, event]
+        self._entries.append(entry)
+        if key is not None:
+            self._pending[key] = entry
+        self._ready.set()
+        depth += 1
+        metrics.observe(depth)
+
+        if depth >= self.max_size:
+            return False
+        if depth > self.high_water:
+            now = time.monotonic()
+            if self._over_since is None:
+                self._over_since = now
+            elif now - self._over_since >= self.evict_after:
+                return False
+        return True
+
+    async def _run(self):
+        while True:
+            if not self._entries:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            entry = self._entries.popleft()
+            key, event = entry
+            if key is not None and self._pending.get(key) is entry:
+                del self._pending[key]
+            await self._send(event)
+            metrics.sent += 1
+            if event.get('message_id'):
+                self.last_seen = event['message_id']
+            if len(self._entries) <= self.high_water:
+                self._over_since = None
+
+    async def stop(self):
+        self.closed = True
+        self._entries.clear()
+        self._pending.clear()
+        metrics.closed(self)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+
+def create_send_queue(send):
+    config = send_queue_settings()
+    return SendQueue(send, config['MAX_SIZE'], config['HIGH_WATER'], config['EVICT_AFTER'])
@@ -1,6 +1,10 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from .models import *
+from .timelines import TimelineService
+from .presence import PresenceService, community_scope
+from .memberships import MembershipService
+from .notification_builder import NotificationBuilder
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -62,9 +66,31 @@ class ResetPasswordSerializer(serializers.Serializer):
             raise serializers.ValidationError("Passwords don't match")
         return attrs
 
+class CommunityListSerializer(serializers.ListSerializer):
+    # Look up online counts for the whole page in one presence store call
+    def to_representation(self, data):
+        communities = list(data.all() if hasattr(data, 'all') else data)
+        counts = PresenceService.online_counts(community_scope(community.id) for community in communities)
+        for community in communities:
+            community.online_count = counts.get(community_scope(community.id), 0)
+        return super().to_representation(communities)
+
+class NestedCommunityListSerializer(serializers.ListSerializer):
+    # Posts and events nest their community: look up the online counts of
+    # the page's distinct communities in one presence store call and share
+    # them with the nested CommunitySerializers through the context
+    def to_representation(self, data):
+        items = list(data.all() if hasattr(data, 'all') else data)
+        scopes = {community_scope(item.community_id) for item in items}
+        self.context['online_counts'] = {
+            **self.context.get('online_counts', {}),
+            **PresenceService.online_counts(scopes),
+        }
+        return super().to_representation(items)
+
 class CommunitySerializer(serializers.ModelSerializer):
     created_by = UserSerializer(read_only=True)
-    member_count = serializers.SerializerMethodField()
+    member_count = serializers.IntegerField(read_only=True)
     online_count = serializers.SerializerMethodField()
     is_member = serializers.SerializerMethodField()
     user_role = serializers.SerializerMethodField()
@@ -72,25 +98,33 @@ class CommunitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Community
         fields = '__all__'
+        list_serializer_class = CommunityListSerializer
     
-    def get_member_count(self, obj):
-        return obj.members.count()
-    
+    # is_member / user_role come from the requesting user's cached membership
+    # map, looked up once per response. online_count comes from the presence
+    # store, batched per page by CommunityListSerializer (or, when nested, by
+    # NestedCommunityListSerializer).
     def get_online_count(self, obj):
-        return obj.members.filter(is_online=True).count()
+        if hasattr(obj, 'online_count'):
+            return obj.online_count
+        scope = community_scope(obj.id)
+        online_counts = self.context.get('online_counts', {})
+        if scope in online_counts:
+            return online_counts[scope]
+        return PresenceService.online_count(scope)
+    
+    def get_membership_roles(self):
+        # Shared by every CommunitySerializer in the response (lists, nested)
+        if 'membership_roles' not in self.context:
+            request = self.context.get('request')
+            self.context['membership_roles'] = MembershipService.roles(request.user if request else None)
+        return self.context['membership_roles']
     
     def get_is_member(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return obj.members.filter(user=request.user).exists()
-        return False
+        return obj.id in self.get_membership_roles()
     
     def get_user_role(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            membership = obj.members.filter(user=request.user).first()
-            return membership.role if membership else None
-        return None
+        return self.get_membership_roles().get(obj.id)
 
 class ChannelSerializer(serializers.ModelSerializer):
     created_by = UserSerializer(read_only=True)
@@ -105,8 +139,8 @@ class ChannelSerializer(serializers.ModelSerializer):
 class PostSerializer(serializers.ModelSerializer):
     posted_by = UserSerializer(read_only=True)
     community = CommunitySerializer(read_only=True)  # Changed from channel to community
-    like_count = serializers.SerializerMethodField()
-    reaction_count = serializers.SerializerMethodField()
+    like_count = serializers.IntegerField(read_only=True)
+    reaction_count = serializers.IntegerField(read_only=True)
     user_liked = serializers.SerializerMethodField()
     user_reaction = serializers.SerializerMethodField()
     community_uuid = serializers.UUIDField(write_only=True)  # Changed from channel_uuid to community_uuid
@@ -119,6 +153,7 @@ class PostSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'posted_by', 'created_at', 'updated_at', 'community']
+        list_serializer_class = NestedCommunityListSerializer
     
     def create(self, validated_data):
         # Get the current user from the request context
@@ -138,24 +173,27 @@ class PostSerializer(serializers.ModelSerializer):
             **validated_data
         )
         
+        # Push onto members' precomputed home timelines (no-op when disabled)
+        TimelineService.fan_out(post)
+        
         return post
 
     # Remove the get_community method since we now have community as a direct field
     # Keep the other methods (like_count, reaction_count, etc.) the same
     
-    def get_like_count(self, obj):
-        return obj.likes.count()
-    
-    def get_reaction_count(self, obj):
-        return obj.reactions.count()
-    
+    # user_liked / user_reaction come from Post.objects.for_feed() annotations
+    # when present.
     def get_user_liked(self, obj):
+        if hasattr(obj, 'user_liked'):
+            return obj.user_liked
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.likes.filter(user=request.user).exists()
         return False
     
     def get_user_reaction(self, obj):
+        if hasattr(obj, 'user_reaction'):
+            return obj.user_reaction
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             reaction = obj.reactions.filter(user=request.user).first()
@@ -166,7 +204,7 @@ class EventSerializer(serializers.ModelSerializer):
     created_by = UserSerializer(read_only=True)
     community = CommunitySerializer(read_only=True)
     channel = ChannelSerializer(read_only=True)
-    participant_count = serializers.SerializerMethodField()
+    participant_count = serializers.IntegerField(read_only=True)
     is_participant = serializers.SerializerMethodField()
     
     # Add these fields for creation
@@ -184,9 +222,7 @@ class EventSerializer(serializers.ModelSerializer):
             'is_participant', 'created_at'  # REMOVED 'updated_at' from here
         ]
         read_only_fields = ['id', 'created_by', 'created_at', 'community', 'channel']  # REMOVED 'updated_at' from here too
-    
-    def get_participant_count(self, obj):
-        return obj.participants.count()
+        list_serializer_class = NestedCommunityListSerializer
     
     def get_is_participant(self, obj):
         request = self.context.get('request')
@@ -270,7 +306,7 @@ class ChatMessageSerializer(serializers.ModelSerializer):
     reply_to = serializers.PrimaryKeyRelatedField(queryset=ChatMessage.objects.all(), required=False, allow_null=True)
     mentions = UserSerializer(many=True, read_only=True)
     reactions = ChatReactionSerializer(many=True, read_only=True)
-    reaction_count = serializers.SerializerMethodField()
+    reaction_count = serializers.IntegerField(read_only=True)
     user_reacted = serializers.SerializerMethodField()
     
     class Meta:
@@ -278,12 +314,10 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'channel', 'user', 'message', 'reply_to', 'mentions', 
             'reactions', 'reaction_count', 'user_reacted',
+            'seq', 'change_seq', 'is_deleted',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'user', 'created_at', 'updated_at', 'mentions']
-    
-    def get_reaction_count(self, obj):
-        return obj.reactions.count()
+        read_only_fields = ['id', 'user', 'created_at', 'updated_at', 'mentions', 'is_deleted']
     
     def get_user_reacted(self, obj):
         request = self.context.get('request')
@@ -303,21 +337,11 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         
         # Add mentions
         if mentioned_users:
-            users_to_mention = User.objects.filter(id__in=mentioned_users)
-            message.mentions.set(users_to_mention)
+            mentioned_ids = list(User.objects.filter(id__in=mentioned_users).values_list('id', flat=True))
+            message.mentions.set(mentioned_ids)
             
-            # Create notifications for mentioned users
-            for mentioned_user in users_to_mention:
-                if mentioned_user != request.user:  # Don't notify self
-                    Notification.objects.create(
-                        user=mentioned_user,
-                        notification_type='chat_mention',
-                        title=f"You were mentioned by {request.user.username}",
-                        message=f"{request.user.username} mentioned you in {message.channel.name}",
-                        community=message.channel.community,
-                        channel=message.channel,
-                        chat_message=message
-                    )
+            # One insert for every mentioned user (but not yourself)
+            NotificationBuilder(actor=request.user).add_chat_mentions(message, mentioned_ids).save()
         
         return message
 
@@ -353,21 +377,11 @@ class ChatMessageCreateSerializer(serializers.ModelSerializer):
         
         # Add mentions to the message
         if mentioned_users:
-            users_to_mention = User.objects.filter(id__in=mentioned_users)
-            message.mentions.set(users_to_mention)
+            mentioned_ids = list(User.objects.filter(id__in=mentioned_users).values_list('id', flat=True))
+            message.mentions.set(mentioned_ids)
             
-            # Create notifications for mentioned users
-            for mentioned_user in users_to_mention:
-                if mentioned_user != request.user:  # Don't notify self
-                    Notification.objects.create(
-                        user=mentioned_user,
-                        notification_type='chat_mention',
-                        title=f"You were mentioned by {request.user.username}",
-                        message=f"{request.user.username} mentioned you in {message.channel.name}",
-                        community=message.channel.community,
-                        channel=message.channel,
-                        chat_message=message
-                    )
+            # One insert for every mentioned user (but not yourself)
+            NotificationBuilder(actor=request.user).add_chat_mentions(message, mentioned_ids).save()
         
         return message
 
@@ -402,30 +416,107 @@ class ChatMessageReplySerializer(serializers.ModelSerializer):
         
         # Add mentions to the message
         if mentioned_users:
-            users_to_mention = User.objects.filter(id__in=mentioned_users)
-            message.mentions.set(users_to_mention)
+            mentioned_ids = list(User.objects.filter(id__in=mentioned_users).values_list('id', flat=True))
+            message.mentions.set(mentioned_ids)
             
-            # Create notifications for mentioned users
-            for mentioned_user in users_to_mention:
-                if mentioned_user != request.user:  # Don't notify self
-                    Notification.objects.create(
-                        user=mentioned_user,
-                        notification_type='chat_mention',
-                        title=f"You were mentioned by {request.user.username}",
-                        message=f"{request.user.username} mentioned you in {message.channel.name}",
-                        community=message.channel.community,
-                        channel=message.channel,
-                        chat_message=message
-                    )
+            # One insert for every mentioned user (but not yourself)
+            NotificationBuilder(actor=request.user).add_chat_mentions(message, mentioned_ids).save()
         
         return message
 
+def file_url(field):
+    return field.url if field else None
+
+def excerpt(text, length=100):
+    return text if len(text) <= length else text[:length - 1].rstrip() + '…'
+
+class NotificationListSerializer(serializers.ListSerializer):
+    # Look up the profile pictures of every actor on the page in one query
+    def to_representation(self, data):
+        notifications = list(data.all() if hasattr(data, 'all') else data)
+        actor_ids = {actor['id'] for notification in notifications for actor in notification.latest_actors}
+        self.child.context['actor_pics'] = {
+            str(pk): pic for pk, pic in User.objects.filter(id__in=actor_ids).values_list('id', 'profile_pic')
+        }
+        return super().to_representation(notifications)
+
 class NotificationSerializer(serializers.ModelSerializer):
-    community = CommunitySerializer(read_only=True)
-    channel = ChannelSerializer(read_only=True)
-    post = PostSerializer(read_only=True)
-    chat_message = ChatMessageSerializer(read_only=True)
+    """
+    Compact representation: the referenced community, channel, post and
+    chat message are summarized (ids, names, thumbnails, an excerpt) from
+    the select_related row rather than nested in full, and `target` says
+    where the notification should open.
+    """
+    community = serializers.SerializerMethodField()
+    channel = serializers.SerializerMethodField()
+    post = serializers.SerializerMethodField()
+    chat_message = serializers.SerializerMethodField()
+    latest_actors = serializers.SerializerMethodField()
+    target = serializers.SerializerMethodField()
     
     class Meta:
         model = Notification
-        fields = '__all__'
+        fields = [
+            'id', 'notification_type', 'title', 'message', 'is_read', 'created_at',
+            'actor_count', 'latest_actors', 'community', 'channel', 'post', 'chat_message', 'target'
+        ]
+        list_serializer_class = NotificationListSerializer
+    
+    def get_community(self, obj):
+        if obj.community_id is None:
+            return None
+        return {
+            'id': obj.community_id,
+            'name': obj.community.name,
+            'profile_pic': file_url(obj.community.profile_pic),
+        }
+    
+    def get_channel(self, obj):
+        if obj.channel_id is None:
+            return None
+        return {'id': obj.channel_id, 'name': obj.channel.name}
+    
+    def get_post(self, obj):
+        if obj.post_id is None:
+            return None
+        return {
+            'id': obj.post_id,
+            'image': file_url(obj.post.image),
+            'caption': excerpt(obj.post.caption),
+        }
+    
+    def get_chat_message(self, obj):
+        if obj.chat_message_id is None:
+            return None
+        message = obj.chat_message
+        return {
+            'id': obj.chat_message_id,
+            'seq': message.seq,
+            'message': None if message.is_deleted else excerpt(message.message),
+        }
+    
+    def get_latest_actors(self, obj):
+        actor_pics = self.context.get('actor_pics')
+        if actor_pics is None:
+            actor_pics = {
+                str(pk): pic for pk, pic in User.objects.filter(
+                    id__in=[actor['id'] for actor in obj.latest_actors]
+                ).values_list('id', 'profile_pic')
+            }
+        storage = User._meta.get_field('profile_pic').storage
+        return [
+            {**actor, 'profile_pic': storage.url(actor_pics[actor['id']]) if actor_pics.get(actor['id']) else None}
+            for actor in obj.latest_actors
+        ]
+    
+    def get_target(self, obj):
+        # Deep link, most specific first
+        if obj.chat_message_id is not None:
+            return {'type': 'chat_message', 'channel_id': obj.channel_id, 'message_id': obj.chat_message_id}
+        if obj.post_id is not None:
+            return {'type': 'post', 'community_id': obj.community_id, 'post_id': obj.post_id}
+        if obj.channel_id is not None:
+            return {'type': 'channel', 'channel_id': obj.channel_id}
+        if obj.community_id is not None:
+            return {'type': 'community', 'community_id': obj.community_id}
+        return None
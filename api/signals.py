@@ -0,0 +1,45 @@
+# api/signals.py
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import ChatMessage, Community, CommunityMember, Post, User
+from .memberships import MembershipService
+from .search import SearchService
+from .timelines import TimelineService
+from .ws_auth import user_cache_key
+
+
+@receiver(post_delete, sender=Post)
+def evict_deleted_post(sender, instance, **kwargs):
+    """Drop a deleted post from its members' precomputed timelines"""
+    TimelineService.evict_post(instance)
+
+
+@receiver(post_save, sender=Community)
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=ChatMessage)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        SearchService.index(instance)
+
+
+@receiver(post_delete, sender=Community)
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=ChatMessage)
+def remove_from_search_index(sender, instance, **kwargs):
+    SearchService.remove(instance)
+
+
+@receiver(post_save, sender=CommunityMember)
+@receiver(post_delete, sender=CommunityMember)
+def invalidate_memberships(sender, instance, raw=False, **kwargs):
+    """Joins, leaves, role changes and new communities all land here"""
+    if not raw:
+        MembershipService.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_cached_websocket_user(sender, instance, **kwargs):
+    """Websocket auth must not keep serving a changed or deactivated user"""
+    cache.delete(user_cache_key(instance.pk))
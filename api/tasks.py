@@ -0,0 +1,64 @@
+# api/tasks.py
+"""
+Celery tasks for work that does not need to finish inside the request.
+
+Views queue chat fan-out and notification delivery with
+enqueue_on_commit(), which hands the task to the broker only once the
+surrounding transaction has committed, so workers never see rows that
+are not there yet. If the broker cannot be reached the task runs inline
+instead and nothing is lost.
+
+Workers must share the channel layer with the websocket servers. With the
+in-memory layer (the default for local development) settings therefore
+run tasks eagerly in-process, which means inside the commit of the request
+that queued them: the request pays for the fan-out, so production runs
+workers against a Redis channel layer instead. Tests can queue to the
+memory broker (`CELERY_BROKER_URL=memory://`, eager mode off).
+"""
+import logging
+from celery import shared_task
+from django.db import transaction
+from .notification_service import NotificationService
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_on_commit(task, *args, **kwargs):
+    """Queue `task` with `args` once the current transaction commits"""
+    def enqueue():
+        try:
+            task.delay(*args, **kwargs)
+        except Exception as e:
+            logger.warning(f"Could not queue {task.name}, running it inline: {e}")
+            task.apply(args=args, kwargs=kwargs)
+
+    transaction.on_commit(enqueue)
+
+
+@shared_task(ignore_result=True)
+def send_chat_notification(channel_id, message_data):
+    NotificationService.send_chat_notification(channel_id, message_data)
+
+
+@shared_task(ignore_result=True)
+def create_notifications(notifications):
+    """Insert notifications given as field dicts and push them to their users"""
+    from .notification_builder import NotificationBuilder
+
+    NotificationBuilder.create(notifications)
+
+
+@shared_task(ignore_result=True)
+def send_push_notifications(notification_ids):
+    """FCM delivery of new notifications, see api/push.py"""
+    from .push import PushService
+
+    PushService.deliver(notification_ids)
+
+
+@shared_task(ignore_result=True)
+def prune_notifications():
+    """Periodic retention run (CELERY_BEAT_SCHEDULE)"""
+    from .notification_retention import NotificationRetentionService
+
+    NotificationRetentionService.prune()
@@ -1,3 +1,440 @@
-from django.test import TestCase
+import asyncio
+from unittest import mock
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from backend.celery import app as celery_app
+from .chat_sync import ChatSyncService
+from .chat_writer import ChatMessageWriter
+from .fake_redis import FakeRedisServer
+from .models import (
+    Channel, ChannelReadCursor, ChatMessage, Community, CommunityMember,
+    Notification, Post, User, UserFCMToken,
+)
+from .push import RETRY, UNREGISTERED, PushService, get_push_transport
+from .read_cursors import ReadCursorService, ReadCursorWriter
+from .tasks import enqueue_on_commit, send_chat_notification
+from .timelines import RedisTimelineStore
 
-# Create your tests here.
+
+def create_user(name):
+    return User.objects.create_user(
+        email=f'{name}@example.com', username=name, password='password',
+        first_name=name, last_name='Test',
+    )
+
+
+def create_channel(owner, *members):
+    community = Community.objects.create(name='Community', bio='Bio', created_by=owner, location='Here')
+    for user in (owner, *members):
+        CommunityMember.objects.create(community=community, user=user)
+    return Channel.objects.create(community=community, name='general', created_by=owner)
+
+
+class FakeRedisChannelLayerTests(SimpleTestCase):
+    """Two pub/sub layers on one fake Redis, as two worker processes would use it"""
+
+    async def test_group_send_reaches_the_other_layer(self):
+        from channels_redis.pubsub import RedisPubSubChannelLayer
+
+        server = await FakeRedisServer(port=0).start()
+        sender = RedisPubSubChannelLayer(hosts=[server.url], prefix='test')
+        receiver = RedisPubSubChannelLayer(hosts=[server.url], prefix='test')
+        try:
+            channel = await receiver.new_channel()
+            await receiver.group_add('room', channel)
+            await sender.group_send('room', {'type': 'chat.message', 'text': 'hello'})
+            message = await asyncio.wait_for(receiver.receive(channel), timeout=5)
+        finally:
+            await sender.flush()
+            await receiver.flush()
+            await server.stop()
+        self.assertEqual(message, {'type': 'chat.message', 'text': 'hello'})
+
+
+@override_settings(CELERY_BROKER_URL='memory://', CELERY_TASK_ALWAYS_EAGER=False)
+class EnqueueOnCommitTests(TestCase):
+    """enqueue_on_commit() against Celery's in-memory broker"""
+
+    def setUp(self):
+        patcher = mock.patch('api.tasks.NotificationService.send_chat_notification')
+        self.send_chat_notification = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def queued(self):
+        with celery_app.connection_for_read() as connection:
+            queue = connection.SimpleQueue('celery')
+            messages = []
+            while queue.qsize():
+                message = queue.get(timeout=1)
+                messages.append((message.headers['task'], message.payload[0]))
+                message.ack()
+            queue.close()
+        return messages
+
+    def test_queued_once_the_transaction_commits(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            enqueue_on_commit(send_chat_notification, 'channel-id', {'id': 'message-id'})
+            self.assertEqual(self.queued(), [])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(
+            self.queued(),
+            [('api.tasks.send_chat_notification', ['channel-id', {'id': 'message-id'}])],
+        )
+        self.send_chat_notification.assert_not_called()
+
+    def test_runs_inline_when_the_broker_is_unreachable(self):
+        with mock.patch.object(send_chat_notification, 'delay', side_effect=ConnectionError):
+            with self.captureOnCommitCallbacks(execute=True):
+                enqueue_on_commit(send_chat_notification, 'channel-id', {'id': 'message-id'})
+        self.send_chat_notification.assert_called_once_with('channel-id', {'id': 'message-id'})
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_eager_mode_runs_in_the_commit_callback(self):
+        # The default with the in-memory channel layer: the task runs in the
+        # committing request
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_on_commit(send_chat_notification, 'channel-id', {'id': 'message-id'})
+        self.send_chat_notification.assert_called_once_with('channel-id', {'id': 'message-id'})
+        self.assertEqual(self.queued(), [])
+
+
+class PushServiceTests(TestCase):
+    """PushService.deliver() against the LocMem transport"""
+
+    def setUp(self):
+        self.transport = get_push_transport()
+        self.transport.reset()
+        self.addCleanup(self.transport.reset)
+
+    def create_user(self, name, tokens=()):
+        user = create_user(name)
+        UserFCMToken.objects.bulk_create(UserFCMToken(user=user, token=token) for token in tokens)
+        return user
+
+    def notify(self, user, message='Someone mentioned you'):
+        return Notification.objects.create(
+            user=user, notification_type='mention', title='New mention', message=message,
+        ).id
+
+    def test_identical_pushes_are_split_into_multicasts_of_500(self):
+        users = [
+            self.create_user(f'user{i}', [f'token-{i}-{j}' for j in range(100)])
+            for i in range(6)
+        ]
+        result = PushService.deliver([self.notify(user) for user in users])
+        self.assertEqual(sorted(len(multicast['tokens']) for multicast in self.transport.sent), [100, 500])
+        self.assertEqual(result['multicasts'], 2)
+        self.assertEqual(result['sent'], 600)
+
+    def test_unregistered_tokens_are_deactivated(self):
+        user = self.create_user('alice', ['stale', 'fresh'])
+        self.transport.script('stale', UNREGISTERED)
+        result = PushService.deliver([self.notify(user)])
+        self.assertEqual(result['unregistered'], 1)
+        self.assertFalse(UserFCMToken.objects.get(token='stale').is_active)
+        self.assertTrue(UserFCMToken.objects.get(token='fresh').is_active)
+
+    @mock.patch('api.push.time.sleep')
+    def test_retried_tokens_are_resent_with_backoff(self, sleep):
+        user = self.create_user('alice', ['flaky', 'steady'])
+        self.transport.script('flaky', RETRY, RETRY)
+        result = PushService.deliver([self.notify(user)])
+        self.assertEqual(
+            [multicast['tokens'] for multicast in self.transport.sent],
+            [['flaky', 'steady'], ['flaky'], ['flaky']],
+        )
+        self.assertEqual(result['sent'], 2)
+        self.assertEqual(result['failed'], 0)
+        # One second before the first resend, doubled before the second, plus jitter
+        first, second = (call.args[0] for call in sleep.call_args_list)
+        self.assertTrue(1.0 <= first <= 1.5)
+        self.assertTrue(2.0 <= second <= 3.0)
+
+    @mock.patch('api.push.time.sleep')
+    def test_tokens_still_retrying_after_max_retries_fail(self, sleep):
+        user = self.create_user('alice', ['down'])
+        self.transport.script('down', *[RETRY] * 4)
+        result = PushService.deliver([self.notify(user)])
+        self.assertEqual(len(self.transport.sent), 4)
+        self.assertEqual(sleep.call_count, 3)
+        self.assertEqual(result['failed'], 1)
+        self.assertTrue(UserFCMToken.objects.get(token='down').is_active)
+
+    def test_several_notifications_for_a_user_are_sent_as_one_digest(self):
+        alice = self.create_user('alice', ['alice-phone'])
+        bob = self.create_user('bob', ['bob-phone'])
+        ids = [self.notify(alice, 'first'), self.notify(alice, 'second'), self.notify(bob, 'hello')]
+        result = PushService.deliver(ids)
+        self.assertEqual(result['users'], 2)
+        pushes = {multicast['tokens'][0]: multicast['message'] for multicast in self.transport.sent}
+        self.assertEqual(len(self.transport.sent), 2)
+        self.assertEqual(pushes['alice-phone']['title'], '2 new notifications')
+        self.assertEqual(pushes['alice-phone']['data'], {'notification_type': 'digest', 'count': '2'})
+        self.assertEqual(pushes['bob-phone']['title'], 'New mention')
+        self.assertEqual(pushes['bob-phone']['data'], {'notification_type': 'mention'})
+
+
+@mock.patch('api.read_cursors.close_old_connections')  # would close the test transaction
+@mock.patch.object(ReadCursorWriter, 'start')  # flushed by hand instead of by the thread
+class ReadCursorTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.channel = create_channel(self.alice, self.bob)
+        self.messages = [
+            ChatMessage.objects.create(channel=self.channel, user=self.alice, message=f'message {i}')
+            for i in range(5)
+        ]
+        self.channel.refresh_from_db()
+        self.writer = ReadCursorWriter(flush_interval=60, batch_size=500, max_retries=3)
+
+    def cursor(self, user):
+        return ChannelReadCursor.objects.get(user=user, channel=self.channel).last_read_seq
+
+    def test_negative_and_malformed_seqs_are_ignored(self, *mocks):
+        self.assertFalse(self.writer.record(self.alice.id, self.channel.id, seq=-1))
+        self.assertFalse(self.writer.record(self.alice.id, self.channel.id, seq='three'))
+        self.assertFalse(self.writer.record(self.alice.id, self.channel.id, message_id='not-a-uuid'))
+        self.writer.flush()
+        self.assertFalse(ChannelReadCursor.objects.exists())
+
+    def test_the_view_rejects_a_negative_seq(self, *mocks):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.post(f'/api/channels/{self.channel.id}/read/', {'seq': -1}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_seqs_past_the_end_of_the_channel_are_clamped(self, *mocks):
+        self.writer.record(self.alice.id, self.channel.id, seq=3)
+        self.writer.record(self.bob.id, self.channel.id, seq=2 ** 64)
+        self.writer.flush()
+        self.assertEqual(self.cursor(self.alice), 3)
+        self.assertEqual(self.cursor(self.bob), self.channel.last_seq)
+
+        # Later messages still count as unread
+        ChatMessage.objects.create(channel=self.channel, user=self.alice, message='later')
+        channel = ReadCursorService.unread_counts(Channel.objects.all(), self.bob).get()
+        self.assertEqual(channel.unread_count, 1)
+
+    def test_cursors_only_move_forward(self, *mocks):
+        self.writer.record(self.alice.id, self.channel.id, seq=4)
+        self.writer.record(self.alice.id, self.channel.id, message_id=self.messages[1].id)
+        self.writer.record(self.alice.id, self.channel.id, seq=2)
+        self.writer.flush()
+        self.assertEqual(self.cursor(self.alice), 4)
+
+        self.writer.record(self.alice.id, self.channel.id, seq=1)
+        self.writer.flush()
+        self.assertEqual(self.cursor(self.alice), 4)
+
+        self.writer.record(self.alice.id, self.channel.id, message_id=self.messages[4].id)
+        self.writer.flush()
+        self.assertEqual(self.cursor(self.alice), self.messages[4].seq)
+
+    def test_a_failing_cursor_does_not_lose_the_rest_of_its_batch(self, *mocks):
+        bad_key = (str(self.bob.id), str(self.channel.id))
+        write = ReadCursorWriter._write
+
+        def failing_write(writer, cursors):
+            if bad_key in cursors:
+                raise ValueError('bad cursor')
+            return write(writer, cursors)
+
+        self.writer.record(self.alice.id, self.channel.id, seq=3)
+        self.writer.record(self.bob.id, self.channel.id, seq=2)
+        with mock.patch.object(ReadCursorWriter, '_write', autospec=True, side_effect=failing_write):
+            for _ in range(self.writer.max_retries + 1):
+                self.writer.flush()
+        self.assertEqual(self.cursor(self.alice), 3)
+        self.assertFalse(ChannelReadCursor.objects.filter(user=self.bob).exists())
+        # Retried max_retries times, then dropped
+        self.assertEqual(self.writer._pending, {})
+
+    def test_unread_counts_take_one_query(self, *mocks):
+        other = create_channel(self.bob, self.alice)
+        ChatMessage.objects.create(channel=other, user=self.bob, message='hello')
+        self.writer.record(self.bob.id, self.channel.id, seq=2)
+        self.writer.flush()
+        with self.assertNumQueries(1):
+            counts = {
+                channel.id: (channel.last_read_seq, channel.unread_count)
+                for channel in ReadCursorService.unread_counts(Channel.objects.all(), self.bob)
+            }
+        # Bob's own messages are not unread
+        self.assertEqual(counts, {self.channel.id: (2, 3), other.id: (0, 0)})
+
+
+@override_settings(TIMELINES={**settings.TIMELINES, 'ENABLED': True})
+class TimelineStoreDownTests(TestCase):
+    """Timelines are a cache: with Redis unreachable everything falls back to the database"""
+
+    def setUp(self):
+        store = RedisTimelineStore(500, location='redis://127.0.0.1:1/0')  # nothing listens there
+        patcher = mock.patch('api.timelines.get_timeline_store', return_value=store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.channel = create_channel(self.alice)
+        self.community = self.channel.community
+        self.posts = [
+            Post.objects.create(community=self.community, posted_by=self.alice, caption=f'post {i}')
+            for i in range(3)
+        ]
+        self.client = APIClient()
+
+    def test_home_feed_is_read_from_the_database(self):
+        self.client.force_authenticate(self.alice)
+        response = self.client.get('/api/home/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [post['id'] for post in response.data['posts']],
+            [str(post.id) for post in reversed(self.posts)],
+        )
+
+    def test_posts_can_be_deleted(self):
+        self.posts[0].delete()
+        self.assertFalse(Post.objects.filter(id=self.posts[0].id).exists())
+
+    def test_communities_can_be_joined_and_left(self):
+        self.client.force_authenticate(self.bob)
+        response = self.client.post(f'/api/communities/{self.community.id}/join/')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(f'/api/communities/{self.community.id}/leave/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(CommunityMember.objects.filter(community=self.community, user=self.bob).exists())
+
+
+@mock.patch('api.chat_writer.close_old_connections')  # would close the test transaction
+class ChatWriterTests(TestCase):
+    """ChatMessageWriter._write(), one batch as the writer thread would save it"""
+
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.first = create_channel(self.alice)
+        self.second = create_channel(self.alice)
+        self.writer = ChatMessageWriter(batch_size=200, flush_interval=0.05, max_queue=100)
+
+    def message(self, channel, text):
+        return ChatMessage(channel=channel, user=self.alice, message=text)
+
+    def saved(self, channel):
+        return list(channel.chat_messages.order_by('seq').values_list('message', 'seq', 'change_seq'))
+
+    def test_each_channel_gets_consecutive_seqs_in_arrival_order(self, *mocks):
+        ChatMessage.objects.create(channel=self.first, user=self.alice, message='earlier')
+        batch = [
+            self.message(self.first, 'a1'), self.message(self.second, 'b1'),
+            self.message(self.first, 'a2'), self.message(self.second, 'b2'),
+            self.message(self.first, 'a3'),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            self.writer._write(batch)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "api_chatmessage"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            self.saved(self.first),
+            [('earlier', 1, 1), ('a1', 2, 2), ('a2', 3, 3), ('a3', 4, 4)],
+        )
+        self.assertEqual(self.saved(self.second), [('b1', 1, 1), ('b2', 2, 2)])
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.last_seq, self.second.last_seq), (4, 2))
+
+    def test_a_failed_batch_is_written_row_by_row(self, *mocks):
+        gone = create_channel(self.alice)
+        batch = [self.message(self.first, 'a1'), self.message(gone, 'lost'), self.message(self.first, 'a2')]
+        gone.delete()  # deleted mid-burst
+        self.writer._write(batch)
+        # The rest of the batch is saved, without gaps left by the failed attempt
+        self.assertEqual(self.saved(self.first), [('a1', 1, 1), ('a2', 2, 2)])
+        self.assertFalse(ChatMessage.objects.filter(message='lost').exists())
+
+
+class ChatSyncTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.channel = create_channel(self.alice)
+        self.messages = [
+            ChatMessage.objects.create(channel=self.channel, user=self.alice, message=f'message {i}')
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def sync(self, after, limit=50):
+        self.channel.refresh_from_db()
+        messages, has_more, last_seq = ChatSyncService.changes(self.channel, after, limit)
+        return [(message.message, message.is_deleted) for message in messages], has_more, last_seq
+
+    def test_changes_after_a_cursor_include_edits_and_tombstones(self):
+        first, second, _ = self.messages
+        first.message = 'edited'
+        first.save(update_fields=['message', 'updated_at'])
+        response = self.client.delete(f'/api/chat-messages/{second.id}/')
+        self.assertEqual(response.status_code, 204)
+        ChatMessage.objects.create(channel=self.channel, user=self.alice, message='new')
+
+        self.assertEqual(
+            self.sync(after=3),
+            ([('edited', False), ('', True), ('new', False)], False, 6),
+        )
+        # Paged in change order, resuming where the last page ended
+        self.assertEqual(self.sync(after=3, limit=2), ([('edited', False), ('', True)], True, 5))
+        self.assertEqual(self.sync(after=5, limit=2), ([('new', False)], False, 6))
+        self.assertEqual(self.sync(after=6), ([], False, 6))
+
+    def test_reactions_are_changes(self):
+        message = self.messages[0]
+        for expected in (1, 0):
+            self.channel.refresh_from_db()
+            after = self.channel.last_seq
+            response = self.client.post(f'/api/chat-messages/{message.id}/react/', {'reaction_type': 'like'})
+            self.assertEqual(response.status_code, 200)
+            self.channel.refresh_from_db()
+            messages, _, _ = ChatSyncService.changes(self.channel, after)
+            self.assertEqual([(synced.id, synced.reaction_count) for synced in messages], [(message.id, expected)])
+
+    def test_history_skips_tombstones_and_hands_over_to_changes(self):
+        ChatSyncService.tombstone(self.messages[1])
+        self.channel.refresh_from_db()
+        messages, has_more, last_seq = ChatSyncService.history(self.channel)
+        self.assertEqual([message.message for message in messages], ['message 0', 'message 2'])
+        self.assertEqual((has_more, last_seq), (False, 4))
+        messages, has_more, _ = ChatSyncService.history(self.channel, before=3, limit=1)
+        self.assertEqual(([message.message for message in messages], has_more), (['message 0'], False))
+
+        # A delete after the history was read reaches the client as a tombstone
+        ChatSyncService.tombstone(self.messages[0])
+        response = self.client.get(f'/api/channels/{self.channel.id}/messages/', {'after': last_seq})
+        self.assertEqual(
+            [(message['id'], message['message'], message['is_deleted']) for message in response.data['results']],
+            [(str(self.messages[0].id), '', True)],
+        )
+        self.assertEqual(response.data['last_seq'], 5)
+
+
+class UpdatePresenceTests(TestCase):
+    def setUp(self):
+        self.alice = create_user('alice')
+        self.channel = create_channel(self.alice)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def update(self, data, format=None):
+        return self.client.post('/api/chat-messages/update_presence/', {'channel_id': self.channel.id, **data}, format=format)
+
+    @mock.patch('api.views.PresenceService')
+    def test_is_online_is_parsed_as_a_boolean(self, presence):
+        for data, format in (({'is_online': 'false'}, None), ({'is_online': '0'}, 'json'), ({'is_online': False}, 'json')):
+            presence.reset_mock()
+            self.assertEqual(self.update(data, format).status_code, 200)
+            presence.leave.assert_called_once()
+            presence.heartbeat.assert_not_called()
+        presence.reset_mock()
+        self.assertEqual(self.update({}).status_code, 200)
+        presence.heartbeat.assert_called_once()
+        self.assertEqual(self.update({'is_online': 'maybe'}).status_code, 400)
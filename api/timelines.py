@@ -0,0 +1,333 @@
+# api/timelines.py
+"""
+Precomputed home timelines (fan-out on write).
+
+When a post is created its id is pushed onto a capped timeline for every
+member of the community, so HomeView can read a page of post ids for the
+user and hydrate them in one batch instead of scanning posts across all of
+the user's communities. Communities with more than FANOUT_MAX_MEMBERS
+members are not fanned out; their posts are merged in at read time. Timelines
+keep the newest MAX_LENGTH posts; older pages are read from the database.
+
+Disabled unless TIMELINES['ENABLED'] is set. The store is pluggable:
+LocMemTimelineStore keeps timelines in process memory (development and
+tests only), RedisTimelineStore keeps them in sorted sets.
+"""
+import bisect
+import calendar
+import logging
+import threading
+from functools import lru_cache
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from .models import CommunityMember, Post
+from .pagination import FeedCursorPagination
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'BACKEND': 'api.timelines.LocMemTimelineStore',
+    'OPTIONS': {},
+    'MAX_LENGTH': 500,
+    'FANOUT_MAX_MEMBERS': 5000,
+}
+
+
+def timeline_settings():
+    return {**DEFAULTS, **getattr(settings, 'TIMELINES', {})}
+
+
+def post_score(created_at):
+    """Integer microseconds since the epoch; exact in a Redis double"""
+    return calendar.timegm(created_at.utctimetuple()) * 1000000 + created_at.microsecond
+
+
+class BaseTimelineStore:
+    """
+    A timeline is a set of (score, post_id) entries read newest first, with
+    ties on score broken by post_id descending to match the feed cursor.
+    """
+    def __init__(self, max_length, **options):
+        self.max_length = max_length
+
+    def push(self, user_ids, entries):
+        """Add entries to each user's timeline, trimming to max_length"""
+        raise NotImplementedError
+
+    def replace(self, user_id, entries):
+        """Rebuild a user's timeline from scratch and mark it as built"""
+        raise NotImplementedError
+
+    def remove(self, user_ids, post_ids):
+        raise NotImplementedError
+
+    def is_built(self, user_id):
+        raise NotImplementedError
+
+    def post_ids(self, user_id):
+        raise NotImplementedError
+
+    def page(self, user_id, before=None, limit=20):
+        """Up to `limit` post ids strictly older than `before` (score, post_id)"""
+        raise NotImplementedError
+
+
+class LocMemTimelineStore(BaseTimelineStore):
+    def __init__(self, max_length, **options):
+        super().__init__(max_length, **options)
+        self._timelines = {}
+        # Users whose timeline was rebuilt; fan-out alone does not build one
+        self._built = set()
+        self._lock = threading.Lock()
+
+    def _add(self, timeline, entries):
+        for entry in entries:
+            index = bisect.bisect_left(timeline, entry)
+            if index == len(timeline) or timeline[index] != entry:
+                timeline.insert(index, entry)
+        del timeline[:-self.max_length]
+
+    def push(self, user_ids, entries):
+        entries = [(score, str(post_id)) for post_id, score in entries]
+        with self._lock:
+            for user_id in user_ids:
+                self._add(self._timelines.setdefault(str(user_id), []), entries)
+
+    def replace(self, user_id, entries):
+        timeline = []
+        self._add(timeline, [(score, str(post_id)) for post_id, score in entries])
+        with self._lock:
+            self._timelines[str(user_id)] = timeline
+            self._built.add(str(user_id))
+
+    def remove(self, user_ids, post_ids):
+        post_ids = {str(post_id) for post_id in post_ids}
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(str(user_id))
+                if timeline:
+                    timeline[:] = [entry for entry in timeline if entry[1] not in post_ids]
+
+    def is_built(self, user_id):
+        with self._lock:
+            return str(user_id) in self._built
+
+    def post_ids(self, user_id):
+        with self._lock:
+            return [post_id for _, post_id in self._timelines.get(str(user_id), [])]
+
+    def page(self, user_id, before=None, limit=20):
+        with self._lock:
+            timeline = self._timelines.get(str(user_id), [])
+            end = bisect.bisect_left(timeline, before) if before else len(timeline)
+            return [post_id for _, post_id in reversed(timeline[max(0, end - limit):end])]
+
+
+class RedisTimelineStore(BaseTimelineStore):
+    """
+    One sorted set per user (`timeline:<user_id>`) scored by post_score(),
+    plus a `timeline:<user_id>:built` marker. Both expire after TTL seconds
+    so inactive users' timelines are rebuilt on their next visit.
+    """
+    def __init__(self, max_length, location='redis://localhost:6379/1', ttl=7 * 24 * 3600, **options):
+        import redis
+
+        super().__init__(max_length, **options)
+        self.client = redis.Redis.from_url(location, decode_responses=True)
+        self.ttl = ttl
+
+    def _key(self, user_id):
+        return f'timeline:{user_id}'
+
+    def _add(self, pipe, user_id, mapping):
+        key = self._key(user_id)
+        pipe.zadd(key, mapping)
+        pipe.zremrangebyrank(key, 0, -(self.max_length + 1))
+        pipe.expire(key, self.ttl)
+
+    def push(self, user_ids, entries):
+        mapping = {str(post_id): score for post_id, score in entries}
+        if not mapping:
+            return
+        with self.client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                self._add(pipe, user_id, mapping)
+            pipe.execute()
+
+    def replace(self, user_id, entries):
+        mapping = {str(post_id): score for post_id, score in entries}
+        with self.client.pipeline() as pipe:
+            pipe.delete(self._key(user_id))
+            if mapping:
+                self._add(pipe, user_id, mapping)
+            pipe.set(f'{self._key(user_id)}:built', 1, ex=self.ttl)
+            pipe.execute()
+
+    def remove(self, user_ids, post_ids):
+        post_ids = [str(post_id) for post_id in post_ids]
+        if not post_ids:
+            return
+        with self.client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zrem(self._key(user_id), *post_ids)
+            pipe.execute()
+
+    def is_built(self, user_id):
+        return bool(self.client.exists(f'{self._key(user_id)}:built'))
+
+    def post_ids(self, user_id):
+        return self.client.zrange(self._key(user_id), 0, -1)
+
+    def page(self, user_id, before=None, limit=20):
+        key = self._key(user_id)
+        if before is None:
+            return self.client.zrevrange(key, 0, limit - 1)
+
+        # Members sharing the cursor's score are ordered by member, so fetch
+        # enough extra rows to skip the ones at or after the cursor id
+        score, post_id = before
+        ties = self.client.zcount(key, score, score)
+        entries = self.client.zrevrangebyscore(
+            key, score, '-inf', start=0, num=limit + ties, withscores=True
+        )
+        return [
+            member for member, member_score in entries
+            if member_score < score or member < post_id
+        ][:limit]
+
+
+@lru_cache(maxsize=None)
+def get_timeline_store():
+    config = timeline_settings()
+    store_class = import_string(config['BACKEND'])
+    return store_class(config['MAX_LENGTH'], **config['OPTIONS'])
+
+
+class TimelineService:
+    @staticmethod
+    def is_enabled():
+        return timeline_settings()['ENABLED']
+
+    @staticmethod
+    def fans_out(community):
+        return community.member_count <= timeline_settings()['FANOUT_MAX_MEMBERS']
+
+    @staticmethod
+    def fan_out(post):
+        """Push a new post onto every member's timeline once it is committed"""
+        if not TimelineService.is_enabled() or not TimelineService.fans_out(post.community):
+            return
+
+        def push():
+            member_ids = CommunityMember.objects.filter(
+                community_id=post.community_id
+            ).values_list('user_id', flat=True)
+            try:
+                get_timeline_store().push(member_ids, [(post.id, post_score(post.created_at))])
+            except Exception as e:
+                logger.warning(f"Timeline fan-out failed for post {post.id}: {e}")
+
+        transaction.on_commit(push)
+
+    @staticmethod
+    def evict_post(post):
+        if not TimelineService.is_enabled():
+            return
+        member_ids = CommunityMember.objects.filter(
+            community_id=post.community_id
+        ).values_list('user_id', flat=True)
+        try:
+            get_timeline_store().remove(member_ids, [post.id])
+        except Exception as e:
+            # home_feed drops ids of deleted posts lazily
+            logger.warning(f"Timeline eviction failed for post {post.id}: {e}")
+
+    @staticmethod
+    def on_join(user, community):
+        """Backfill a user's (already built) timeline with the community's recent posts"""
+        if not TimelineService.is_enabled() or not TimelineService.fans_out(community):
+            return
+        store = get_timeline_store()
+        try:
+            if not store.is_built(user.id):
+                return
+            recent = Post.objects.filter(community=community).order_by(
+                '-created_at', '-id'
+            ).values_list('id', 'created_at')[:store.max_length]
+            store.push([user.id], [(post_id, post_score(created_at)) for post_id, created_at in recent])
+        except Exception as e:
+            logger.warning(f"Timeline backfill failed for user {user.id}: {e}")
+
+    @staticmethod
+    def on_leave(user, community):
+        """Evict the community's posts from the user's timeline"""
+        if not TimelineService.is_enabled():
+            return
+        store = get_timeline_store()
+        try:
+            stale = Post.objects.filter(
+                id__in=store.post_ids(user.id), community=community
+            ).values_list('id', flat=True)
+            store.remove([user.id], list(stale))
+        except Exception as e:
+            logger.warning(f"Timeline eviction failed for user {user.id}: {e}")
+
+    @staticmethod
+    def rebuild(user, community_ids):
+        store = get_timeline_store()
+        recent = Post.objects.filter(community_id__in=community_ids).order_by(
+            '-created_at', '-id'
+        ).values_list('id', 'created_at')[:store.max_length]
+        store.replace(user.id, [(post_id, post_score(created_at)) for post_id, created_at in recent])
+
+    @staticmethod
+    def home_feed(user, cursor, limit):
+        """
+        Posts for the user's home feed strictly after `cursor` (created_at, id),
+        newest first: ids from the precomputed timeline merged with a
+        fan-out-on-read query over the user's large communities. Pages past
+        the end of the capped timeline, and every page while the store is
+        unreachable, are read from the database.
+        """
+        store = get_timeline_store()
+        fanout_max = timeline_settings()['FANOUT_MAX_MEMBERS']
+        small_ids, large_ids = [], []
+        for community_id, member_count in CommunityMember.objects.filter(
+            user=user
+        ).values_list('community_id', 'community__member_count'):
+            (small_ids if member_count <= fanout_max else large_ids).append(community_id)
+
+        before = (post_score(cursor[0]), str(cursor[1])) if cursor else None
+        try:
+            if not store.is_built(user.id):
+                TimelineService.rebuild(user, small_ids)
+            post_ids = set(store.page(user.id, before=before, limit=limit))
+        except Exception as e:
+            logger.warning(f"Timeline read failed for user {user.id}, reading from the database: {e}")
+            post_ids = set()
+        if len(post_ids) < limit and small_ids:
+            # Past the end of the capped timeline (or the store is down): read
+            # the rest from the database
+            older = Post.objects.filter(community_id__in=small_ids).order_by('-created_at', '-id')
+            if cursor is not None:
+                older = older.filter(FeedCursorPagination.cursor_filter(cursor))
+            post_ids.update(str(post_id) for post_id in older.values_list('id', flat=True)[:limit])
+
+        if large_ids:
+            large = Post.objects.filter(community_id__in=large_ids).order_by('-created_at', '-id')
+            if cursor is not None:
+                large = large.filter(FeedCursorPagination.cursor_filter(cursor))
+            post_ids.update(str(post_id) for post_id in large.values_list('id', flat=True)[:limit])
+
+        posts = list(Post.objects.filter(id__in=post_ids).for_feed(user))
+        posts.sort(key=lambda post: (post.created_at, str(post.id)), reverse=True)
+        if len(posts) < len(post_ids):
+            # Lazily drop ids of posts deleted without eviction
+            found = {str(post.id) for post in posts}
+            try:
+                store.remove([user.id], [post_id for post_id in post_ids if post_id not in found])
+            except Exception as e:
+                logger.warning(f"Timeline cleanup failed for user {user.id}: {e}")
+        return posts[:limit]
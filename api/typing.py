@@ -0,0 +1,242 @@
+# api/typing.py
+"""
+Server-side coalescing of typing indicators.
+
+Instead of broadcasting every typing_start/typing_stop frame, ChatConsumer
+records typists here. Each typist entry expires TTL seconds after the last
+typing_start (so a client that vanishes mid-word stops "typing"), and once
+per TICK a room whose roster changed receives a single `typing_users`
+event listing everyone currently typing. Rooms members therefore get at
+most one typing frame per tick however many people type.
+
+Rosters live in a shared store so that every worker sees the same one.
+Each process with a typist in a room runs a ticker for it, but only the
+ticker holding the room's short ticker lock sends the roster; if its
+process dies the lock expires and another ticker takes over. The store is
+pluggable: LocMemTypingStore is shared by the event loops of one process
+(development and single-process deployments), RedisTypingStore keeps one
+hash per room for multi-worker deployments.
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+import weakref
+from functools import lru_cache
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from channels.layers import get_channel_layer
+from .framing import encode_event
+
+DEFAULTS = {
+    'BACKEND': 'api.typing.LocMemTypingStore',
+    'OPTIONS': {},
+    'TICK': 1.0,  # seconds between roster frames per room
+    'TTL': 6.0,  # seconds a typing_start stays valid
+}
+
+
+def typing_settings():
+    return {**DEFAULTS, **getattr(settings, 'TYPING_INDICATORS', {})}
+
+
+class BaseTypingStore:
+    """
+    A room's roster maps user ids to (username, expiry time). Rosters are
+    returned sorted by user id so that they compare equal across workers.
+    """
+    def __init__(self, ttl, **options):
+        self.ttl = ttl
+
+    def start(self, room, user_id, username):
+        """Add or refresh a typist, expiring TTL seconds from now"""
+        raise NotImplementedError
+
+    def stop(self, room, user_id):
+        raise NotImplementedError
+
+    def acquire(self, room, owner, ttl):
+        """Take or extend the room's ticker lock; True if `owner` holds it"""
+        raise NotImplementedError
+
+    def release(self, room, owner):
+        raise NotImplementedError
+
+    def collect(self, room):
+        """
+        Drop expired typists and return (roster, changed), where `changed`
+        says whether the roster differs from the one last collected.
+        """
+        raise NotImplementedError
+
+
+class LocMemTypingStore(BaseTypingStore):
+    def __init__(self, ttl, **options):
+        super().__init__(ttl, **options)
+        self._rooms = {}  # room -> {user_id: (username, expires_at)}
+        self._sent = {}  # room -> roster last collected
+        self._locks = {}  # room -> (owner, expires_at)
+        self._lock = threading.Lock()
+
+    def start(self, room, user_id, username):
+        with self._lock:
+            self._rooms.setdefault(room, {})[user_id] = (username, time.time() + self.ttl)
+
+    def stop(self, room, user_id):
+        with self._lock:
+            self._rooms.get(room, {}).pop(user_id, None)
+
+    def acquire(self, room, owner, ttl):
+        now = time.time()
+        with self._lock:
+            holder, expires_at = self._locks.get(room, (None, 0))
+            if holder not in (None, owner) and expires_at > now:
+                return False
+            self._locks[room] = (owner, now + ttl)
+            return True
+
+    def release(self, room, owner):
+        with self._lock:
+            if self._locks.get(room, (None, 0))[0] == owner:
+                del self._locks[room]
+
+    def collect(self, room):
+        now = time.time()
+        with self._lock:
+            typists = self._rooms.get(room, {})
+            roster = [
+                {'user_id': user_id, 'username': username}
+                for user_id, (username, expires_at) in sorted(typists.items())
+                if expires_at > now
+            ]
+            changed = roster != self._sent.get(room, [])
+            if roster:
+                self._rooms[room] = {entry['user_id']: typists[entry['user_id']] for entry in roster}
+                self._sent[room] = roster
+            else:
+                self._rooms.pop(room, None)
+                self._sent.pop(room, None)
+            return roster, changed
+
+
+class RedisTypingStore(BaseTypingStore):
+    """
+    `typing:<room>` is a hash of user id -> [username, expiry time],
+    `typing:<room>:sent` the roster last collected and
+    `typing:<room>:ticker` the ticker lock. All of them expire, so rooms
+    that go quiet clean up after themselves.
+    """
+    def __init__(self, ttl, location='redis://localhost:6379/6', **options):
+        import redis
+
+        super().__init__(ttl, **options)
+        self.client = redis.Redis.from_url(location, decode_responses=True)
+
+    def _key(self, room):
+        return f'typing:{room}'
+
+    def start(self, room, user_id, username):
+        key = self._key(room)
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.hset(key, user_id, json.dumps([username, time.time() + self.ttl]))
+            pipe.expire(key, int(self.ttl) + 1)
+            pipe.execute()
+
+    def stop(self, room, user_id):
+        self.client.hdel(self._key(room), user_id)
+
+    def acquire(self, room, owner, ttl):
+        key = f'{self._key(room)}:ticker'
+        if self.client.set(key, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        if self.client.get(key) == owner:
+            self.client.pexpire(key, int(ttl * 1000))
+            return True
+        return False
+
+    def release(self, room, owner):
+        key = f'{self._key(room)}:ticker'
+        if self.client.get(key) == owner:
+            self.client.delete(key)
+
+    def collect(self, room):
+        key = self._key(room)
+        now = time.time()
+        roster, expired = [], []
+        for user_id, value in sorted(self.client.hgetall(key).items()):
+            username, expires_at = json.loads(value)
+            if expires_at > now:
+                roster.append({'user_id': user_id, 'username': username})
+            else:
+                expired.append(user_id)
+        if expired:
+            self.client.hdel(key, *expired)
+        sent = self.client.get(f'{key}:sent')
+        changed = roster != (json.loads(sent) if sent else [])
+        if changed or roster:
+            self.client.set(f'{key}:sent', json.dumps(roster), ex=int(self.ttl) + 1)
+        return roster, changed
+
+
+@lru_cache(maxsize=None)
+def get_typing_store():
+    config = typing_settings()
+    store_class = import_string(config['BACKEND'])
+    return store_class(config['TTL'], **config['OPTIONS'])
+
+
+store_start = sync_to_async(lambda *args: get_typing_store().start(*args), thread_sensitive=False)
+store_stop = sync_to_async(lambda *args: get_typing_store().stop(*args), thread_sensitive=False)
+store_acquire = sync_to_async(lambda *args: get_typing_store().acquire(*args), thread_sensitive=False)
+store_release = sync_to_async(lambda *args: get_typing_store().release(*args), thread_sensitive=False)
+store_collect = sync_to_async(lambda *args: get_typing_store().collect(*args), thread_sensitive=False)
+
+
+class TypingTracker:
+    def __init__(self, tick):
+        self.tick = tick
+        self.owner = uuid.uuid4().hex  # identifies this tracker's tickers in the lock
+        self.tickers = {}
+
+    async def start(self, room, user_id, username):
+        """Record (or refresh) a typist and make sure the room is ticking"""
+        await store_start(room, user_id, username)
+        if room not in self.tickers:
+            self.tickers[room] = asyncio.get_running_loop().create_task(self._run(room))
+
+    async def stop(self, room, user_id):
+        await store_stop(room, user_id)
+
+    async def _run(self, room):
+        channel_layer = get_channel_layer()
+        try:
+            while True:
+                await asyncio.sleep(self.tick)
+                # A few ticks' lease, so a dead process's lock soon passes on
+                if not await store_acquire(room, self.owner, self.tick * 3):
+                    continue
+                roster, changed = await store_collect(room)
+                if changed:
+                    await channel_layer.group_send(room, encode_event({
+                        'type': 'typing_users',
+                        'users': roster,
+                    }))
+                # Nobody typing and the empty roster has been sent: go idle
+                if not roster:
+                    await store_release(room, self.owner)
+                    break
+        finally:
+            self.tickers.pop(room, None)
+
+
+_trackers = weakref.WeakKeyDictionary()
+
+
+def get_typing_tracker():
+    """The tracker for the running event loop"""
+    loop = asyncio.get_running_loop()
+    if loop not in _trackers:
+        _trackers[loop] = TypingTracker(typing_settings()['TICK'])
+    return _trackers[loop]
@@ -22,6 +22,7 @@ urlpatterns = [
     path('verify-otp/', VerifyOTPView.as_view(), name='verify_otp'),
     path('reset-password/', ResetPasswordView.as_view(), name='reset_password'),
     path('home/', HomeView.as_view(), name='home'),
+    path('metrics/websockets/', WebsocketMetricsView.as_view(), name='websocket_metrics'),
 ]
 
 # Add media URLs in development
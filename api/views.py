@@ -1,4 +1,4 @@
-from rest_framework import viewsets, status, permissions
+from rest_framework import mixins, serializers, viewsets, status, permissions
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -14,9 +14,24 @@ from .permissions import *
 from rest_framework_simplejwt.views import TokenBlacklistView
 from rest_framework.response import Response
 from rest_framework import status
+from django.db import transaction
 from django.db.models import Count
 import json
 from .notification_service import NotificationService  # Add this instead
+from .notification_builder import NotificationBuilder
+from .notification_counts import UnreadCountService
+from .tasks import enqueue_on_commit, send_chat_notification
+from .counters import CounterService
+from .pagination import FeedCursorPagination, get_offset_limit, get_seq_range
+from .timelines import TimelineService
+from .rankings import CommunityRankingService
+from .search import SearchService
+from .presence import PresenceService, channel_scope, community_scope
+from .replay import chat_message_event
+from .chat_sync import ChatSyncService
+from .read_cursors import ReadCursorService, get_read_cursor_writer
+from .memberships import MembershipService
+from .send_queues import metrics as send_queue_metrics
 
 
 
@@ -201,14 +216,17 @@ class CommunityViewSet(viewsets.ModelViewSet):
     # permission_classes = [permissions.IsAuthenticated]
     permission_classes = [permissions.IsAuthenticated]  # Require authentication
     
+    def get_queryset(self):
+        return Community.objects.with_member_stats(self.request.user)
+    
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
     
     def perform_create(self, serializer):
-        # Save the community first
-        community = serializer.save(created_by=self.request.user)
+        # Save the community first (the creator is its first member)
+        community = serializer.save(created_by=self.request.user, member_count=1)
         
         # Automatically make the creator an admin member
         CommunityMember.objects.create(
@@ -242,41 +260,56 @@ class CommunityViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def join(self, request, pk=None):
         community = self.get_object()
-        CommunityMember.objects.get_or_create(
-            community=community,
-            user=request.user,
-            defaults={'role': 'member'}
-        )
+        with transaction.atomic():
+            _, created = CommunityMember.objects.get_or_create(
+                community=community,
+                user=request.user,
+                defaults={'role': 'member'}
+            )
+            if created:
+                CounterService.increment(community, 'member_count')
+        if created:
+            TimelineService.on_join(request.user, community)
         return Response({'message': 'Joined community successfully'})
     
     @action(detail=True, methods=['post'])
     def leave(self, request, pk=None):
         community = self.get_object()
-        CommunityMember.objects.filter(community=community, user=request.user).delete()
+        with transaction.atomic():
+            deleted, _ = CommunityMember.objects.filter(community=community, user=request.user).delete()
+            CounterService.decrement(community, 'member_count', deleted)
+        TimelineService.on_leave(request.user, community)
         return Response({'message': 'Left community successfully'})
     
     @action(detail=False, methods=['get'])
     def joined(self, request):
-        joined_communities = Community.objects.filter(members__user=request.user)
+        joined_communities = self.get_queryset().filter(id__in=MembershipService.community_ids(request.user))
         serializer = self.get_serializer(joined_communities, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def explore(self, request):
         # Get communities not joined by user, ordered by member count (popularity)
-        explored_communities = Community.objects.exclude(
-            members__user=request.user
-        ).annotate(
-            member_count=Count('members')
-        ).order_by('-member_count')
+        offset, limit = get_offset_limit(request)
+        explored_communities = CommunityRankingService.popular_communities(request.user, offset, limit)
         
         serializer = self.get_serializer(explored_communities, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'])
+    def suggestions(self, request):
+        # Popular communities the user has not joined yet
+        suggested_communities = CommunityRankingService.popular_communities(request.user)
+        
+        serializer = self.get_serializer(suggested_communities, many=True)
+        return Response(serializer.data)
+    
     @action(detail=False, methods=['get'])
     def search(self, request):
-        query = request.GET.get('q', '')
-        communities = Community.objects.filter(name__icontains=query)
+        # Ranked full-text search over name, bio and location
+        offset, limit = get_offset_limit(request, default_limit=20)
+        ids = SearchService.search('community', request.GET.get('q', ''), offset=offset, limit=limit)
+        communities = SearchService.hydrate(self.get_queryset(), ids)
         serializer = self.get_serializer(communities, many=True)
         return Response(serializer.data)
     
@@ -301,6 +334,7 @@ class CommunityViewSet(viewsets.ModelViewSet):
         """Get all members of a community"""
         community = self.get_object()
         members = community.members.all().select_related('user')
+        online_user_ids = PresenceService.online_user_ids(community_scope(community.id))
         
         # Serialize the data
         member_data = []
@@ -310,7 +344,7 @@ class CommunityViewSet(viewsets.ModelViewSet):
                 'user': UserSerializer(member.user).data,
                 'role': member.role,
                 'joined_at': member.joined_at,
-                'is_online': member.is_online
+                'is_online': str(member.user_id) in online_user_ids
             })
         
         return Response(member_data)
@@ -342,7 +376,10 @@ class CommunityViewSet(viewsets.ModelViewSet):
         
         if action_type == 'remove':
             # Remove member from community
-            member.delete()
+            with transaction.atomic():
+                member.delete()
+                CounterService.decrement(community, 'member_count')
+            TimelineService.on_leave(target_user, community)
             return Response({'message': 'Member removed from community successfully'})
         
         elif action_type == 'update_role':
@@ -371,18 +408,47 @@ class PostViewSet(viewsets.ModelViewSet):
     # permission_classes = [permissions.IsAuthenticated, IsChannelAdmin]
     permission_classes = [permissions.IsAuthenticated]  # Require authentication
     
+    def get_queryset(self):
+        return Post.objects.for_feed(self.request.user)
+    
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
     
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        # Ranked full-text search over captions of posts in joined communities
+        offset, limit = get_offset_limit(request, default_limit=20)
+        ids = SearchService.search(
+            'post', request.GET.get('q', ''),
+            filters={'community_id': MembershipService.community_ids(request.user)},
+            offset=offset, limit=limit
+        )
+        posts = SearchService.hydrate(self.get_queryset(), ids)
+        serializer = self.get_serializer(posts, many=True)
+        return Response(serializer.data)
+    
     @action(detail=True, methods=['post'])
     def like(self, request, pk=None):
         post = self.get_object()
-        like, created = Like.objects.get_or_create(post=post, user=request.user)
-        if not created:
-            like.delete()
-            return Response({'message': 'Post unliked'})
+        with transaction.atomic():
+            like, created = Like.objects.get_or_create(post=post, user=request.user)
+            if not created:
+                like.delete()
+                CounterService.decrement(post, 'like_count')
+                return Response({'message': 'Post unliked'})
+            CounterService.increment(post, 'like_count')
+        
+        # Merged into the author's open like notification for this post
+        NotificationBuilder(actor=request.user).add(
+            post.posted_by_id,
+            'post_like',
+            title="New like on your post",
+            message=f"{request.user.username} liked your post",
+            community_id=post.community_id,
+            post=post
+        ).save()
         return Response({'message': 'Post liked'})
     
     @action(detail=True, methods=['post'])
@@ -393,15 +459,26 @@ class PostViewSet(viewsets.ModelViewSet):
         if reaction_type not in dict(Reaction.REACTION_TYPES):
             return Response({'error': 'Invalid reaction type'}, status=status.HTTP_400_BAD_REQUEST)
         
-        reaction, created = Reaction.objects.get_or_create(
-            post=post, 
-            user=request.user,
-            defaults={'reaction_type': reaction_type}
-        )
-        
-        if not created:
-            if reaction.reaction_type == reaction_type:
+        with transaction.atomic():
+            reaction, created = Reaction.objects.get_or_create(
+                post=post, 
+                user=request.user,
+                defaults={'reaction_type': reaction_type}
+            )
+            
+            if created:
+                CounterService.increment(post, 'reaction_count')
+                NotificationBuilder(actor=request.user).add(
+                    post.posted_by_id,
+                    'post_reaction',
+                    title="New reaction to your post",
+                    message=f"{request.user.username} reacted with {reaction_type} to your post",
+                    community_id=post.community_id,
+                    post=post
+                ).save()
+            elif reaction.reaction_type == reaction_type:
                 reaction.delete()
+                CounterService.decrement(post, 'reaction_count')
                 return Response({'message': 'Reaction removed'})
             else:
                 reaction.reaction_type = reaction_type
@@ -426,65 +503,113 @@ class EventViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def join(self, request, pk=None):
         event = self.get_object()
-        EventParticipant.objects.get_or_create(event=event, user=request.user)
+        with transaction.atomic():
+            _, created = EventParticipant.objects.get_or_create(event=event, user=request.user)
+            if created:
+                CounterService.increment(event, 'participant_count')
         return Response({'message': 'Joined event successfully'})
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         event = self.get_object()
-        EventParticipant.objects.filter(event=event, user=request.user).delete()
+        with transaction.atomic():
+            deleted, _ = EventParticipant.objects.filter(event=event, user=request.user).delete()
+            CounterService.decrement(event, 'participant_count', deleted)
         return Response({'message': 'Cancelled event participation'})
 
 
-class NotificationViewSet(viewsets.ModelViewSet):
+class NotificationViewSet(mixins.ListModelMixin,
+                          mixins.RetrieveModelMixin,
+                          mixins.DestroyModelMixin,
+                          viewsets.GenericViewSet):
+    # Notifications are created server-side (api/notification_builder.py)
+    # and marked read through the actions below, which keep the cached
+    # unread counts in step; there is no create or update
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     # permission_classes = [permissions.IsAuthenticated]
     permission_classes = [permissions.IsAuthenticated]  # Require authentication
     
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user).order_by('-created_at')
+        # Just the columns the compact NotificationSerializer reads, in one query
+        return self.queryset.filter(user=self.request.user).select_related(
+            'community', 'channel', 'post', 'chat_message'
+        ).only(
+            *[field.name for field in Notification._meta.concrete_fields],
+            'community__name', 'community__profile_pic',
+            'channel__name',
+            'post__image', 'post__caption',
+            'chat_message__seq', 'chat_message__message', 'chat_message__is_deleted'
+        ).order_by('-created_at')
+    
+    def perform_destroy(self, instance):
+        instance.delete()
+        if not instance.is_read:
+            UnreadCountService.adjust_and_push({str(self.request.user.id): -1})
+    
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        # Badge count from the cache; updates are also pushed as `unread_count` events
+        return Response({'unread_count': UnreadCountService.get(request.user.id)})
     
     @action(detail=True, methods=['post'])
     def mark_as_read(self, request, pk=None):
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        # Only the request that actually flips the flag takes the count down
+        if Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True):
+            UnreadCountService.adjust_and_push({str(request.user.id): -1})
         return Response({'message': 'Notification marked as read'})
     
     @action(detail=False, methods=['post'])
     def mark_all_as_read(self, request):
-        self.get_queryset().update(is_read=True)
+        if Notification.objects.filter(user=request.user, is_read=False).update(is_read=True):
+            UnreadCountService.reset(request.user.id)
+            UnreadCountService.push({str(request.user.id): 0})
         return Response({'message': 'All notifications marked as read'})
 
 class HomeView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = FeedCursorPagination
     
     def get(self, request):
-        from django.db.models import Count
+        paginator = self.pagination_class()
         
-        # Get user's joined communities
-        joined_communities = Community.objects.filter(members__user=request.user)
-        
-        # Get posts from joined communities (CHANGED THIS LINE)
-        posts = Post.objects.filter(community__in=joined_communities).order_by('-created_at')
+        # Posts from joined communities, one keyset page at a time (?cursor=, ?limit=)
+        if TimelineService.is_enabled():
+            page = paginator.paginate_fetch(
+                lambda cursor, limit: TimelineService.home_feed(request.user, cursor, limit),
+                request
+            )
+        else:
+            community_ids = MembershipService.community_ids(request.user)
+            posts = Post.objects.filter(community_id__in=community_ids).for_feed(request.user)
+            page = paginator.paginate_queryset(posts, request, view=self)
+        post_serializer = PostSerializer(page, many=True, context={'request': request})
         
-        # Get community suggestions (not joined, popular ones)
-        suggestions = Community.objects.exclude(
-            members__user=request.user
-        ).annotate(
-            member_count=Count('members')
-        ).order_by('-member_count')[:10]
+        data = {
+            'posts': post_serializer.data,
+            'next_cursor': paginator.next_cursor,
+        }
         
-        community_serializer = CommunitySerializer(joined_communities, many=True, context={'request': request})
-        post_serializer = PostSerializer(posts, many=True, context={'request': request})
-        suggestion_serializer = CommunitySerializer(suggestions, many=True, context={'request': request})
+        # The sidebar blocks only come with the first page; they are also
+        # available on their own from communities/joined/ and communities/suggestions/
+        if paginator.cursor is None:
+            joined_communities = Community.objects.with_member_stats(request.user).filter(
+                id__in=MembershipService.community_ids(request.user)
+            )
+            suggestions = CommunityRankingService.popular_communities(request.user)
+            
+            data['joined_communities'] = CommunitySerializer(joined_communities, many=True, context={'request': request}).data
+            data['suggestions'] = CommunitySerializer(suggestions, many=True, context={'request': request}).data
         
-        return Response({
-            'joined_communities': community_serializer.data,
-            'posts': post_serializer.data,
-            'suggestions': suggestion_serializer.data
-        })
+        return Response(data)
+
+class WebsocketMetricsView(APIView):
+    """Outbound websocket queue metrics of the worker serving the request"""
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request):
+        return Response(send_queue_metrics.snapshot())
     
 class ChatMessageViewSet(viewsets.ModelViewSet):
     queryset = ChatMessage.objects.all()
@@ -502,7 +627,8 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
         return context
     
     def get_queryset(self):
-        queryset = ChatMessage.objects.all()
+        # Deleted messages only live on as tombstones in the channel sync API
+        queryset = ChatMessage.objects.filter(is_deleted=False)
         channel_id = self.request.query_params.get('channel_id')
         
         if channel_id:
@@ -510,6 +636,26 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
         
         return queryset.select_related('user', 'channel').prefetch_related('reactions', 'mentions')
     
+    def perform_destroy(self, instance):
+        ChatSyncService.tombstone(instance)
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        # Ranked full-text search over messages in the user's channels (?channel_id= to narrow)
+        offset, limit = get_offset_limit(request, default_limit=20)
+        channels = Channel.objects.filter(community_id__in=MembershipService.community_ids(request.user))
+        channel_id = request.query_params.get('channel_id')
+        if channel_id:
+            channels = channels.filter(id=channel_id)
+        ids = SearchService.search(
+            'chat_message', request.GET.get('q', ''),
+            filters={'channel_id': list(channels.values_list('id', flat=True))},
+            offset=offset, limit=limit
+        )
+        messages = SearchService.hydrate(self.get_queryset(), ids)
+        serializer = self.get_serializer(messages, many=True)
+        return Response(serializer.data)
+    
     def perform_create(self, serializer):
         # Make a copy of validated_data and remove user if it exists
         validated_data = serializer.validated_data.copy()
@@ -519,50 +665,43 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
         # Now save with the cleaned data
         message = serializer.save(user=self.request.user)
         
-        # Prepare data for WebSocket
-        message_data = {
-            'id': str(message.id),
-            'channel_id': str(message.channel.id),
-            'user': {
-                'id': str(self.request.user.id),
-                'username': self.request.user.username,
-                'profile_pic': self.request.user.profile_pic.url if self.request.user.profile_pic else None
-            },
-            'message': message.message,
-            'created_at': message.created_at.isoformat(),
-            'type': 'new_message'
-        }
+        # Same shape as messages sent over the websocket, so replay and
+        # clients treat both alike
+        message_data = chat_message_event(message)['message']
         
-        # Send via WebSocket with error handling
-        try:
-            NotificationService.send_chat_notification(str(message.channel.id), message_data)
-        except Exception as e:
-            print(f"WebSocket notification failed: {e}")
-            # Continue anyway - the message was created successfully
-        
-        # Handle mentions with error handling
-        mentioned_users = [str(user.id) for user in message.mentions.all()]
-        if mentioned_users:
-            try:
-                NotificationService.notify_mentioned_users(mentioned_users, message_data)
-            except Exception as e:
-                print(f"Mention notification failed: {e}")
-                # Continue anyway
+        # Fan out to the channel's websockets from a task once the message is
+        # committed; mentioned users were queued for notification by the serializer
+        enqueue_on_commit(send_chat_notification, str(message.channel_id), message_data)
     
     
     @action(detail=False, methods=['post'])
     def update_presence(self, request):
+        # Heartbeat for clients without a websocket; expires after PRESENCE['TTL']
         channel_id = request.data.get('channel_id')
-        is_online = request.data.get('is_online', True)
-        
-        if channel_id:
-            FirebaseService.update_user_presence(
-                str(request.user.id),
-                channel_id,
-                is_online
-            )
-            return Response({'message': 'Presence updated'})
-        return Response({'error': 'Channel ID required'}, status=400)
+        try:
+            # Form and JSON clients send "false" / "0" as well as false
+            is_online = serializers.BooleanField().to_internal_value(request.data.get('is_online', True))
+        except serializers.ValidationError:
+            return Response({'error': 'is_online must be a boolean'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not channel_id:
+            return Response({'error': 'Channel ID required'}, status=400)
+        
+        channel = Channel.objects.filter(
+            id=channel_id,
+            community_id__in=MembershipService.community_ids(request.user)
+        ).first()
+        if not channel:
+            return Response({'error': 'Channel not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        scopes = [channel_scope(channel.id), community_scope(channel.community_id)]
+        if is_online:
+            PresenceService.heartbeat(scopes, request.user.id)
+        else:
+            # Connection counts belong to the websockets; only drop the
+            # REST heartbeat
+            PresenceService.leave(scopes, request.user.id)
+        return Response({'message': 'Presence updated'})
     
     @action(detail=True, methods=['post'])
     def react(self, request, pk=None):
@@ -572,29 +711,35 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
         if reaction_type not in dict(ChatReaction.REACTION_TYPES):
             return Response({'error': 'Invalid reaction type'}, status=status.HTTP_400_BAD_REQUEST)
         
-        reaction, created = ChatReaction.objects.get_or_create(
-            message=message, 
-            user=request.user,
-            reaction_type=reaction_type
-        )
+        with transaction.atomic():
+            reaction, created = ChatReaction.objects.get_or_create(
+                message=message, 
+                user=request.user,
+                reaction_type=reaction_type
+            )
+            # A reaction is a change to the message, so delta syncs pick it up
+            change_seq = ChatMessage.allocate_seqs(message.channel_id)
+            if created:
+                CounterService.increment(message, 'reaction_count', change_seq=change_seq)
+            else:
+                reaction.delete()
+                CounterService.decrement(message, 'reaction_count', change_seq=change_seq)
         
         if not created:
-            reaction.delete()
             action_type = 'removed'
         else:
             action_type = 'added'
             
             # Create notification for message owner if it's not the reactor
-            if message.user != request.user:
-                Notification.objects.create(
-                    user=message.user,
-                    notification_type='chat_reaction',
-                    title=f"New reaction to your message",
-                    message=f"{request.user.username} reacted with {reaction_type} to your message",
-                    community=message.channel.community,
-                    channel=message.channel,
-                    chat_message=message
-                )
+            NotificationBuilder(actor=request.user).add(
+                message.user_id,
+                'chat_reaction',
+                title=f"New reaction to your message",
+                message=f"{request.user.username} reacted with {reaction_type} to your message",
+                community_id=message.channel.community_id,
+                channel=message.channel,
+                chat_message=message
+            ).save()
         
         return Response({'message': f'Reaction {action_type}'})
     
@@ -617,16 +762,15 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
             reply_message = serializer.save()
             
             # Create notification for original message owner
-            if original_message.user != request.user:
-                Notification.objects.create(
-                    user=original_message.user,
-                    notification_type='chat_reply',
-                    title=f"New reply to your message",
-                    message=f"{request.user.username} replied to your message",
-                    community=original_message.channel.community,
-                    channel=original_message.channel,
-                    chat_message=reply_message
-                )
+            NotificationBuilder(actor=request.user).add(
+                original_message.user_id,
+                'chat_reply',
+                title=f"New reply to your message",
+                message=f"{request.user.username} replied to your message",
+                community_id=original_message.channel.community_id,
+                channel=original_message.channel,
+                chat_message=reply_message
+            ).save()
             
             return Response(ChatMessageSerializer(reply_message, context={'request': request}).data)
         
@@ -639,26 +783,90 @@ class ChannelViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         # Only show channels from communities the user has joined
-        user_communities = Community.objects.filter(members__user=self.request.user)
-        return Channel.objects.filter(community__in=user_communities)
+        return Channel.objects.filter(community_id__in=MembershipService.community_ids(self.request.user))
     
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
+        """
+        Incremental sync. ?after=<seq> returns what changed since that seq
+        (new and edited messages, tombstones for deleted ones); ?before=<seq>
+        pages back through history; neither returns the latest messages.
+        Pass the returned last_seq as ?after= on the next sync.
+        """
         channel = self.get_object()
-        messages = channel.chat_messages.all().order_by('created_at')
-        page = self.paginate_queryset(messages)
+        after, before, limit = get_seq_range(request)
+        if after is not None:
+            messages, has_more, last_seq = ChatSyncService.changes(channel, after, limit)
+        else:
+            messages, has_more, last_seq = ChatSyncService.history(channel, before, limit)
         
-        if page is not None:
-            serializer = ChatMessageSerializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
+        serializer = ChatMessageSerializer(messages, many=True, context={'request': request})
+        return Response({
+            'results': serializer.data,
+            'has_more': has_more,
+            'last_seq': last_seq,
+        })
+    
+    @action(detail=True, methods=['post'])
+    def read(self, request, pk=None):
+        """Move the read cursor to `seq` or `message_id` (saved within a few seconds)"""
+        channel = self.get_object()
+        seq = request.data.get('seq')
+        message_id = request.data.get('message_id')
+        if seq is None and not message_id:
+            return Response({'error': 'seq or message_id required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            seq = int(seq) if seq is not None else None
+        except (TypeError, ValueError):
+            return Response({'error': 'seq must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if seq is not None and seq < 0:
+            return Response({'error': 'seq must not be negative'}, status=status.HTTP_400_BAD_REQUEST)
         
+        get_read_cursor_writer().record(request.user.id, channel.id, seq=seq, message_id=message_id)
+        return Response({'message': 'Read position recorded'}, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['get'])
+    def unread(self, request):
+        """Unread message counts for all of the user's channels, in one query"""
+        channels = ReadCursorService.unread_counts(self.get_queryset(), request.user)
+        return Response([
+            {
+                'channel_id': str(channel_id),
+                'community_id': str(community_id),
+                'last_read_seq': last_read_seq,
+                'unread_count': unread_count,
+            }
+            for channel_id, community_id, last_read_seq, unread_count in channels.values_list(
+                'id', 'community_id', 'last_read_seq', 'unread_count'
+            )
+        ])
+    
+    @action(detail=True, methods=['get'])
+    def search(self, request, pk=None):
+        # Ranked full-text search over this channel's messages
+        channel = self.get_object()
+        offset, limit = get_offset_limit(request, default_limit=20)
+        ids = SearchService.search(
+            'chat_message', request.GET.get('q', ''),
+            filters={'channel_id': [channel.id]},
+            offset=offset, limit=limit
+        )
+        messages = SearchService.hydrate(
+            channel.chat_messages.select_related('user', 'channel').prefetch_related('reactions', 'mentions'),
+            ids
+        )
         serializer = ChatMessageSerializer(messages, many=True, context={'request': request})
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
     def members(self, request, pk=None):
+        # Users currently online in this channel
         channel = self.get_object()
-        members = channel.community.members.filter(is_online=True)
+        online_user_ids = PresenceService.online_user_ids(channel_scope(channel.id))
+        members = User.objects.filter(
+            id__in=online_user_ids,
+            joined_communities__community_id=channel.community_id
+        )
         serializer = UserSerializer(members, many=True)
         return Response(serializer.data)
     
\ No newline at end of file
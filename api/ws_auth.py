@@ -0,0 +1,101 @@
+# api/ws_auth.py
+"""
+JWT authentication for websocket connections.
+
+The REST API authenticates with SimpleJWT access tokens, so websockets do
+the same instead of looking up a Django session. Clients pass the access
+token either as `?token=<access>` or as a `bearer.<access>` websocket
+subprotocol, offered next to a framing subprotocol (api/framing.py),
+because browsers reject a handshake that accepts none of the offered
+subprotocols.
+
+Verified claims are cached under a hash of the token, and users under
+their id, for CACHE_TTL seconds (never past the token's expiry). A burst
+of reconnects with the same token then costs no signature check and no
+query. A user's cached row is dropped whenever the user is saved.
+"""
+import hashlib
+import time
+from urllib.parse import parse_qs
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+DEFAULTS = {
+    'QUERY_PARAM': 'token',
+    'SUBPROTOCOL_PREFIX': 'bearer.',
+    'CACHE_TTL': 60,  # seconds
+}
+
+
+def ws_auth_settings():
+    return {**DEFAULTS, **getattr(settings, 'WEBSOCKET_AUTH', {})}
+
+
+def user_cache_key(user_id):
+    return f'ws_auth:user:{user_id}'
+
+
+def get_token(scope):
+    config = ws_auth_settings()
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get(config['QUERY_PARAM']):
+        return query[config['QUERY_PARAM']][0]
+    for subprotocol in scope.get('subprotocols') or []:
+        if subprotocol.startswith(config['SUBPROTOCOL_PREFIX']):
+            return subprotocol[len(config['SUBPROTOCOL_PREFIX']):]
+    return None
+
+
+def get_token_user_id(token, ttl):
+    """The user id claim of a valid access token, or None"""
+    key = f'ws_auth:token:{hashlib.sha256(token.encode()).hexdigest()}'
+    claims = cache.get(key)
+    if claims is None:
+        try:
+            access = AccessToken(token)
+        except TokenError:
+            return None
+        claims = {'user_id': access[jwt_settings.USER_ID_CLAIM], 'exp': access['exp']}
+        cache.set(key, claims, max(1, min(ttl, int(claims['exp'] - time.time()))))
+    elif claims['exp'] <= time.time():
+        return None
+    return claims['user_id']
+
+
+def get_user(user_id, ttl):
+    key = user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        User = get_user_model()
+        try:
+            user = User.objects.get(**{jwt_settings.USER_ID_FIELD: user_id})
+        except (User.DoesNotExist, ValueError):
+            return None
+        cache.set(key, user, ttl)
+    return user
+
+
+@database_sync_to_async
+def get_user_for_token(token):
+    ttl = ws_auth_settings()['CACHE_TTL']
+    user_id = get_token_user_id(token, ttl)
+    user = get_user(user_id, ttl) if user_id is not None else None
+    if user is None or not user.is_active:
+        return AnonymousUser()
+    return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Populates scope['user'] from a SimpleJWT access token"""
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        token = get_token(scope)
+        scope['user'] = await get_user_for_token(token) if token else AnonymousUser()
+        return await super().__call__(scope, receive, send)
@@ -13,7 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 import os
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decouple import config, Csv
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -214,15 +214,201 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 
 # Channels configuration (for WebSockets)
-CHANNEL_LAYERS = {
+# CHANNEL_LAYER selects the backend:
+#   memory       - single process only (default, development)
+#   redis        - channels_redis core layer; several CHANNEL_REDIS_URLS are sharded
+#   redis_pubsub - channels_redis pub/sub layer (lower latency, no delivery buffering)
+#   fake_redis   - pub/sub layer against `manage.py runfakeredis`, for multi-process tests
+CHANNEL_LAYER = config('CHANNEL_LAYER', default='memory')
+CHANNEL_REDIS_URLS = config('CHANNEL_REDIS_URLS', default='redis://localhost:6379/2', cast=Csv())
+CHANNEL_FAKE_REDIS_URL = config('CHANNEL_FAKE_REDIS_URL', default='redis://127.0.0.1:6390/0')
+
+if CHANNEL_LAYER == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': CHANNEL_REDIS_URLS,
+                'prefix': 'circleup',
+                'capacity': config('CHANNEL_LAYER_CAPACITY', default=100, cast=int),
+                'expiry': config('CHANNEL_LAYER_EXPIRY', default=60, cast=int),
+                'group_expiry': config('CHANNEL_LAYER_GROUP_EXPIRY', default=86400, cast=int),
+                'channel_capacity': {
+                    'http.request': 200,
+                    'websocket.send*': 100,
+                },
+            },
+        },
+    }
+elif CHANNEL_LAYER in ('redis_pubsub', 'fake_redis'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {
+                'hosts': CHANNEL_REDIS_URLS if CHANNEL_LAYER == 'redis_pubsub' else [CHANNEL_FAKE_REDIS_URL],
+                'prefix': 'circleup',
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            'CONFIG': {
+                'capacity': config('CHANNEL_LAYER_CAPACITY', default=100, cast=int),
+                'expiry': config('CHANNEL_LAYER_EXPIRY', default=60, cast=int),
+            },
+        },
+    }
+
+# Default cache (community ranking, websocket auth, membership ACLs). With
+# more than one worker process point it at a shared backend, e.g.
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache and
+# CACHE_LOCATION=redis://localhost:6379/5, so invalidations reach every worker.
+CACHES = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
+    }
+}
+
+# Cached {community_id: role} maps for access checks, see api/memberships.py
+MEMBERSHIP_CACHE = {
+    'TTL': 300,  # seconds
+}
+
+# Precomputed home timelines (fan-out on write), see api/timelines.py
+TIMELINES = {
+    'ENABLED': config('TIMELINES_ENABLED', default=False, cast=bool),
+    'BACKEND': config('TIMELINES_BACKEND', default='api.timelines.LocMemTimelineStore'),
+    'OPTIONS': {
+        # Only used by api.timelines.RedisTimelineStore
+        'location': config('TIMELINES_REDIS_URL', default='redis://localhost:6379/1'),
+    },
+    'MAX_LENGTH': 500,  # entries kept per user
+    'FANOUT_MAX_MEMBERS': 5000,  # bigger communities are merged in at read time
+}
+
+# Cached community popularity ranking for explore/suggestions, see api/rankings.py
+COMMUNITY_RANKING = {
+    'SIZE': 1000,  # communities kept in the ranking
+    'TTL': config('COMMUNITY_RANKING_TTL', default=600, cast=int),  # seconds
+}
+
+# Write-behind batching of websocket chat messages, see api/chat_writer.py
+CHAT_WRITER = {
+    'ENABLED': config('CHAT_WRITER_ENABLED', default=True, cast=bool),
+    'BATCH_SIZE': 200,  # messages per bulk_create
+    'FLUSH_INTERVAL': 0.05,  # seconds a batch may wait
+    'MAX_QUEUE': 10000,  # beyond this, messages are written through
+}
+
+# Typing indicator coalescing, see api/typing.py
+TYPING_INDICATORS = {
+    'BACKEND': config('TYPING_BACKEND', default='api.typing.LocMemTypingStore'),
+    'OPTIONS': {
+        # Only used by api.typing.RedisTypingStore
+        'location': config('TYPING_REDIS_URL', default='redis://localhost:6379/6'),
+    },
+    'TICK': 1.0,  # seconds between roster frames per room
+    'TTL': 6.0,  # seconds a typing_start stays valid without a refresh
+}
+
+# Websocket presence (who is online), see api/presence.py
+PRESENCE = {
+    'BACKEND': config('PRESENCE_BACKEND', default='api.presence.LocMemPresenceStore'),
+    'OPTIONS': {
+        # Only used by api.presence.RedisPresenceStore
+        'location': config('PRESENCE_REDIS_URL', default='redis://localhost:6379/3'),
+    },
+    'HEARTBEAT_INTERVAL': 30,  # seconds between client heartbeats
+    'TTL': 75,  # seconds a user stays online without a heartbeat
+}
+
+# Replay of missed chat events on websocket reconnect, see api/replay.py
+CHAT_REPLAY = {
+    'BACKEND': config('CHAT_REPLAY_BACKEND', default='api.replay.LocMemReplayBuffer'),
+    'OPTIONS': {
+        # Only used by api.replay.RedisReplayBuffer
+        'location': config('CHAT_REPLAY_REDIS_URL', default='redis://localhost:6379/4'),
     },
+    'SIZE': 200,  # events kept per room
+    'MAX_REPLAY': 500,  # bigger gaps are resynced over REST
+}
+
+# Batched read cursor writes, see api/read_cursors.py
+READ_CURSORS = {
+    'FLUSH_INTERVAL': 2.0,  # seconds read reports are coalesced before saving
+    'BATCH_SIZE': 500,  # cursors per write batch
 }
 
-# Celery configuration
+# JWT authentication for websockets, see api/ws_auth.py
+WEBSOCKET_AUTH = {
+    'QUERY_PARAM': 'token',  # ?token=<access token>
+    'SUBPROTOCOL_PREFIX': 'bearer.',  # or a `bearer.<access token>` subprotocol
+    'CACHE_TTL': 60,  # seconds verified tokens and users are cached
+}
+
+# Bounded outbound websocket queues, see api/send_queues.py
+WEBSOCKET_SEND_QUEUE = {
+    'MAX_SIZE': 1000,  # queued events at which a connection is evicted
+    'HIGH_WATER': 200,  # above this read receipts are dropped
+    'EVICT_AFTER': 10.0,  # seconds a queue may stay above HIGH_WATER
+}
+
+# Merging of like and reaction notifications, see api/notification_aggregation.py
+NOTIFICATION_AGGREGATION = {
+    'WINDOW': 24 * 3600,  # seconds an unread notification keeps taking new actors
+    'LATEST_ACTORS': 3,  # actors shown ("alice and 41 others")
+}
+
+# Cached unread notification counts, see api/notification_counts.py
+UNREAD_NOTIFICATION_COUNTS = {
+    'TTL': 300,  # seconds before a cached count is recounted from the database
+}
+
+# Notification retention, see api/notification_retention.py
+NOTIFICATION_RETENTION = {
+    'READ_DAYS': config('NOTIFICATION_READ_RETENTION_DAYS', default=30, cast=int),
+    'UNREAD_DAYS': config('NOTIFICATION_UNREAD_RETENTION_DAYS', default=180, cast=int),
+    'ARCHIVE': config('NOTIFICATION_ARCHIVE', default=None),  # 'table', 'jsonl' or unset to keep old unread ones
+    'ARCHIVE_PATH': BASE_DIR / 'archive' / 'notifications.jsonl',
+    'CHUNK_SIZE': 500,  # rows per short delete transaction
+    'PAUSE': 0.1,  # seconds between chunks
+}
+
+# Mobile push delivery of notifications, see api/push.py. The default
+# transport only records pushes in memory; set
+# PUSH_BACKEND=api.push.FirebasePushTransport to send through FCM.
+PUSH_NOTIFICATIONS = {
+    'BACKEND': config('PUSH_BACKEND', default='api.push.LocMemPushTransport'),
+    'OPTIONS': {
+        # Only used by api.push.FirebasePushTransport; unset uses Application Default Credentials
+        'credentials': config('FIREBASE_CREDENTIALS_PATH', default=None),
+    },
+    'BATCH_SIZE': 500,  # tokens per FCM multicast (FCM's maximum)
+    'CONCURRENCY': 4,  # multicasts in flight per task
+    'MAX_RETRIES': 3,  # resends of tokens that failed temporarily
+    'BACKOFF': 1.0,  # seconds before the first resend, doubled for each one after
+}
+
+# Celery configuration, tasks in api/tasks.py. Workers must share the
+# channel layer with the websocket servers, so with the in-memory layer
+# (the default) tasks run eagerly in-process. Eager tasks run in the
+# committing request, so chat fan-out, notification creation and push
+# delivery (with its retry backoff) all stay on the request path; deploy
+# with a Redis channel layer and a worker to take them off it. Tests can
+# use CELERY_BROKER_URL=memory:// with CELERY_TASK_ALWAYS_EAGER=False.
 CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default='redis://localhost:6379/0')
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=CHANNEL_LAYER == 'memory', cast=bool)
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_BEAT_SCHEDULE = {
+    'prune-notifications': {
+        'task': 'api.tasks.prune_notifications',
+        'schedule': config('NOTIFICATION_PRUNE_INTERVAL', default=6 * 3600, cast=int),  # seconds
+    },
+}
 
 # FIREBASE_CREDENTIALS_PATH = os.path.join(BASE_DIR, 'firebase-credentials.json')
 # FIREBASE_DATABASE_URL = config('FIREBASE_DATABASE_URL', default='https://circleup-chat-default-rtdb.firebaseio.com/')
@@ -2,21 +2,47 @@
 class WebSocketService {
     constructor() {
         this.chatConnections = new Map();
+        // Last message id received per channel, sent back on reconnect so
+        // the server can replay whatever was missed in between
+        this.lastSeen = new Map();
         this.notificationConnection = null;
         this.reconnectAttempts = 0;
         this.maxReconnectAttempts = 5;
+        // Keep in step with PRESENCE['HEARTBEAT_INTERVAL'] on the server
+        this.heartbeatInterval = 30000;
+    }
+    
+    // Websockets authenticate with the same JWT access token as the REST API,
+    // passed as a subprotocol next to the JSON framing one
+    protocols() {
+        const token = localStorage.getItem('access');
+        return token ? ['circleup.json', `bearer.${token}`] : ['circleup.json'];
+    }
+    
+    // Presence heartbeats; the server drops users it has not heard from
+    startHeartbeat(socket) {
+        const timer = setInterval(() => {
+            if (socket.readyState === WebSocket.OPEN) {
+                socket.send(JSON.stringify({ type: 'heartbeat' }));
+            }
+        }, this.heartbeatInterval);
+        socket.addEventListener('close', () => clearInterval(timer));
     }
     
     // Chat WebSocket
-    connectToChat(channelId, onMessage, onUserJoin, onUserLeave, onTyping) {
+    connectToChat(channelId, onMessage, onUserJoin, onUserLeave, onTyping, onResync) {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws/chat/${channelId}/`;
+        const lastSeen = this.lastSeen.get(channelId);
+        const query = lastSeen ? `?last_seen=${encodeURIComponent(lastSeen)}` : '';
+        const wsUrl = `${protocol}//${window.location.host}/ws/chat/${channelId}/${query}`;
         
-        const socket = new WebSocket(wsUrl);
+        const socket = new WebSocket(wsUrl, this.protocols());
+        let typists = new Map();
         
         socket.onopen = () => {
             console.log(`Connected to chat channel ${channelId}`);
             this.reconnectAttempts = 0;
+            this.startHeartbeat(socket);
         };
         
         socket.onmessage = (event) => {
@@ -24,8 +50,13 @@ class WebSocketService {
             
             switch(data.type) {
                 case 'chat_message':
+                    this.lastSeen.set(channelId, data.message.id);
                     onMessage(data.message);
                     break;
+                case 'resync_required':
+                    // Too much was missed to replay; refetch over REST
+                    if (onResync) onResync();
+                    break;
                 case 'user_joined':
                     onUserJoin(data);
                     break;
@@ -33,7 +64,19 @@ class WebSocketService {
                     onUserLeave(data);
                     break;
                 case 'user_typing':
-                    onTyping(data);
+                    // Older servers send one typist at a time; fold them into
+                    // a roster so onTyping always gets { users: [...] }
+                    if (data.typing) {
+                        typists.set(data.user_id, { user_id: data.user_id, username: data.username });
+                    } else {
+                        typists.delete(data.user_id);
+                    }
+                    onTyping({ users: [...typists.values()] });
+                    break;
+                case 'typing_users':
+                    // Roster of everyone currently typing, sent at most once per tick
+                    typists = new Map(data.users.map((user) => [user.user_id, user]));
+                    onTyping({ users: data.users });
                     break;
                 case 'message_read':
                     // Handle read receipts
@@ -43,7 +86,12 @@ class WebSocketService {
         
         socket.onclose = (event) => {
             console.log('Chat WebSocket disconnected');
-            this.handleReconnection(channelId, onMessage, onUserJoin, onUserLeave, onTyping);
+            if (event.code === 4008) {
+                // Evicted as a slow consumer; resume from the server's hint
+                const hint = /last_seen=(\S+)/.exec(event.reason || '');
+                if (hint && !this.lastSeen.has(channelId)) this.lastSeen.set(channelId, hint[1]);
+            }
+            this.handleReconnection(channelId, onMessage, onUserJoin, onUserLeave, onTyping, onResync);
         };
         
         socket.onerror = (error) => {
@@ -59,10 +107,11 @@ class WebSocketService {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
         const wsUrl = `${protocol}//${window.location.host}/ws/notifications/`;
         
-        this.notificationConnection = new WebSocket(wsUrl);
+        this.notificationConnection = new WebSocket(wsUrl, this.protocols());
         
         this.notificationConnection.onopen = () => {
             console.log('Connected to notifications');
+            this.startHeartbeat(this.notificationConnection);
         };
         
         this.notificationConnection.onmessage = (event) => {
@@ -105,12 +154,12 @@ class WebSocketService {
     }
     
     // Reconnection logic
-    handleReconnection(channelId, onMessage, onUserJoin, onUserLeave, onTyping) {
+    handleReconnection(channelId, onMessage, onUserJoin, onUserLeave, onTyping, onResync) {
         if (this.reconnectAttempts < this.maxReconnectAttempts) {
             this.reconnectAttempts++;
             setTimeout(() => {
                 console.log(`Reconnecting to chat ${channelId}... Attempt ${this.reconnectAttempts}`);
-                this.connectToChat(channelId, onMessage, onUserJoin, onUserLeave, onTyping);
+                this.connectToChat(channelId, onMessage, onUserJoin, onUserLeave, onTyping, onResync);
             }, 3000 * this.reconnectAttempts); // Exponential backoff
         }
     }
@@ -121,6 +170,7 @@ class WebSocketService {
         if (socket) {
             socket.close();
             this.chatConnections.delete(channelId);
+            this.lastSeen.delete(channelId);
         }
     }
     